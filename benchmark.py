@@ -0,0 +1,645 @@
+import argparse
+import heapq
+import json
+import multiprocessing
+import random
+import resource
+import time
+import tracemalloc
+from array import array
+import numpy as np
+from py2neo import Graph
+from operations import (NeighborExpander, RoadGraphSnapshot, SearchControl, astar, bfs, dijkstra, expand_query, find_street_nodes,
+                        graph_version_query as read_graph_version_query, haversine, haversine_estimates, haversine_heuristic,
+                        haversine_vector, locate_query, snapshot_nodes_query, snapshot_rels_query, street_nodes_query)
+from contractionHierarchies import ContractionHierarchy
+from osmToNeo4j import (constraint_query, delete_nodes_batch_query, delete_rels_batch_query, graph_version_query,
+                        node_query, point_index_query, rel_index_query, rel_name_index_query, rel_names_index_query,
+                        rels_query)
+from instrumentation import InstrumentedGraph, measure
+from spatialIndex import METERS_PER_DEGREE
+
+# Scalar vs vectorized haversine throughput, in distances per second
+def haversine_throughput(count=100000, seed=0):
+    rng = np.random.default_rng(seed)
+    lats = rng.uniform(37.3, 37.45, count)
+    lons = rng.uniform(-6.05, -5.9, count)
+    end_lat, end_lon = 37.38, -5.98
+
+    start_time = time.perf_counter()
+    for lat, lon in zip(lats.tolist(), lons.tolist()):
+        haversine(lat, lon, end_lat, end_lon)
+    scalar = count / (time.perf_counter() - start_time)
+
+    start_time = time.perf_counter()
+    haversine_vector(lats, lons, end_lat, end_lon)
+    vectorized = count / (time.perf_counter() - start_time)
+    return {'scalar': scalar, 'vectorized': vectorized, 'speedup': vectorized / scalar}
+
+# Same values as haversine_heuristic, but not recognized by astar, so it is called per neighbor
+def _scalar_heuristic(node_id, lat, lon, end_id, end_lat, end_lon):
+    return haversine_heuristic(node_id, lat, lon, end_id, end_lat, end_lon)
+
+# A* time with the precomputed heuristic array vs one heuristic call per pushed neighbor
+def astar_heuristic_timing(snapshot, pairs):
+    results = {}
+    for name, heuristic in (('scalar', _scalar_heuristic), ('precomputed', haversine_heuristic)):
+        start_time = time.perf_counter()
+        for start_id, end_id in pairs:
+            astar(None, start_id, end_id, snapshot=snapshot, heuristic=heuristic)
+        results[name] = (time.perf_counter() - start_time) / len(pairs) * 1000
+    return results
+
+# Reference A* that carries the whole path in every heap entry (path + [current]
+# on each expansion), the way astar tracked paths before predecessor arrays
+def _astar_path_copies(snapshot, start_id, end_id):
+    start, end = snapshot.index[start_id], snapshot.index[end_id]
+    estimates = haversine_estimates(snapshot, *snapshot.location(end_id))
+    open_set = [(estimates[start], 0, start, [])]
+    g_score = {start: 0}
+    visited = set()
+    while open_set:
+        _, current_g, current, path = heapq.heappop(open_set)
+        if current in visited:
+            continue
+        visited.add(current)
+        path = path + [current]
+        if current == end:
+            return current_g, [snapshot.node_ids[i] for i in path]
+        for neighbor, length in snapshot.neighbors(current):
+            temp_g_score = current_g + length
+            if temp_g_score < g_score.get(neighbor, float('inf')):
+                g_score[neighbor] = temp_g_score
+                heapq.heappush(open_set, (temp_g_score + estimates[neighbor], temp_g_score, neighbor, path))
+    return float('inf'), []
+
+def _astar_predecessors(snapshot, start_id, end_id):
+    return astar(None, start_id, end_id, snapshot=snapshot)
+
+memory_searches = {
+    'path_copies': _astar_path_copies,
+    'predecessors': _astar_predecessors,
+}
+
+# Nodes at opposite corners of the network (south-west and north-east)
+def cross_city_pair(snapshot):
+    corners = np.frombuffer(snapshot.lats) + np.frombuffer(snapshot.lons)
+    return snapshot.node_ids[int(np.nanargmin(corners))], snapshot.node_ids[int(np.nanargmax(corners))]
+
+# Field of /proc/self/status (Linux, reported in kB) in megabytes
+def _status_mb(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1]) / 1024
+    return float('nan')
+
+def _measure_search(name, snapshot, start_id, end_id, results):
+    search = memory_searches[name]
+    # Reset the peak RSS (VmHWM) so it only covers the search, not the snapshot loading
+    with open('/proc/self/clear_refs', 'w') as f:
+        f.write('5')
+    rss_before = _status_mb('VmRSS')
+    cost, path = search(snapshot, start_id, end_id)
+    rss_growth = _status_mb('VmHWM') - rss_before
+
+    tracemalloc.start()
+    search(snapshot, start_id, end_id)
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results.put((name, traced_peak / 2**20, rss_growth, cost, len(path)))
+
+# Peak memory of A* with path copies vs predecessor arrays on one long route, each
+# search in a fresh process: peak RSS growth during the search and peak of the
+# Python allocations made by it (tracemalloc)
+def search_memory(snapshot, start_id=None, end_id=None):
+    if start_id is None or end_id is None:
+        start_id, end_id = cross_city_pair(snapshot)
+    context = multiprocessing.get_context('spawn')
+    report = {}
+    for name in memory_searches:
+        results = context.Queue()
+        process = context.Process(target=_measure_search, args=(name, snapshot, start_id, end_id, results))
+        process.start()
+        _, traced_peak, rss_growth, cost, hops = results.get()
+        process.join()
+        report[name] = {'traced_peak_mb': round(traced_peak, 2), 'peak_rss_growth_mb': round(rss_growth, 1), 'cost': cost, 'path_nodes': hops}
+    return report
+
+# Speed limit (OSM maxspeed) and lanes of the highway classes of the synthetic networks
+HIGHWAY_CLASSES = {
+    'primary': ('50', '2'),
+    'secondary': ('40', '2'),
+    'residential': ('30', '1'),
+}
+
+# Sectors of the named radial avenues of the radial layout
+RADIAL_SECTORS = 24
+
+# Square blocks of spacing meters: every row is a "Calle" and every column an
+# "Avenida". Returns node coordinates, undirected (u, v) index pairs and the street
+# index of every pair, streets are (name, highway) tuples
+def _grid_layout(num_nodes, spacing, center, rng):
+    cols = int(np.ceil(np.sqrt(num_nodes)))
+    rows = int(np.ceil(num_nodes / cols))
+    nodes = np.arange(num_nodes)
+    row, col = nodes // cols, nodes % cols
+    degrees = spacing / METERS_PER_DEGREE
+    lats = center[0] + (row - rows / 2) * degrees
+    lons = center[1] + (col - cols / 2) * degrees / np.cos(np.radians(center[0]))
+
+    horizontal = nodes[(col < cols - 1) & (nodes + 1 < num_nodes)]
+    vertical = nodes[nodes + cols < num_nodes]
+    u = np.concatenate([horizontal, vertical])
+    v = np.concatenate([horizontal + 1, vertical + cols])
+    street = np.concatenate([row[horizontal], rows + col[vertical]])
+
+    def highway(k):
+        return 'primary' if k % 8 == 0 else 'secondary' if k % 4 == 0 else 'residential'
+    streets = [(f"Calle {r + 1}", highway(r)) for r in range(rows)] + [(f"Avenida {c + 1}", highway(c)) for c in range(cols)]
+    return lats, lons, u, v, street, streets
+
+# Concentric rings around a center node, spacing meters apart, with about one
+# node every spacing meters along each ring. Every ring node links to the closest
+# node of the inner ring; those links form RADIAL_SECTORS named radial avenues
+def _radial_layout(num_nodes, spacing, center, rng):
+    sizes = []
+    while 1 + sum(sizes) < num_nodes:
+        sizes.append(max(6, round(2 * np.pi * (len(sizes) + 1))))
+    sizes = np.array(sizes or [6])
+    starts = 1 + np.concatenate([[0], np.cumsum(sizes)[:-1]])
+
+    nodes = np.arange(1, num_nodes)
+    ring = np.searchsorted(starts, nodes, side='right') - 1
+    position = nodes - starts[ring]
+    angles = 2 * np.pi * position / sizes[ring]
+    radius = (ring + 1) * spacing / METERS_PER_DEGREE
+    lats = np.concatenate([[center[0]], center[0] + radius * np.sin(angles)])
+    lons = np.concatenate([[center[1]], center[1] + radius * np.cos(angles) / np.cos(np.radians(center[0]))])
+
+    # Along the ring, the last node closes the ring when the ring is complete
+    following = starts[ring] + (position + 1) % sizes[ring]
+    along = following < num_nodes
+    # Towards the center
+    inner = np.where(ring == 0, 0, starts[ring - 1] + position * sizes[ring - 1] // sizes[ring])
+    sector = (angles / (2 * np.pi) * RADIAL_SECTORS).astype(np.int64) % RADIAL_SECTORS
+
+    u = np.concatenate([nodes[along], nodes])
+    v = np.concatenate([following[along], inner])
+    street = np.concatenate([ring[along], len(sizes) + sector])
+    streets = ([(f"Ronda {k + 1}", 'secondary' if (k + 1) % 5 == 0 else 'residential') for k in range(len(sizes))] +
+               [(f"Radial {s + 1}", 'primary' if s % 6 == 0 else 'residential') for s in range(RADIAL_SECTORS)])
+    return lats, lons, u, v, street, streets
+
+layouts = {
+    'grid': _grid_layout,
+    'radial': _radial_layout,
+}
+
+# Synthetic road network with OSM-like ids, locations around center and segment
+# lengths from the great-circle distance plus some curvature. A fixed share of
+# the residential streets is one-way. The rows it yields are the ones osmnx gives
+# osmToNeo4j.py, so they load through the same node_query/rels_query
+class SyntheticNetwork:
+
+    def __init__(self, num_nodes, layout='grid', spacing=100, seed=0, center=(37.3891, -5.9845), oneway_fraction=0.2):
+        if layout not in layouts:
+            raise ValueError(f"Unknown layout '{layout}', expected one of {sorted(layouts)}")
+        rng = np.random.default_rng(seed)
+        lats, lons, u, v, street, self.streets = layouts[layout](num_nodes, spacing, center, rng)
+        # Up to a sixth of a block of noise on every intersection
+        jitter = spacing / METERS_PER_DEGREE / 6
+        self.lats = lats + rng.uniform(-jitter, jitter, num_nodes)
+        self.lons = lons + rng.uniform(-jitter, jitter, num_nodes)
+        self.osmids = 1000000000 + np.arange(num_nodes, dtype=np.int64)
+        self.layout = layout
+        self.seed = seed
+
+        lengths = haversine_vector(self.lats[u], self.lons[u], self.lats[v], self.lons[v]) * 1000 * rng.uniform(1.0, 1.08, len(u))
+        self.street_counts = np.bincount(np.concatenate([u, v]), minlength=num_nodes)
+
+        # One-way streets keep a single direction, chosen per street
+        oneway_streets = np.array([highway == 'residential' for _, highway in self.streets]) & (rng.random(len(self.streets)) < oneway_fraction)
+        reversed_streets = rng.random(len(self.streets)) < 0.5
+        oneway = oneway_streets[street]
+        forward = ~oneway | ~reversed_streets[street]
+        backward = ~oneway | reversed_streets[street]
+        self.src = np.concatenate([u[forward], v[backward]])
+        self.dst = np.concatenate([v[forward], u[backward]])
+        self.lengths = np.concatenate([lengths[forward], lengths[backward]])
+        self.segment_streets = np.concatenate([street[forward], street[backward]])
+        self.oneway = np.concatenate([oneway[forward], oneway[backward]])
+
+    def __len__(self):
+        return len(self.osmids)
+
+    def street_names(self):
+        return [name for name, _ in self.streets]
+
+    # Intersection rows as in the osmnx nodes GeoDataFrame, batch_size rows at a time
+    def node_rows(self, batch_size=10000):
+        for start in range(0, len(self), batch_size):
+            end = min(start + batch_size, len(self))
+            yield [{'osmid': osmid, 'y': lat, 'x': lon, 'ref': None, 'highway': None, 'street_count': count}
+                   for osmid, lat, lon, count in zip(self.osmids[start:end].tolist(), self.lats[start:end].tolist(),
+                                                     self.lons[start:end].tolist(), self.street_counts[start:end].tolist())]
+
+    # ROAD_SEGMENT rows as in the osmnx edges GeoDataFrame (geometry as WKT), batch_size rows at a time
+    def segment_rows(self, batch_size=10000):
+        lats, lons = self.lats.tolist(), self.lons.tolist()
+        for start in range(0, len(self.src), batch_size):
+            end = min(start + batch_size, len(self.src))
+            rows = []
+            for u, v, length, street, oneway in zip(self.src[start:end].tolist(), self.dst[start:end].tolist(), self.lengths[start:end].tolist(),
+                                                    self.segment_streets[start:end].tolist(), self.oneway[start:end].tolist()):
+                name, highway = self.streets[street]
+                maxspeed, lanes = HIGHWAY_CLASSES[highway]
+                rows.append({'u': int(self.osmids[u]), 'v': int(self.osmids[v]), 'osmid': 200000000 + street, 'oneway': oneway,
+                             'lanes': lanes, 'ref': None, 'name': name, 'highway': highway, 'maxspeed': maxspeed, 'length': length,
+                             'geometry': f"LINESTRING ({lons[u]} {lats[u]}, {lons[v]} {lats[v]})"})
+            yield rows
+
+    # Snapshot keyed on the osmids, for benchmarks that do not need a graph at all
+    def snapshot(self):
+        osmids = self.osmids.tolist()
+        # (maxspeed, highway, lanes) of the segments of every street
+        travel = [(HIGHWAY_CLASSES[highway][0], highway, HIGHWAY_CLASSES[highway][1]) for _, highway in self.streets]
+        return RoadGraphSnapshot.from_edges(zip(osmids, self.lats.tolist(), self.lons.tolist()),
+                                            ((osmids[u], osmids[v], length, *travel[street]) for u, v, length, street in
+                                             zip(self.src.tolist(), self.dst.tolist(), self.lengths.tolist(), self.segment_streets.tolist())))
+
+# Cypher query for the street names the find_street_nodes workload picks from
+street_names_query = '''
+    MATCH ()-[r:ROAD_SEGMENT]->()
+    WHERE r.name IS NOT NULL
+    UNWIND [] + r.name AS name
+    RETURN DISTINCT name
+'''
+
+# py2neo-style result: a list of records with the Cursor methods the repo uses
+class _Records(list):
+
+    def data(self):
+        return list(self)
+
+    def evaluate(self, field=0):
+        return list(self[0].values())[field] if self else None
+
+    def single(self):
+        return self[0] if self else None
+
+# In-process stand-in for a Neo4j road graph. It answers the Cypher queries of
+# osmToNeo4j.py and operations.py that the benchmarks send (by query text, like
+# a prepared statement), with ids assigned in creation order as id() would
+class InMemoryGraph:
+
+    def __init__(self):
+        self.handlers = {
+            constraint_query: self._no_op,
+            rel_index_query: self._no_op,
+            point_index_query: self._no_op,
+            rel_name_index_query: self._no_op,
+            rel_names_index_query: self._no_op,
+            delete_rels_batch_query: self._delete_rels,
+            delete_nodes_batch_query: self._delete_nodes,
+            graph_version_query: self._bump_version,
+            read_graph_version_query: self._version,
+            node_query: self._merge_nodes,
+            rels_query: self._merge_rels,
+            street_names_query: self._street_names,
+            snapshot_nodes_query: self._snapshot_nodes,
+            snapshot_rels_query: self._snapshot_rels,
+            expand_query: self._expand,
+            locate_query: self._locate,
+            street_nodes_query: self._street_nodes,
+        }
+        self.version = 0
+        # Intersections by id(): osmid and location
+        self.osmids, self.index = [], {}
+        self.lats, self.lons = array('d'), array('d')
+        # ROAD_SEGMENTs by position, with the outgoing positions of every intersection
+        self.src, self.dst, self.lengths = array('q'), array('q'), array('d')
+        self.osmid, self.names = [], []
+        self.max_speeds, self.highways, self.lanes = [], [], []
+        self.outgoing = []
+        self.by_name = None  # street name -> ids of the intersections it starts from, built on demand
+
+    def __len__(self):
+        return len(self.osmids)
+
+    def run(self, cypher, parameters=None, **kwparameters):
+        if cypher not in self.handlers:
+            raise NotImplementedError(f"InMemoryGraph does not understand the query {cypher.strip()[:60]!r}")
+        return _Records(self.handlers[cypher](dict(parameters or {}, **kwparameters)))
+
+    def _no_op(self, params):
+        return []
+
+    # Deletes everything at once instead of $limit at a time
+    def _delete_rels(self, params):
+        total = len(self.src)
+        self.src, self.dst, self.lengths = array('q'), array('q'), array('d')
+        self.osmid, self.names = [], []
+        self.max_speeds, self.highways, self.lanes = [], [], []
+        self.outgoing = [[] for _ in self.osmids]
+        self.by_name = None
+        return [{'total': total}]
+
+    def _delete_nodes(self, params):
+        total = len(self.osmids)
+        self.osmids, self.index = [], {}
+        self.lats, self.lons = array('d'), array('d')
+        self._delete_rels(params)
+        return [{'total': total}]
+
+    def _bump_version(self, params):
+        self.version += 1
+        return [{'version': self.version}]
+
+    # No version before the first load, like the OPTIONAL MATCH on a missing GraphMeta node
+    def _version(self, params):
+        return [{'version': self.version or None}]
+
+    def _merge_nodes(self, params):
+        total = 0
+        for row in params['rows']:
+            if row['osmid'] is None:
+                continue
+            total += 1
+            if row['osmid'] not in self.index:
+                self.index[row['osmid']] = len(self.osmids)
+                self.osmids.append(row['osmid'])
+                self.lats.append(row['y'])
+                self.lons.append(row['x'])
+                self.outgoing.append([])
+        return [{'total': total}]
+
+    def _merge_rels(self, params):
+        total = 0
+        for road in params['rows']:
+            u, v = self.index.get(road['u']), self.index.get(road['v'])
+            if u is None or v is None:
+                continue
+            total += 1
+            for segment in self.outgoing[u]:
+                if self.dst[segment] == v and self.osmid[segment] == road['osmid']:
+                    break
+            else:
+                segment = len(self.src)
+                self.src.append(u)
+                self.dst.append(v)
+                self.lengths.append(0.0)
+                self.osmid.append(road['osmid'])
+                self.names.append(None)
+                self.max_speeds.append(None)
+                self.highways.append(None)
+                self.lanes.append(None)
+                self.outgoing[u].append(segment)
+            self.lengths[segment] = float(road['length'])
+            self.names[segment] = road['name']
+            self.max_speeds[segment] = road['maxspeed']
+            self.highways[segment] = road['highway']
+            self.lanes[segment] = road['lanes']
+        self.by_name = None
+        return [{'total': total}]
+
+    def _street_names(self, params):
+        if self.by_name is None:
+            self.by_name = {}
+            for src, name in zip(self.src, self.names):
+                for street in name if isinstance(name, list) else [name]:
+                    if street is not None:
+                        self.by_name.setdefault(street, set()).add(src)
+        return [{'name': name} for name in self.by_name]
+
+    def _snapshot_nodes(self, params):
+        return [{'id': i, 'lat': lat, 'lon': lon} for i, (lat, lon) in enumerate(zip(self.lats, self.lons))]
+
+    def _snapshot_rels(self, params):
+        return [{'src': src, 'dst': dst, 'length': length, 'max_speed': max_speed, 'highway': highway, 'lanes': lanes}
+                for src, dst, length, max_speed, highway, lanes in zip(self.src, self.dst, self.lengths, self.max_speeds, self.highways, self.lanes)]
+
+    def _expand(self, params):
+        return [{'src': src, 'dst': self.dst[segment], 'length': self.lengths[segment], 'max_speed': self.max_speeds[segment],
+                 'highway': self.highways[segment], 'lanes': self.lanes[segment], 'lat': self.lats[self.dst[segment]], 'lon': self.lons[self.dst[segment]]}
+                for src in params['ids'] if 0 <= src < len(self.outgoing) for segment in self.outgoing[src]]
+
+    def _locate(self, params):
+        return [{'id': i, 'lat': self.lats[i], 'lon': self.lons[i]} for i in params['ids'] if 0 <= i < len(self.osmids)]
+
+    def _street_nodes(self, params):
+        self._street_names(params)
+        return [{'street': street, 'id': i, 'lat': self.lats[i], 'lon': self.lons[i]}
+                for street in dict.fromkeys(params['names']) for i in sorted(self.by_name.get(street, ()))]
+
+# neo4j driver-style front of an InMemoryGraph, so the osmToNeo4j.py Bolt import
+# (sessions, execute_write transaction functions) runs in process. Records are
+# plain dicts, as record.data() would return them
+class InMemoryDriver:
+
+    def __init__(self, graph=None):
+        self.graph = graph if graph is not None else InMemoryGraph()
+
+    def session(self):
+        return _InMemorySession(self.graph)
+
+    def close(self):
+        pass
+
+class _InMemorySession:
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def run(self, query, parameters=None, **kwparameters):
+        return self.graph.run(query, parameters, **kwparameters)
+
+    def execute_write(self, transaction_function, *args, **kwargs):
+        return transaction_function(self, *args, **kwargs)
+
+    execute_read = execute_write
+
+# Wipe the graph and load a synthetic network through the osmToNeo4j.py queries, over
+# a py2neo Graph (local Neo4j) or an InMemoryGraph. Returns the load time in seconds
+def load_network(graph, network, batch_size=10000):
+    start_time = time.perf_counter()
+    for query in (delete_rels_batch_query, delete_nodes_batch_query):
+        while graph.run(query, limit=batch_size).evaluate():
+            pass
+    for query in (constraint_query, rel_index_query, point_index_query, rel_name_index_query, rel_names_index_query):
+        graph.run(query)
+    for rows in network.node_rows(batch_size):
+        graph.run(node_query, rows=rows)
+    for rows in network.segment_rows(batch_size):
+        graph.run(rels_query, rows=rows)
+    graph.run(graph_version_query)
+    return time.perf_counter() - start_time
+
+def _summary(values):
+    values = np.asarray(values, dtype=np.float64)
+    if not len(values):
+        return None
+    return {'mean': round(float(values.mean()), 3), 'p50': round(float(np.percentile(values, 50)), 3),
+            'p90': round(float(np.percentile(values, 90)), 3), 'p99': round(float(np.percentile(values, 99)), 3),
+            'max': round(float(values.max()), 3)}
+
+# Time query(item, control) for every item: latency percentiles in milliseconds,
+# settled nodes (counted by the SearchControl), database calls and rows, time
+# spent in the database (through an InstrumentedGraph), and the traced peak of
+# the Python allocations of one extra untimed pass over the first memory_items
+# items (tracemalloc slows the queries down)
+def run_workload(query, items, searches=True, memory_items=5):
+    latencies, settled, db_calls, rows, db_times = [], [], [], [], []
+    found = 0
+    for item in items:
+        control = SearchControl()
+        with measure('benchmark') as metrics:
+            result = query(item, control)
+        latencies.append(metrics.phases['total'] * 1000)
+        settled.append(control.settled)
+        db_calls.append(metrics.db_calls)
+        rows.append(metrics.rows)
+        db_times.append((metrics.phases.get('db_run', 0) + metrics.phases.get('db_fetch', 0)) * 1000)
+        found += bool(result[1] if searches else result)
+
+    tracemalloc.start()
+    for item in items[:memory_items]:
+        query(item, SearchControl())
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'queries': len(items),
+        'found': found,
+        'latency_ms': _summary(latencies),
+        'db_ms': _summary(db_times),
+        'settled': _summary(settled) if searches else None,
+        'round_trips': {'total': int(sum(db_calls)), 'mean': sum(db_calls) / len(items) if items else 0},
+        'rows': {'total': int(sum(rows)), 'mean': sum(rows) / len(items) if items else 0},
+        'traced_peak_mb': round(traced_peak / 2**20, 2),
+    }
+
+# Fixed-seed workloads over the graph: snapshot loading, Dijkstra/A*/BFS on the
+# snapshot (Dijkstra and A* also over the rush hour travel times), with ch the
+# contraction hierarchy build and its queries on the same pairs, A*/BFS
+# expanding the frontier through the database (cold adjacency cache per query,
+# at most db_queries of them) and street lookups
+def run_suite(graph, queries=100, db_queries=10, seed=42, street_names=None, ch=True):
+    graph = graph if isinstance(graph, InstrumentedGraph) else InstrumentedGraph(graph)
+    rng = random.Random(seed)
+    report = {}
+
+    snapshots = []
+    report['snapshot_load'] = run_workload(lambda _, control: snapshots.append(RoadGraphSnapshot(graph)) or True,
+                                           [None] * 3, searches=False, memory_items=1)
+    snapshot = snapshots[0]
+    pairs = [(rng.choice(snapshot.node_ids), rng.choice(snapshot.node_ids)) for _ in range(queries)]
+
+    searches = {
+        'dijkstra': lambda pair, control: dijkstra(None, *pair, snapshot=snapshot, control=control),
+        'astar': lambda pair, control: astar(None, *pair, snapshot=snapshot, control=control),
+        'bfs': lambda pair, control: bfs(None, *pair, snapshot=snapshot, control=control),
+        'dijkstra_time': lambda pair, control: dijkstra(None, *pair, snapshot=snapshot, weight='time@8', control=control),
+        'astar_time': lambda pair, control: astar(None, *pair, snapshot=snapshot, weight='time@8', control=control),
+    }
+    for name, search in searches.items():
+        report[name] = run_workload(search, pairs)
+
+    if ch:
+        # One timed build: the traced pass would contract the network a second time
+        hierarchies = []
+        report['ch_build'] = run_workload(lambda _, control: hierarchies.append(ContractionHierarchy.build(snapshot)) or True,
+                                          [None], searches=False, memory_items=0)
+        hierarchy = hierarchies[0]
+        report['ch'] = run_workload(lambda pair, control: hierarchy.query(*pair, control=control), pairs)
+
+    expander = NeighborExpander(graph)
+
+    def batched(search):
+        def query(pair, control):
+            expander.clear()
+            return search(graph, *pair, expander=expander, control=control)
+        return query
+    report['astar_batched'] = run_workload(batched(astar), pairs[:db_queries])
+    report['bfs_batched'] = run_workload(batched(bfs), pairs[:db_queries])
+
+    if street_names is None:
+        street_names = sorted(record['name'] for record in graph.run(street_names_query))
+    streets = [rng.choice(street_names) for _ in range(queries)] if street_names else []
+    report['find_street_nodes'] = run_workload(lambda street, _: find_street_nodes(graph, street), streets, searches=False)
+    return report
+
+# Build (or reuse) the graph, run the suite and return the JSON-ready report
+def benchmark(nodes=10000, layout='grid', seed=42, queries=100, db_queries=10, uri=None, load=False, batch_size=10000, ch=True):
+    network = None
+    load_seconds = None
+    if uri is None or load:
+        network = SyntheticNetwork(nodes, layout, seed=seed)
+    graph = Graph(uri, auth=None) if uri is not None else InMemoryGraph()
+    if network is not None:
+        load_seconds = load_network(graph, network, batch_size)
+
+    workloads = run_suite(graph, queries, db_queries, seed, network.street_names() if network is not None else None, ch)
+    return {
+        'graph': {
+            'backend': 'neo4j' if uri is not None else 'memory',
+            'uri': uri,
+            'layout': layout if network is not None else None,
+            'nodes': len(network) if network is not None else None,
+            'segments': len(network.src) if network is not None else None,
+            'seed': seed,
+            'load_seconds': round(load_seconds, 3) if load_seconds is not None else None,
+        },
+        'workloads': workloads,
+        # Linux reports ru_maxrss in kB
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+# Main code
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the operations.py searches on a synthetic road network")
+    parser.add_argument('--nodes', type=int, default=10000, help="intersections of the synthetic network (1k to 1M)")
+    parser.add_argument('--layout', choices=sorted(layouts), default='grid')
+    parser.add_argument('--seed', type=int, default=42, help="seed of the network and of the query workloads")
+    parser.add_argument('--queries', type=int, default=100, help="queries per snapshot search and street workload")
+    parser.add_argument('--db-queries', type=int, default=10, help="queries per workload that expands through the database")
+    parser.add_argument('--uri', help="benchmark a local Neo4j server (e.g. bolt://localhost:7687) instead of the in-process graph")
+    parser.add_argument('--load', action='store_true', help="with --uri, wipe the database and load the synthetic network first")
+    parser.add_argument('--batch-size', type=int, default=10000, help="rows per load query")
+    parser.add_argument('--no-ch', action='store_true', help="skip the contraction hierarchy build and queries (slow on large networks)")
+    parser.add_argument('--output', metavar='PATH', help="write the JSON report to PATH instead of stdout")
+    parser.add_argument('--micro', action='store_true', help="run the haversine, A* heuristic and search memory micro benchmarks instead")
+    args = parser.parse_args()
+
+    if args.micro:
+        throughput = haversine_throughput()
+        print(f"haversine: {throughput['scalar']:,.0f} scalar vs {throughput['vectorized']:,.0f} vectorized distances/s "
+              f"({throughput['speedup']:.0f}x)")
+
+        if args.uri is not None:
+            snapshot = RoadGraphSnapshot(Graph(args.uri, auth=None))
+        else:
+            snapshot = SyntheticNetwork(args.nodes, args.layout, seed=args.seed).snapshot()
+
+        # Fixed-seed random query pairs
+        rng = random.Random(args.seed)
+        pairs = [(rng.choice(snapshot.node_ids), rng.choice(snapshot.node_ids)) for _ in range(args.queries)]
+        timing = astar_heuristic_timing(snapshot, pairs)
+        print(f"astar: {timing['scalar']:.2f} ms with scalar heuristic calls, {timing['precomputed']:.2f} ms precomputed")
+
+        for name, result in search_memory(snapshot).items():
+            print(f"{name}: {result['traced_peak_mb']} MB allocated at peak, {result['peak_rss_growth_mb']} MB peak RSS growth, "
+                  f"{result['path_nodes']} nodes on the route")
+    else:
+        report = benchmark(args.nodes, args.layout, args.seed, args.queries, args.db_queries, args.uri, args.load, args.batch_size,
+                           not args.no_ch)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2)
+        else:
+            print(json.dumps(report, indent=2))
@@ -0,0 +1,292 @@
+import heapq
+import pickle
+import time
+from array import array
+from py2neo import Graph
+from instrumentation import instrumented
+from operations import RoadGraphSnapshot, _csr, dijkstra
+
+# Version of the pickled hierarchy file, bump it when the stored layout changes
+CH_FILE_VERSION = 1
+
+# Bounds of the witness searches that estimate the shortcuts of a node while
+# ordering the contraction, looser than those of the contraction itself
+SIMULATION_HOPS = 2
+SIMULATION_SETTLED = 20
+
+# Contraction Hierarchy over the Intersection/ROAD_SEGMENT network.
+# Every node gets a rank; the upward graph holds the edges (original or
+# shortcut) from a node to higher ranked nodes, the downward graph holds the
+# reversed edges into a node from higher ranked nodes. A shortcut remembers the
+# contracted node it bypasses (middle) so paths can be unpacked again
+class ContractionHierarchy:
+
+    def __init__(self, node_ids, rank, up, down):
+        self.node_ids = node_ids
+        self.index = {node_id: i for i, node_id in enumerate(node_ids)}
+        self.rank = rank
+        self.up_offsets, self.up_targets, self.up_weights, self.up_middles = up
+        self.down_offsets, self.down_targets, self.down_weights, self.down_middles = down
+
+        # (u, v) -> middle node of the cheapest hierarchy edge u -> v, used to unpack shortcuts
+        self.middles = {}
+        for u in range(len(node_ids)):
+            for edge in range(self.up_offsets[u], self.up_offsets[u + 1]):
+                self._remember(u, self.up_targets[edge], self.up_weights[edge], self.up_middles[edge])
+            for edge in range(self.down_offsets[u], self.down_offsets[u + 1]):
+                self._remember(self.down_targets[edge], u, self.down_weights[edge], self.down_middles[edge])
+
+    def _remember(self, u, v, weight, middle):
+        if (u, v) not in self.middles or weight < self.middles[(u, v)][0]:
+            self.middles[(u, v)] = (weight, middle)
+
+    # Contract a snapshot. Nodes are contracted by increasing priority: edge
+    # difference (shortcuts added minus edges removed), plus deleted neighbours
+    # (already contracted neighbours) and level (depth in the hierarchy so far),
+    # which spread the contraction evenly over the network. Witness searches are
+    # bounded to hop_limit segments and settle_limit settled nodes; a witness they
+    # miss only adds a superfluous shortcut, never a wrong distance. Priorities
+    # are estimated with a cheaper witness search (SIMULATION_HOPS and
+    # SIMULATION_SETTLED) and lazily updated: a popped node whose priority changed
+    # goes back into the queue
+    @classmethod
+    def build(cls, snapshot, hop_limit=10, settle_limit=200):
+        n = len(snapshot)
+        out_edges = [dict() for _ in range(n)]  # u -> {v: (weight, middle)} in the remaining graph
+        in_edges = [dict() for _ in range(n)]   # v -> {u: (weight, middle)} in the remaining graph
+        for u in range(n):
+            for v, weight in snapshot.neighbors(u):
+                if u != v and (v not in out_edges[u] or weight < out_edges[u][v][0]):
+                    out_edges[u][v] = (weight, -1)
+                    in_edges[v][u] = (weight, -1)
+
+        contracted = [False] * n
+        contracted_neighbors = [0] * n
+        level = [0] * n
+        rank = array('q', [0]) * n
+        up_edges = []
+        down_edges = []
+
+        # Distance from source to the targets (a set) without passing through the
+        # skipped node, over at most hop_limit segments and up to max_distance
+        def witness_distances(source, skipped, targets, max_distance, hop_limit, settle_limit):
+            distances = {source: 0}
+            queue = [(0, 0, source)]
+            remaining = len(targets)
+            settled = 0
+            while queue:
+                distance, hops, current = heapq.heappop(queue)
+                if distance > distances[current]:
+                    continue
+                if current in targets:
+                    remaining -= 1
+                    if not remaining:
+                        break
+                settled += 1
+                if settled >= settle_limit:
+                    break
+                if hops >= hop_limit:
+                    continue
+                hops += 1
+                for neighbor, edge in out_edges[current].items():
+                    new_distance = distance + edge[0]
+                    if new_distance <= max_distance and new_distance < distances.get(neighbor, max_distance + 1) and neighbor != skipped:
+                        distances[neighbor] = new_distance
+                        heapq.heappush(queue, (new_distance, hops, neighbor))
+            return distances
+
+        # Shortcuts (u, w, weight) needed to contract node v
+        def shortcuts_for(v, hop_limit, settle_limit):
+            shortcuts = []
+            targets = out_edges[v]
+            if not targets:
+                return shortcuts
+            max_out = max(weight for weight, _ in targets.values())
+            for u, (in_weight, _) in in_edges[v].items():
+                distances = witness_distances(u, v, targets.keys() - {u}, in_weight + max_out, hop_limit, settle_limit)
+                for w, (out_weight, _) in targets.items():
+                    if w != u and in_weight + out_weight < distances.get(w, float('inf')):
+                        shortcuts.append((u, w, in_weight + out_weight))
+            return shortcuts
+
+        def priority(v):
+            edge_difference = len(shortcuts_for(v, SIMULATION_HOPS, SIMULATION_SETTLED)) - len(in_edges[v]) - len(out_edges[v])
+            return 4 * edge_difference + contracted_neighbors[v] + level[v]
+
+        queue = [(priority(v), v) for v in range(n)]
+        heapq.heapify(queue)
+        next_rank = 0
+        while queue:
+            node_priority, v = heapq.heappop(queue)
+            if contracted[v]:
+                continue
+            # Lazy update: recompute the priority and postpone the node if it changed
+            current_priority = priority(v)
+            if current_priority != node_priority:
+                heapq.heappush(queue, (current_priority, v))
+                continue
+
+            for u, w, weight in shortcuts_for(v, hop_limit, settle_limit):
+                if w not in out_edges[u] or weight < out_edges[u][w][0]:
+                    out_edges[u][w] = (weight, v)
+                    in_edges[w][u] = (weight, v)
+
+            # Remaining edges of v all lead to higher ranked nodes
+            neighbors = set(out_edges[v]) | set(in_edges[v])
+            for w, (weight, middle) in out_edges[v].items():
+                up_edges.append((v, w, weight, middle))
+                del in_edges[w][v]
+            for u, (weight, middle) in in_edges[v].items():
+                down_edges.append((v, u, weight, middle))
+                del out_edges[u][v]
+            out_edges[v] = {}
+            in_edges[v] = {}
+            for neighbor in neighbors:
+                contracted_neighbors[neighbor] += 1
+                level[neighbor] = max(level[neighbor], level[v] + 1)
+
+            contracted[v] = True
+            rank[v] = next_rank
+            next_rank += 1
+
+        return cls(list(snapshot.node_ids), rank, _csr_with_middles(n, up_edges), _csr_with_middles(n, down_edges))
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump({
+                'version': CH_FILE_VERSION,
+                'node_ids': self.node_ids,
+                'rank': self.rank,
+                'up': (self.up_offsets, self.up_targets, self.up_weights, self.up_middles),
+                'down': (self.down_offsets, self.down_targets, self.down_weights, self.down_middles),
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+        if data.get('version') != CH_FILE_VERSION:
+            raise ValueError(f"Unsupported hierarchy file version {data.get('version')} in {path}, rebuild it")
+        return cls(data['node_ids'], data['rank'], data['up'], data['down'])
+
+    # Upward bidirectional Dijkstra with stall-on-demand, returns (cost, path of
+    # Neo4j node ids). A node is stalled (not expanded) when a higher ranked node
+    # already reached in the same direction gives it a shorter distance: its
+    # distance is not a shortest one, so nothing reached through it can be
+    def query(self, start_id, end_id, control=None):
+        if start_id not in self.index or end_id not in self.index:
+            return float('inf'), []
+        start, end = self.index[start_id], self.index[end_id]
+
+        # Per direction: (offsets, targets, weights, distances, predecessors, queue, stall offsets, targets, weights).
+        # The forward search goes up the upward edges; an edge w -> v from a higher ranked w is a
+        # downward edge of v, so those stall it. The backward search mirrors this
+        forward = (self.up_offsets, self.up_targets, self.up_weights, {start: 0}, {start: -1}, [(0, start)],
+                   self.down_offsets, self.down_targets, self.down_weights)
+        backward = (self.down_offsets, self.down_targets, self.down_weights, {end: 0}, {end: -1}, [(0, end)],
+                    self.up_offsets, self.up_targets, self.up_weights)
+
+        best = float('inf')
+        meeting = -1
+        while forward[5] or backward[5]:
+            for direction, other in ((forward, backward), (backward, forward)):
+                offsets, targets, weights, distances, predecessors, queue, stall_offsets, stall_targets, stall_weights = direction
+                if not queue:
+                    continue
+                distance, current = heapq.heappop(queue)
+                if distance > distances[current]:
+                    continue
+                if distance >= best:
+                    queue.clear()  # Nothing better can be found in this direction
+                    continue
+                if current in other[3] and distance + other[3][current] < best:
+                    best = distance + other[3][current]
+                    meeting = current
+                stalled = False
+                for edge in range(stall_offsets[current], stall_offsets[current + 1]):
+                    higher = stall_targets[edge]
+                    if higher in distances and distances[higher] + stall_weights[edge] < distance:
+                        stalled = True
+                        break
+                if stalled:
+                    continue
+                if control is not None:
+                    control.step()
+                for edge in range(offsets[current], offsets[current + 1]):
+                    neighbor = targets[edge]
+                    new_distance = distance + weights[edge]
+                    if new_distance < distances.get(neighbor, float('inf')):
+                        distances[neighbor] = new_distance
+                        predecessors[neighbor] = current
+                        heapq.heappush(queue, (new_distance, neighbor))
+
+        if meeting == -1:
+            return float('inf'), []
+
+        # Hierarchy path start -> meeting -> end, then unpack every shortcut
+        hierarchy_path = []
+        current = meeting
+        while current != -1:
+            hierarchy_path.append(current)
+            current = forward[4][current]
+        hierarchy_path.reverse()
+        current = backward[4][meeting]
+        while current != -1:
+            hierarchy_path.append(current)
+            current = backward[4][current]
+
+        path = [hierarchy_path[0]]
+        for u, v in zip(hierarchy_path, hierarchy_path[1:]):
+            path.extend(self._unpack(u, v))
+        return best, [self.node_ids[i] for i in path]
+
+    # Original nodes after u on the hierarchy edge u -> v (v included)
+    def _unpack(self, u, v):
+        nodes = []
+        stack = [(u, v)]
+        while stack:
+            a, b = stack.pop()
+            middle = self.middles[(a, b)][1]
+            if middle == -1:
+                nodes.append(b)
+            else:
+                stack.append((middle, b))
+                stack.append((a, middle))
+        return nodes
+
+# CSR arrays for (src, dst, weight, middle) edges
+def _csr_with_middles(num_nodes, edges):
+    edges.sort(key=lambda edge: edge[0])
+    offsets, targets, weights = _csr(num_nodes, [(src, dst, weight) for src, dst, weight, _ in edges])
+    middles = array('q', [middle for _, _, _, middle in edges])
+    return offsets, targets, weights, middles
+
+# Same (cost, path) contract as the engines in operations.py
+@instrumented('ch_shortest_path', search=True)
+def ch_shortest_path(graph, start_id, end_id, hierarchy, control=None):
+    return hierarchy.query(start_id, end_id, control)
+
+# Main code
+if __name__ == "__main__":
+    # Connect to Neo4j
+    graph = Graph("bolt://localhost:7687", auth=None)
+    snapshot = RoadGraphSnapshot(graph)
+
+    # Preprocess once and store the hierarchy next to the scripts
+    start_time = time.perf_counter()
+    hierarchy = ContractionHierarchy.build(snapshot)
+    print(f"Contracted {len(snapshot)} intersections in {time.perf_counter() - start_time:.1f} s")
+    hierarchy.save('road_network.ch')
+    hierarchy = ContractionHierarchy.load('road_network.ch')
+
+    start_node_id = 4566
+    end_node_id = 766
+
+    start_time = time.perf_counter()
+    cost, path = hierarchy.query(start_node_id, end_node_id)
+    print(f"CH query: {cost} meters in {(time.perf_counter() - start_time) * 1000:.3f} ms")
+    print("Shortest path:", path)
+
+    start_time = time.perf_counter()
+    cost, path = dijkstra(graph, start_node_id, end_node_id, snapshot=snapshot)
+    print(f"Dijkstra: {cost} meters in {(time.perf_counter() - start_time) * 1000:.3f} ms")
@@ -0,0 +1,334 @@
+import argparse
+import bisect
+import mmap
+import os
+import struct
+import time
+import zlib
+import numpy as np
+from py2neo import Graph
+from operations import RoadGraphSnapshot, graph_version
+from travelTime import MAX_SPEED, free_flow_speeds
+
+# Routing graph file: the CSR arrays of a RoadGraphSnapshot (with the speeds and
+# classes of the travel time weights) plus the osmid of every node and the street
+# name of every edge, memory-mapped so that every process
+# opening the same file shares its pages and starts without loading anything.
+#
+# Layout (little endian): header, section directory, header CRC32, then the
+# sections, each one aligned to SECTION_ALIGNMENT bytes. Nodes are sorted by id,
+# so the position of an id is found by binary search
+MAGIC = b'ROADGRPH'
+# Version 2 added the speeds and classes of the travel time weights
+FORMAT_VERSION = 2
+SECTION_ALIGNMENT = 64
+
+# magic, format version, section count, nodes, edges, graph version (-1 if unknown)
+_header = struct.Struct('<8sIIqqq')
+# name, array typecode, offset, item count, CRC32 of the data
+_section = struct.Struct('<16s8sQQI4x')
+_crc = struct.Struct('<I')
+# Item size of every array typecode used by the sections
+_itemsizes = {typecode: struct.calcsize(typecode) for typecode in 'bBiqd'}
+
+# Cypher queries to export the road network with the osmid of every node and the
+# name of every segment
+graph_file_nodes_query = '''
+    MATCH (i:Intersection)
+    RETURN id(i) AS id, i.osmid AS osmid, i.location.latitude AS lat, i.location.longitude AS lon
+'''
+
+graph_file_rels_query = '''
+    MATCH (u:Intersection)-[r:ROAD_SEGMENT]->(v:Intersection)
+    RETURN id(u) AS src, id(v) AS dst, r.length AS length, r.name AS name,
+        r.max_speed AS max_speed, r.highway AS highway, r.lanes AS lanes
+'''
+
+# Street name as one string: osmnx gives a list for merged ways, NaN when missing
+def _street_name(name):
+    if isinstance(name, (list, tuple)):
+        return ', '.join(str(part) for part in name)
+    if name is None or name != name:
+        return None
+    return str(name)
+
+# Write a graph file from node (id, osmid, lat, lon) and edge (src, dst, length,
+# name, max_speed, highway, lanes) columns. The file is written next to path and
+# renamed, readers of the old file keep their mapping
+def write_graph_file(path, node_ids, lats, lons, src, dst, lengths, osmids=None, names=None, version=None,
+                     max_speeds=None, highways=None, lanes=None):
+    node_ids = np.asarray(node_ids, dtype=np.int64)
+    order = np.argsort(node_ids, kind='stable')
+    node_ids = node_ids[order]
+    if len(node_ids) > 1 and np.any(node_ids[1:] == node_ids[:-1]):
+        raise ValueError("Node ids must be unique")
+    lats = np.asarray(lats, dtype=np.float64)[order]
+    lons = np.asarray(lons, dtype=np.float64)[order]
+    osmids = node_ids if osmids is None else np.asarray(osmids, dtype=np.int64)[order]
+
+    # Edge endpoints as node positions
+    src = np.asarray(src, dtype=np.int64)
+    dst = np.asarray(dst, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.float64)
+    src_positions = np.minimum(np.searchsorted(node_ids, src), max(len(node_ids) - 1, 0))
+    dst_positions = np.minimum(np.searchsorted(node_ids, dst), max(len(node_ids) - 1, 0))
+    if len(src) and (np.any(node_ids[src_positions] != src) or np.any(node_ids[dst_positions] != dst)):
+        raise ValueError("Every edge must connect two of the given nodes")
+
+    # Forward and reverse CSR; a stable sort keeps the input order of the edges
+    # of every node, as RoadGraphSnapshot does
+    forward = np.argsort(src_positions, kind='stable')
+    backward = np.argsort(dst_positions, kind='stable')
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(src_positions, minlength=len(node_ids)))]).astype(np.int64)
+    rev_offsets = np.concatenate([[0], np.cumsum(np.bincount(dst_positions, minlength=len(node_ids)))]).astype(np.int64)
+
+    # Street names as a UTF-8 string table, edges refer to them by number (-1 for none)
+    table = {}
+    name_ids = np.full(len(src), -1, dtype=np.int32)
+    if names is not None:
+        for edge, name in enumerate(names):
+            name = _street_name(name)
+            if name is not None:
+                name_ids[edge] = table.setdefault(name, len(table))
+    encoded = [name.encode('utf-8') for name in table]
+
+    # Free-flow speeds and highway classes, from whichever attributes are given
+    columns = [[None] * len(src) if column is None else list(column) for column in (max_speeds, highways, lanes)]
+    speeds, classes = free_flow_speeds(list(zip(*columns)))
+    name_offsets = np.concatenate([[0], np.cumsum([len(name) for name in encoded], dtype=np.int64)]).astype(np.int64)
+
+    sections = [
+        ('node_ids', 'q', node_ids),
+        ('osmids', 'q', osmids),
+        ('osmid_order', 'q', np.argsort(osmids, kind='stable').astype(np.int64)),
+        ('lats', 'd', lats),
+        ('lons', 'd', lons),
+        ('offsets', 'q', offsets),
+        ('targets', 'q', dst_positions[forward]),
+        ('weights', 'd', lengths[forward]),
+        ('rev_offsets', 'q', rev_offsets),
+        ('rev_targets', 'q', src_positions[backward]),
+        ('rev_weights', 'd', lengths[backward]),
+        ('speeds', 'd', speeds[forward]),
+        ('rev_speeds', 'd', speeds[backward]),
+        ('classes', 'b', classes[forward]),
+        ('rev_classes', 'b', classes[backward]),
+        ('name_ids', 'i', name_ids[forward]),
+        ('name_offsets', 'q', name_offsets),
+        ('names', 'B', np.frombuffer(b''.join(encoded), dtype=np.uint8)),
+    ]
+
+    # Section offsets follow the header, the directory and its checksum
+    position = _header.size + len(sections) * _section.size + _crc.size
+    directory = []
+    for name, typecode, data in sections:
+        position += -position % SECTION_ALIGNMENT
+        data = np.ascontiguousarray(data)
+        directory.append(_section.pack(name.encode(), typecode.encode(), position, len(data), zlib.crc32(data.tobytes())))
+        position += data.nbytes
+    header = _header.pack(MAGIC, FORMAT_VERSION, len(sections), len(node_ids), len(src), -1 if version is None else version)
+    header += b''.join(directory)
+    header += _crc.pack(zlib.crc32(header))
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        for (_, _, data), entry in zip(sections, directory):
+            f.write(b'\0' * (_section.unpack(entry)[2] - f.tell()))
+            f.write(np.ascontiguousarray(data).tobytes())
+    os.replace(tmp_path, path)
+    return path
+
+# Export the road network stored in Neo4j, keyed on the Neo4j node ids like a
+# RoadGraphSnapshot, together with the graph version stamp
+def export_from_neo4j(graph, path):
+    # Read before the network: an import finishing meanwhile makes the stamp older, never newer
+    version = graph_version(graph)
+    nodes = [(record['id'], record['osmid'], record['lat'], record['lon']) for record in graph.run(graph_file_nodes_query)]
+    edges = [(record['src'], record['dst'], record['length'], record['name'], record['max_speed'], record['highway'], record['lanes'])
+             for record in graph.run(graph_file_rels_query)]
+    node_ids, osmids, lats, lons = zip(*nodes) if nodes else ((), (), (), ())
+    src, dst, lengths, names, max_speeds, highways, lanes = zip(*edges) if edges else ((), (), (), (), (), (), ())
+    return write_graph_file(path, node_ids, [np.nan if lat is None else lat for lat in lats], [np.nan if lon is None else lon for lon in lons],
+                            src, dst, lengths, [-1 if osmid is None else osmid for osmid in osmids], names, version,
+                            max_speeds, highways, lanes)
+
+# Export the osmnx GeoDataFrames of osmToNeo4j.py before (or without) loading
+# them into Neo4j. There are no Neo4j ids yet, so the nodes are keyed on osmid
+def export_from_geodataframes(gdf_nodes, gdf_relationships, path):
+    def column(name):
+        return gdf_relationships[name] if name in gdf_relationships else None
+    return write_graph_file(path, gdf_nodes['osmid'], gdf_nodes['y'], gdf_nodes['x'], gdf_relationships['u'], gdf_relationships['v'],
+                            gdf_relationships['length'], names=column('name'), max_speeds=column('maxspeed'),
+                            highways=column('highway'), lanes=column('lanes'))
+
+# Read-only view of a graph file. Sections are exposed as memoryviews (fast
+# element access from the search loops) or NumPy arrays, both over the mapping
+class GraphFile:
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.buffer = memoryview(self.mmap)
+
+        if len(self.mmap) < _header.size:
+            raise ValueError(f"{path} is not a routing graph file")
+        magic, version, section_count, self.num_nodes, self.num_edges, graph_version = _header.unpack_from(self.mmap)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a routing graph file")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"{path} has format version {version}, expected {FORMAT_VERSION}: export it again")
+        header_end = _header.size + section_count * _section.size
+        if header_end + _crc.size > len(self.mmap) or _crc.unpack_from(self.mmap, header_end)[0] != zlib.crc32(self.buffer[:header_end]):
+            raise ValueError(f"Header of {path} is corrupt")
+        self.graph_version = None if graph_version == -1 else graph_version
+
+        # Sections are checked to lie inside the file even without verify(): a
+        # truncated file would otherwise give short views and wrong searches
+        self.sections = {}  # name -> (typecode, offset, count, crc32)
+        for k in range(section_count):
+            name, typecode, offset, count, crc = _section.unpack_from(self.mmap, _header.size + k * _section.size)
+            name, typecode = name.rstrip(b'\0').decode(), typecode.rstrip(b'\0').decode()
+            if typecode not in _itemsizes:
+                raise ValueError(f"Section {name} of {path} has unknown type '{typecode}'")
+            if offset + count * _itemsizes[typecode] > len(self.mmap):
+                raise ValueError(f"Section {name} of {path} ends past the end of the file, it is truncated")
+            self.sections[name] = (typecode, offset, count, crc)
+
+    def _bytes(self, name):
+        typecode, offset, count, _ = self.sections[name]
+        return self.buffer[offset:offset + count * _itemsizes[typecode]]
+
+    def view(self, name):
+        return self._bytes(name).cast(self.sections[name][0])
+
+    def array(self, name):
+        typecode, offset, count, _ = self.sections[name]
+        return np.frombuffer(self.mmap, dtype=np.dtype(typecode), count=count, offset=offset)
+
+    # Check every section against its CRC32 (reads the whole file)
+    def verify(self):
+        for name, (_, _, _, crc) in self.sections.items():
+            if zlib.crc32(self._bytes(name)) != crc:
+                raise ValueError(f"Section {name} of {self.path} is corrupt")
+        return True
+
+    # Position of a node id, or None
+    def position(self, node_id):
+        node_ids = self.view('node_ids')
+        i = bisect.bisect_left(node_ids, node_id)
+        return i if i < len(node_ids) and node_ids[i] == node_id else None
+
+    def osmid(self, node_id):
+        i = self.position(node_id)
+        return None if i is None else self.view('osmids')[i]
+
+    # Node id of an OSM id, or None
+    def node_id(self, osmid):
+        osmids, order = self.view('osmids'), self.view('osmid_order')
+        low, high = 0, len(order)
+        while low < high:
+            middle = (low + high) // 2
+            if osmids[order[middle]] < osmid:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(order) and osmids[order[low]] == osmid:
+            return self.view('node_ids')[order[low]]
+        return None
+
+    # Street name of a (forward CSR) edge, or None
+    def edge_name(self, edge):
+        name_id = self.view('name_ids')[edge]
+        if name_id == -1:
+            return None
+        offsets = self.view('name_offsets')
+        return bytes(self.view('names')[offsets[name_id]:offsets[name_id + 1]]).decode('utf-8')
+
+    def snapshot(self):
+        return MappedSnapshot(self.path, graph_file=self)
+
+# Node id -> position mapping over the sorted node ids of a graph file, used as
+# RoadGraphSnapshot.index without building a dict per process
+class _SortedIndex:
+
+    def __init__(self, node_ids):
+        self.node_ids = node_ids
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def __contains__(self, node_id):
+        return self.get(node_id) is not None
+
+    def __getitem__(self, node_id):
+        i = self.get(node_id)
+        if i is None:
+            raise KeyError(node_id)
+        return i
+
+    def get(self, node_id, default=None):
+        i = bisect.bisect_left(self.node_ids, node_id)
+        return i if i < len(self.node_ids) and self.node_ids[i] == node_id else default
+
+    def __iter__(self):
+        return iter(self.node_ids)
+
+# RoadGraphSnapshot over a graph file: the arrays are views of the mapping, so
+# opening one takes milliseconds and processes share the pages. Pickling only
+# sends the path; a worker process maps the file again
+class MappedSnapshot(RoadGraphSnapshot):
+
+    def __init__(self, path, verify=False, graph_file=None):
+        super().__init__()
+        self.path = path
+        self._map(graph_file or GraphFile(path), verify)
+
+    def _map(self, graph_file, verify):
+        if verify:
+            graph_file.verify()
+        self.file = graph_file
+        self.version = graph_file.graph_version
+        for name in ('node_ids', 'lats', 'lons', 'offsets', 'targets', 'weights', 'rev_offsets', 'rev_targets', 'rev_weights'):
+            setattr(self, name, graph_file.view(name))
+        for name in ('speeds', 'rev_speeds', 'classes', 'rev_classes'):
+            setattr(self, name, graph_file.view(name))
+        self.max_speed = float(graph_file.array('speeds').max()) if len(self.speeds) else MAX_SPEED
+        self.index = _SortedIndex(self.node_ids)
+        self._edge_weights = {}
+        self._integer_weights = {}
+
+    # Map the file again, e.g. after a new export replaced it
+    def refresh(self, graph=None):
+        self._map(GraphFile(self.path), False)
+        return self
+
+    def __getstate__(self):
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+# Main code
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the road network to a memory-mapped routing graph file, or inspect one")
+    parser.add_argument('path', help="graph file")
+    parser.add_argument('--export', action='store_true', help="export the graph from Neo4j to path first")
+    parser.add_argument('--uri', default="bolt://localhost:7687", help="bolt URI of the Neo4j server")
+    parser.add_argument('--verify', action='store_true', help="check the CRC32 of every section")
+    args = parser.parse_args()
+
+    if args.export:
+        start_time = time.perf_counter()
+        export_from_neo4j(Graph(args.uri, auth=None), args.path)
+        print(f"Exported {args.path} in {time.perf_counter() - start_time:.1f} s")
+
+    start_time = time.perf_counter()
+    snapshot = MappedSnapshot(args.path)
+    print(f"Mapped {len(snapshot)} intersections and {len(snapshot.targets)} road segments "
+          f"(graph version {snapshot.file.graph_version}) in {(time.perf_counter() - start_time) * 1000:.2f} ms")
+    if args.verify:
+        start_time = time.perf_counter()
+        snapshot.file.verify()
+        print(f"Checksums verified in {(time.perf_counter() - start_time) * 1000:.1f} ms")
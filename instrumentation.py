@@ -0,0 +1,341 @@
+import contextlib
+import functools
+import heapq
+import inspect
+import logging
+import os
+import threading
+import time
+
+# Opt-in counters for the hot paths: database calls and rows, settled nodes, heap
+# pushes/pops and wall time per phase. Nothing is counted unless a measurement is
+# active on the calling thread (measure(), or the instrumented() functions once
+# enable() has been called), so the disabled cost is one flag check per call
+
+_enabled = False
+_exporters = []
+_state = threading.local()
+
+# Counters of one measurement. rows are the records fetched from (or, for the
+# importer, sent to) the database; phases maps a phase name to seconds:
+# 'total' is the whole measurement, 'db_run' the time spent waiting for queries
+# to start answering (Bolt round trips), 'db_fetch' the time spent pulling and
+# hydrating their records; the rest of 'total' is spent in Python
+class Metrics:
+
+    def __init__(self, name):
+        self.name = name
+        self.db_calls = 0
+        self.rows = 0
+        self.settled = 0
+        self.heap_pushes = 0
+        self.heap_pops = 0
+        self.phases = {}
+
+    def add_phase(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'db_calls': self.db_calls,
+            'rows': self.rows,
+            'settled': self.settled,
+            'heap_pushes': self.heap_pushes,
+            'heap_pops': self.heap_pops,
+            'phases': dict(self.phases),
+        }
+
+# Metrics of the measurement running on this thread, or None
+def current():
+    return getattr(_state, 'metrics', None)
+
+# Metrics of the last measurement finished on this thread
+def last():
+    return getattr(_state, 'last', None)
+
+# Measure everything the calling thread does inside the block. A measurement
+# started inside another one only adds its time to the outer one as a phase.
+# Finished measurements are handed to the registered exporters
+@contextlib.contextmanager
+def measure(name):
+    outer = current()
+    if outer is not None:
+        with phase(name):
+            yield outer
+        return
+    metrics = Metrics(name)
+    _state.metrics = metrics
+    start_time = time.perf_counter()
+    try:
+        yield metrics
+    finally:
+        metrics.add_phase('total', time.perf_counter() - start_time)
+        _state.metrics = None
+        _state.last = metrics
+        for exporter in list(_exporters):
+            exporter.export(metrics)
+
+class _Phase:
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start_time = time.perf_counter()
+        return self.metrics
+
+    def __exit__(self, *exc_info):
+        self.metrics.add_phase(self.name, time.perf_counter() - self.start_time)
+
+_no_phase = contextlib.nullcontext()
+
+# Time a block as a phase of the current measurement (no-op without one)
+def phase(name):
+    metrics = current()
+    return _no_phase if metrics is None else _Phase(metrics, name)
+
+# Add to a counter of the current measurement (no-op without one)
+def count(counter, amount=1):
+    metrics = current()
+    if metrics is not None:
+        setattr(metrics, counter, getattr(metrics, counter) + amount)
+
+# Counts settled nodes for searches started without a SearchControl; like
+# SearchControl it is only ever stepped, it cannot be cancelled
+class _SettledCounter:
+
+    def __init__(self):
+        self.settled = 0
+
+    def step(self):
+        self.settled += 1
+
+# Decorator: while instrumentation is enabled every call is a measurement named
+# name. With search=True the function has a control parameter
+# (operations.SearchControl), passed by keyword or by position, and its settled
+# nodes are counted. Nested instrumented searches (shortest_path calling
+# dijkstra) count them once, in the outermost one
+def instrumented(name, search=False):
+    def decorator(function):
+        position = list(inspect.signature(function).parameters).index('control') if search else None
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with measure(name) as metrics:
+                if not search or getattr(_state, 'counting', False):
+                    return function(*args, **kwargs)
+                control = args[position] if len(args) > position else kwargs.get('control')
+                if control is None:
+                    control = _SettledCounter()
+                    if len(args) > position:
+                        args = args[:position] + (control,) + args[position + 1:]
+                    else:
+                        kwargs['control'] = control
+                settled = control.settled
+                _state.counting = True
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    _state.counting = False
+                    metrics.settled += control.settled - settled
+        return wrapper
+    return decorator
+
+# Stands in for the heapq module of operations.py while instrumentation is
+# enabled, counting the pushes and pops of the thread's current measurement
+class _CountingHeapq:
+
+    def heappush(self, heap, item):
+        metrics = current()
+        if metrics is not None:
+            metrics.heap_pushes += 1
+        heapq.heappush(heap, item)
+
+    def heappop(self, heap):
+        metrics = current()
+        if metrics is not None:
+            metrics.heap_pops += 1
+        return heapq.heappop(heap)
+
+    def __getattr__(self, name):
+        return getattr(heapq, name)
+
+# Start measuring the instrumented() functions and counting heap operations, and
+# register exporters for the finished measurements
+def enable(*exporters):
+    global _enabled
+    import operations
+    _exporters.extend(exporters)
+    operations.heapq = _CountingHeapq()
+    _enabled = True
+
+def disable():
+    global _enabled
+    import operations
+    _enabled = False
+    operations.heapq = heapq
+    _exporters.clear()
+
+def enabled():
+    return _enabled
+
+# Records of a query, counting the rows and the time spent fetching them
+class _InstrumentedCursor:
+
+    def __init__(self, cursor, metrics):
+        self.cursor = cursor
+        self.metrics = metrics
+
+    def __iter__(self):
+        records = iter(self.cursor)
+        while True:
+            start_time = time.perf_counter()
+            try:
+                record = next(records)
+            except StopIteration:
+                self.metrics.add_phase('db_fetch', time.perf_counter() - start_time)
+                return
+            self.metrics.add_phase('db_fetch', time.perf_counter() - start_time)
+            self.metrics.rows += 1
+            yield record
+
+    def data(self, *keys):
+        with _Phase(self.metrics, 'db_fetch'):
+            data = self.cursor.data(*keys)
+        self.metrics.rows += len(data)
+        return data
+
+    def evaluate(self, field=0):
+        with _Phase(self.metrics, 'db_fetch'):
+            value = self.cursor.evaluate(field)
+        self.metrics.rows += 1
+        return value
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+# Lazy py2neo match (graph.relationships.match(...)): one database call when iterated
+class _InstrumentedMatch:
+
+    def __init__(self, match):
+        self.match = match
+
+    def __iter__(self):
+        metrics = current()
+        if metrics is None:
+            return iter(self.match)
+        metrics.db_calls += 1
+        return iter(_InstrumentedCursor(self.match, metrics))
+
+    def __getattr__(self, name):
+        return getattr(self.match, name)
+
+# graph.nodes / graph.relationships of an InstrumentedGraph
+class _InstrumentedMatcher:
+
+    def __init__(self, matcher):
+        self.matcher = matcher
+
+    def get(self, identity):
+        metrics = current()
+        if metrics is None:
+            return self.matcher.get(identity)
+        metrics.db_calls += 1
+        with _Phase(metrics, 'db_run'):
+            entity = self.matcher.get(identity)
+        metrics.rows += entity is not None
+        return entity
+
+    def match(self, *args, **kwargs):
+        return _InstrumentedMatch(self.matcher.match(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self.matcher, name)
+
+# py2neo Graph proxy that counts the calls, rows and database time of the current
+# measurement. Outside a measurement it only forwards the calls
+class InstrumentedGraph:
+
+    def __init__(self, graph):
+        self.graph = graph
+
+    @property
+    def nodes(self):
+        return _InstrumentedMatcher(self.graph.nodes)
+
+    @property
+    def relationships(self):
+        return _InstrumentedMatcher(self.graph.relationships)
+
+    def run(self, cypher, parameters=None, **kwparameters):
+        metrics = current()
+        if metrics is None:
+            return self.graph.run(cypher, parameters, **kwparameters)
+        metrics.db_calls += 1
+        with _Phase(metrics, 'db_run'):
+            cursor = self.graph.run(cypher, parameters, **kwparameters)
+        return _InstrumentedCursor(cursor, metrics)
+
+    def __getattr__(self, name):
+        return getattr(self.graph, name)
+
+# One log line per finished measurement
+class LoggingExporter:
+
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger(__name__)
+        self.level = level
+
+    def export(self, metrics):
+        phases = ', '.join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in metrics.phases.items())
+        self.logger.log(self.level, "%s: %d db calls, %d rows, %d settled, %d heap pushes, %d heap pops (%s)",
+                        metrics.name, metrics.db_calls, metrics.rows, metrics.settled, metrics.heap_pushes, metrics.heap_pops, phases)
+
+# Running totals per measurement name in the Prometheus text format, rewritten
+# after every measurement for the node_exporter textfile collector
+class PrometheusExporter:
+
+    counters = {
+        'db_calls': 'Database calls',
+        'rows': 'Records fetched from or sent to the database',
+        'settled': 'Search nodes settled',
+        'heap_pushes': 'Priority queue pushes',
+        'heap_pops': 'Priority queue pops',
+    }
+
+    def __init__(self, path, prefix='routing'):
+        self.path = path
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.totals = {}  # name -> {'measurements': n, counter: total, ('phase', phase): seconds}
+
+    def export(self, metrics):
+        with self.lock:
+            totals = self.totals.setdefault(metrics.name, {})
+            totals['measurements'] = totals.get('measurements', 0) + 1
+            for counter in self.counters:
+                totals[counter] = totals.get(counter, 0) + getattr(metrics, counter)
+            for name, seconds in metrics.phases.items():
+                totals[('phase', name)] = totals.get(('phase', name), 0.0) + seconds
+            self.write()
+
+    def write(self):
+        lines = [f"# HELP {self.prefix}_measurements_total Instrumented calls",
+                 f"# TYPE {self.prefix}_measurements_total counter"]
+        lines += [f'{self.prefix}_measurements_total{{name="{name}"}} {totals["measurements"]}' for name, totals in self.totals.items()]
+        for counter, description in self.counters.items():
+            lines += [f"# HELP {self.prefix}_{counter}_total {description}", f"# TYPE {self.prefix}_{counter}_total counter"]
+            lines += [f'{self.prefix}_{counter}_total{{name="{name}"}} {totals[counter]}' for name, totals in self.totals.items()]
+        lines += [f"# HELP {self.prefix}_phase_seconds_total Wall time per phase",
+                  f"# TYPE {self.prefix}_phase_seconds_total counter"]
+        lines += [f'{self.prefix}_phase_seconds_total{{name="{name}",phase="{key[1]}"}} {seconds:.6f}'
+                  for name, totals in self.totals.items() for key, seconds in totals.items() if isinstance(key, tuple)]
+        # Written next to the target and renamed, the collector never reads a partial file
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,194 @@
+import argparse
+import heapq
+import os
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from py2neo import Graph
+import operations
+from instrumentation import instrumented
+from operations import RoadGraphSnapshot
+from spatialIndex import GridIndex
+
+# shapely is only needed for concave hulls, without it the polygon is the convex hull
+try:
+    import shapely
+except ImportError:
+    shapely = None
+
+# Bounded multi-source Dijkstra over a snapshot: every node whose cost from the
+# nearest source (or, with reverse, to it) is at most budget, in the unit of the
+# weight. Returns the snapshot positions and costs of the reached nodes in
+# settled order (increasing cost). Costs are kept in a dict, the reached area is
+# usually a small part of the network
+def _bounded_search(snapshot, sources, budget, weight, reverse, control):
+    if reverse:
+        offsets, targets, weights = snapshot.rev_offsets, snapshot.rev_targets, snapshot.edge_weights(weight)[1]
+    else:
+        offsets, targets, weights = snapshot.offsets, snapshot.targets, snapshot.edge_weights(weight)[0]
+    costs = {source: 0.0 for source in sources}
+    queue = [(0.0, source) for source in costs]
+    heapq.heapify(queue)
+    positions = array('q')
+    reached_costs = array('d')
+
+    while queue:
+        cost, current = heapq.heappop(queue)
+        if cost > costs[current]:
+            continue  # Stale queue entry
+        if control is not None:
+            control.step()
+        positions.append(current)
+        reached_costs.append(cost)
+
+        for edge in range(offsets[current], offsets[current + 1]):
+            neighbor = targets[edge]
+            new_cost = cost + weights[edge]
+            if new_cost <= budget and new_cost < costs.get(neighbor, float('inf')):
+                costs[neighbor] = new_cost
+                heapq.heappush(queue, (new_cost, neighbor))
+    return positions, reached_costs
+
+# Convex hull (Andrew's monotone chain) of (x, y) points, counter-clockwise.
+# Empty when the points do not span an area (fewer than 3, or all collinear)
+def _convex_hull(points):
+    points = sorted(set(points))
+    if len(points) < 3:
+        return []
+    def half(points):
+        chain = []
+        for point in points:
+            while len(chain) >= 2 and ((chain[-1][0] - chain[-2][0]) * (point[1] - chain[-2][1])
+                                       - (chain[-1][1] - chain[-2][1]) * (point[0] - chain[-2][0])) <= 0:
+                chain.pop()
+            chain.append(point)
+        return chain
+    lower, upper = half(points), half(points[::-1])
+    ring = lower[:-1] + upper[:-1]
+    return ring if len(ring) >= 3 else []
+
+# Polygon around a set of locations as the (lats, lons) of a closed ring: the
+# shapely concave hull when shapely is installed (ratio 1 gives the convex hull,
+# smaller ratios hug the points tighter), else the convex hull. Empty arrays
+# when the points do not span an area
+def hull(lats, lons, ratio=0.3):
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    valid = ~(np.isnan(lats) | np.isnan(lons))
+    lats, lons = lats[valid], lons[valid]
+    if not len(lats):
+        return np.array([]), np.array([])
+    # Longitudes scaled by cos(latitude) as in GridIndex, so the hull is computed on roughly square units
+    scale = np.cos(np.radians(np.mean(lats)))
+    if shapely is not None:
+        polygon = shapely.concave_hull(shapely.multipoints(np.column_stack([lons * scale, lats])), ratio=ratio)
+        if polygon.geom_type != 'Polygon' or polygon.is_empty:
+            return np.array([]), np.array([])
+        ring = np.asarray(polygon.exterior.coords)
+    else:
+        ring = _convex_hull(list(zip((lons * scale).tolist(), lats.tolist())))
+        if not ring:
+            return np.array([]), np.array([])
+        ring = np.asarray(ring + ring[:1])
+    return ring[:, 1], ring[:, 0] / scale
+
+# Everything reachable from the source node ids within budget (meters for
+# 'length', seconds for the travel time weights): one bounded Dijkstra from all
+# sources at once, so a node's cost is the cost from the nearest source. With
+# reverse the costs are those to the nearest source (arrival instead of departure).
+# Returns a dict with the 'ids' and 'costs' of the reached intersections as
+# NumPy arrays, sorted by cost, and with polygon the 'lats'/'lons' of the hull
+# ring around them (None otherwise)
+@instrumented('isochrone', search=True)
+def isochrone(graph, sources, budget, snapshot=None, weight='length', polygon=False, ratio=0.3, reverse=False, control=None):
+    if snapshot is None:
+        snapshot = RoadGraphSnapshot(graph)
+    if budget < 0:
+        raise ValueError(f"The budget must not be negative, got {budget}")
+    sources = [sources] if np.ndim(sources) == 0 else list(sources)
+    for node_id in sources:
+        if node_id not in snapshot.index:
+            raise KeyError(f"Node {node_id} is not an Intersection of the road network")
+
+    positions, costs = _bounded_search(snapshot, [snapshot.index[node_id] for node_id in sources], budget, weight, reverse, control)
+    result = {
+        'ids': np.array([snapshot.node_ids[position] for position in positions], dtype=np.int64),
+        'costs': np.frombuffer(costs, dtype=np.float64) if len(costs) else np.array([]),
+        'lats': None,
+        'lons': None,
+    }
+    if polygon:
+        positions = np.frombuffer(positions, dtype=np.int64) if len(positions) else np.array([], dtype=np.int64)
+        result['lats'], result['lons'] = hull(np.asarray(snapshot.lats)[positions], np.asarray(snapshot.lons)[positions], ratio)
+    return result
+
+# Runs in the worker processes, on the snapshot shared by operations._init_worker
+def _isochrone_worker(sources, budget, weight, polygon, ratio, reverse):
+    return isochrone(None, sources, budget, snapshot=operations._worker_snapshot, weight=weight, polygon=polygon,
+                     ratio=ratio, reverse=reverse)
+
+# One isochrone per origin (a node id, or a list of ids for a multi-source
+# isochrone), spread over a process pool that shares one read-only snapshot as
+# distance_matrix does. Returns the isochrone dicts in the order of the origins
+def isochrones(graph, origins, budget, snapshot=None, processes=None, weight='length', polygon=False, ratio=0.3, reverse=False):
+    if snapshot is None:
+        snapshot = RoadGraphSnapshot(graph)
+    origins = list(origins)
+    if processes == 1 or len(origins) <= 1:
+        return [isochrone(None, sources, budget, snapshot=snapshot, weight=weight, polygon=polygon, ratio=ratio, reverse=reverse)
+                for sources in origins]
+
+    # Isochrones are short searches: send them in chunks to save inter-process round trips
+    chunksize = max(1, len(origins) // (4 * (processes or os.cpu_count())))
+    with ProcessPoolExecutor(max_workers=processes, initializer=operations._init_worker, initargs=(snapshot,)) as pool:
+        count = len(origins)
+        return list(pool.map(_isochrone_worker, origins, [budget] * count, [weight] * count, [polygon] * count,
+                             [ratio] * count, [reverse] * count, chunksize=chunksize))
+
+# Main code
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Intersections reachable within a distance or travel time budget")
+    parser.add_argument('origins', nargs='+', help="node ids, or lat,lon coordinates snapped to the nearest intersection")
+    parser.add_argument('--budget', type=float, required=True, help="meters, or minutes with a travel time weight")
+    parser.add_argument('--weight', default='length', help="'length', 'time' or 'time@H' (hour H of the speed profiles)")
+    parser.add_argument('--each', action='store_true', help="one isochrone per origin instead of one from all of them")
+    parser.add_argument('--processes', type=int, default=None, help="worker processes for --each (default: one per CPU)")
+    parser.add_argument('--reverse', action='store_true', help="costs to the origins instead of from them")
+    parser.add_argument('--polygon', action='store_true', help="compute the hull around the reached intersections")
+    parser.add_argument('--uri', default="bolt://localhost:7687", help="bolt URI of the Neo4j server")
+    parser.add_argument('--graph-file', metavar='PATH', help="read the network from a graph file written by graphFile.py instead of Neo4j")
+    args = parser.parse_args()
+
+    if args.graph_file:
+        # Imported here: the graph file module is only needed for this option
+        from graphFile import MappedSnapshot
+        snapshot = MappedSnapshot(args.graph_file)
+    else:
+        snapshot = RoadGraphSnapshot(Graph(args.uri, auth=None))
+
+    index = None
+    origins = []
+    for origin in args.origins:
+        if ',' in origin:
+            index = index or GridIndex(snapshot)
+            lat, lon = (float(part) for part in origin.split(','))
+            origins.append(int(index.snap(lat, lon)[0][0]))
+        else:
+            origins.append(int(origin))
+    budget = args.budget if args.weight == 'length' else args.budget * 60
+
+    start_time = time.perf_counter()
+    if args.each:
+        results = isochrones(None, origins, budget, snapshot=snapshot, processes=args.processes, weight=args.weight,
+                             polygon=args.polygon, reverse=args.reverse)
+    else:
+        results = [isochrone(None, origins, budget, snapshot=snapshot, weight=args.weight, polygon=args.polygon, reverse=args.reverse)]
+    elapsed = time.perf_counter() - start_time
+
+    for origin, result in zip(origins if args.each else [origins], results):
+        line = f"{origin}: {len(result['ids'])} intersections reached"
+        if args.polygon:
+            line += f", hull of {max(len(result['lats']) - 1, 0)} vertices"
+        print(line)
+    print(f"{len(results)} isochrones in {elapsed * 1000:.1f} ms")
@@ -0,0 +1,190 @@
+import heapq
+import pickle
+import random
+import time
+from array import array
+from py2neo import Graph
+from operations import RoadGraphSnapshot, astar, haversine_heuristic
+
+# Version of the pickled landmark file, bump it when the stored layout changes
+LANDMARKS_FILE_VERSION = 1
+
+# Distances from one source to every node over CSR arrays (forward or reversed edges)
+def _distances_from(num_nodes, offsets, targets, weights, source):
+    distances = [float('inf')] * num_nodes
+    predecessors = [-1] * num_nodes
+    order = []
+    distances[source] = 0
+    queue = [(0, source)]
+    while queue:
+        distance, current = heapq.heappop(queue)
+        if distance > distances[current]:
+            continue
+        order.append(current)
+        for edge in range(offsets[current], offsets[current + 1]):
+            neighbor = targets[edge]
+            new_distance = distance + weights[edge]
+            if new_distance < distances[neighbor]:
+                distances[neighbor] = new_distance
+                predecessors[neighbor] = current
+                heapq.heappush(queue, (new_distance, neighbor))
+    return distances, predecessors, order
+
+# ALT preprocessing: distances from and to K landmarks for every node, stored
+# node-major in flat arrays (node i uses [i * K:(i + 1) * K]). By the triangle
+# inequality, d(v, t) >= d(L, t) - d(L, v) and d(v, t) >= d(v, L) - d(t, L)
+class Landmarks:
+
+    def __init__(self, node_ids, landmark_ids, from_landmarks, to_landmarks):
+        self.node_ids = node_ids
+        self.index = {node_id: i for i, node_id in enumerate(node_ids)}
+        self.landmark_ids = landmark_ids
+        self.from_landmarks = from_landmarks
+        self.to_landmarks = to_landmarks
+
+    # Select the landmarks ('farthest' or 'avoid') and compute their distance vectors
+    @classmethod
+    def build(cls, snapshot, count=16, method='avoid', seed=0):
+        if method not in ('farthest', 'avoid'):
+            raise ValueError(f"Unknown landmark selection method '{method}', expected 'farthest' or 'avoid'")
+        n = len(snapshot)
+        rng = random.Random(seed)
+        selected = []
+        from_vectors = []
+        to_vectors = []
+
+        def add_landmark(landmark):
+            selected.append(landmark)
+            from_vectors.append(_distances_from(n, snapshot.offsets, snapshot.targets, snapshot.weights, landmark)[0])
+            to_vectors.append(_distances_from(n, snapshot.rev_offsets, snapshot.rev_targets, snapshot.rev_weights, landmark)[0])
+
+        # Current ALT lower bound of d(u, v) with the landmarks selected so far
+        def lower_bound(u, v):
+            bound = 0
+            for from_distances, to_distances in zip(from_vectors, to_vectors):
+                bound = max(bound, _bound(from_distances[v] - from_distances[u]), _bound(to_distances[u] - to_distances[v]))
+            return bound
+
+        # The first landmark is the node farthest from a random start node
+        distances = _distances_from(n, snapshot.offsets, snapshot.targets, snapshot.weights, rng.randrange(n))[0]
+        add_landmark(max(range(n), key=lambda i: distances[i] if distances[i] < float('inf') else -1))
+
+        while len(selected) < min(count, n):
+            if method == 'farthest':
+                # Node maximizing the distance to the closest selected landmark
+                def closest(i):
+                    reachable = [from_distances[i] for from_distances in from_vectors if from_distances[i] < float('inf')]
+                    return min(reachable) if reachable else -1
+                candidate = max((i for i in range(n) if i not in selected), key=closest)
+            else:
+                # Avoid: grow a shortest path tree from a random root, weigh every node by how
+                # badly the current landmarks bound its distance and walk down the heaviest
+                # subtree that does not already contain a landmark
+                root = rng.randrange(n)
+                distances, predecessors, order = _distances_from(n, snapshot.offsets, snapshot.targets, snapshot.weights, root)
+                sizes = [0.0] * n
+                blocked = [False] * n
+                for i in reversed(order):
+                    if i in selected:
+                        blocked[i] = True
+                    if blocked[i]:
+                        sizes[i] = 0.0
+                    else:
+                        sizes[i] += distances[i] - lower_bound(root, i)
+                    parent = predecessors[i]
+                    if parent != -1:
+                        blocked[parent] = blocked[parent] or blocked[i]
+                        sizes[parent] += sizes[i]
+                children = [[] for _ in range(n)]
+                for i in order:
+                    if predecessors[i] != -1:
+                        children[predecessors[i]].append(i)
+                candidate = root
+                while children[candidate]:
+                    heaviest = max(children[candidate], key=lambda child: sizes[child])
+                    if sizes[heaviest] <= 0:
+                        break
+                    candidate = heaviest
+                if candidate in selected:
+                    candidate = rng.choice([i for i in range(n) if i not in selected])
+            add_landmark(candidate)
+
+        # Pack the per-landmark vectors node-major
+        k = len(selected)
+        from_landmarks = array('d', [0.0]) * (n * k)
+        to_landmarks = array('d', [0.0]) * (n * k)
+        for j in range(k):
+            for i in range(n):
+                from_landmarks[i * k + j] = from_vectors[j][i]
+                to_landmarks[i * k + j] = to_vectors[j][i]
+        return cls(list(snapshot.node_ids), [snapshot.node_ids[i] for i in selected], from_landmarks, to_landmarks)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            pickle.dump({
+                'version': LANDMARKS_FILE_VERSION,
+                'node_ids': self.node_ids,
+                'landmark_ids': self.landmark_ids,
+                'from_landmarks': self.from_landmarks,
+                'to_landmarks': self.to_landmarks,
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+        if data.get('version') != LANDMARKS_FILE_VERSION:
+            raise ValueError(f"Unsupported landmark file version {data.get('version')} in {path}, rebuild it")
+        return cls(data['node_ids'], data['landmark_ids'], data['from_landmarks'], data['to_landmarks'])
+
+    # ALT lower bound in meters, same signature as operations.haversine_heuristic
+    def heuristic(self, node_id, lat, lon, end_id, end_lat, end_lon):
+        if node_id not in self.index or end_id not in self.index:
+            return 0
+        k = len(self.landmark_ids)
+        v = self.index[node_id] * k
+        t = self.index[end_id] * k
+        from_landmarks, to_landmarks = self.from_landmarks, self.to_landmarks
+        bound = 0
+        for j in range(k):
+            bound = max(bound, _bound(from_landmarks[t + j] - from_landmarks[v + j]), _bound(to_landmarks[v + j] - to_landmarks[t + j]))
+        return bound
+
+# Differences involving unreachable nodes (inf - inf, inf - x) do not give a usable bound
+def _bound(difference):
+    return difference if difference == difference and difference != float('inf') else 0
+
+# Settled nodes and time of A* with the haversine and ALT heuristics on the same query pairs
+def compare_heuristics(snapshot, landmarks, pairs):
+    results = {}
+    for name, heuristic in (('haversine', haversine_heuristic), ('alt', landmarks.heuristic)):
+        settled = []
+        start_time = time.perf_counter()
+        for start_id, end_id in pairs:
+            stats = {}
+            astar(None, start_id, end_id, snapshot=snapshot, heuristic=heuristic, stats=stats)
+            settled.append(stats['settled'])
+        results[name] = {
+            'queries': len(pairs),
+            'mean_settled': sum(settled) / len(settled) if settled else 0,
+            'max_settled': max(settled, default=0),
+            'seconds': time.perf_counter() - start_time,
+        }
+    return results
+
+# Main code
+if __name__ == "__main__":
+    # Connect to Neo4j
+    graph = Graph("bolt://localhost:7687", auth=None)
+    snapshot = RoadGraphSnapshot(graph)
+
+    start_time = time.perf_counter()
+    landmarks = Landmarks.build(snapshot, count=16)
+    print(f"Selected {len(landmarks.landmark_ids)} landmarks in {time.perf_counter() - start_time:.1f} s")
+    landmarks.save('road_network.alt')
+
+    # Fixed-seed random query pairs
+    rng = random.Random(42)
+    pairs = [(rng.choice(snapshot.node_ids), rng.choice(snapshot.node_ids)) for _ in range(200)]
+    for name, result in compare_heuristics(snapshot, landmarks, pairs).items():
+        print(f"{name}: {result['mean_settled']:.0f} settled nodes on average, {result['max_settled']} max, {result['seconds']:.2f} s")
@@ -1,72 +1,385 @@
-from collections import deque
-from py2neo import Graph, RelationshipMatcher
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+from py2neo import Graph
+from instrumentation import instrumented
+from travelTime import MAX_SPEED, cost_per_meter, edge_cost, free_flow_speeds, parse_weight, travel_times
 import heapq
+import numpy as np
 from math import radians, cos, sin, asin, sqrt
 import matplotlib.pyplot as plt
 
-# Function to search for nodes connected to a specific street
-def find_street_nodes(graph, street_name):
-    # Create a RelationshipMatcher
-    rel_matcher = RelationshipMatcher(graph)
+# Cypher queries to load the whole road network in two round trips. Besides the
+# length, every segment brings the attributes its travel time is derived from
+snapshot_nodes_query = '''
+    MATCH (i:Intersection)
+    RETURN id(i) AS id, i.location.latitude AS lat, i.location.longitude AS lon
+'''
 
-    # Search for relationships connected to the specified street
-    relationships = rel_matcher.match(r_type="ROAD_SEGMENT", name=street_name)
+snapshot_rels_query = '''
+    MATCH (u:Intersection)-[r:ROAD_SEGMENT]->(v:Intersection)
+    RETURN id(u) AS src, id(v) AS dst, r.length AS length, r.max_speed AS max_speed, r.highway AS highway, r.lanes AS lanes
+'''
 
-    # Set to store unique node identities
-    unique_node_ids = set()
+# Counting sort of (src, dst, length) index triples into CSR offset/target/weight arrays
+def _csr(num_nodes, edges):
+    offsets = array('q', [0]) * (num_nodes + 1)
+    for src, _, _ in edges:
+        offsets[src + 1] += 1
+    for i in range(num_nodes):
+        offsets[i + 1] += offsets[i]
+    position = offsets[:-1]
+    targets = array('q', [0]) * len(edges)
+    weights = array('d', [0.0]) * len(edges)
+    for src, dst, length in edges:
+        targets[position[src]] = dst
+        weights[position[src]] = length
+        position[src] += 1
+    return offsets, targets, weights
 
-    # Process relationships and add unique nodes to the set
-    for rel in relationships:
-        unique_node_ids.add(rel.start_node.identity)
+# Cypher query to read the graph version stamp that osmToNeo4j.py bumps after every load
+graph_version_query = '''
+    OPTIONAL MATCH (m:GraphMeta {name: 'road_network'})
+    RETURN m.version AS version
+'''
 
-    # Return the details of unique nodes
-    nodes_info = []
-    for node_id in unique_node_ids:
-        node = graph.nodes.get(node_id)
-        nodes_info.append((node.identity, node.get('location', None)))
-    
-    return nodes_info
+def graph_version(graph):
+    record = graph.run(graph_version_query).data()
+    return record[0]['version'] if record else None
+
+# Compact in-memory copy of the road network that the search functions can reuse.
+# Neo4j ids are remapped to contiguous indices and the adjacency is stored in
+# CSR form: the outgoing edges of node i are targets/weights[offsets[i]:offsets[i + 1]].
+# weights are lengths; speeds (free-flow km/h) and classes (travelTime highway
+# class indices) follow the same order and give the costs of the other weights.
+# version is the graph version stamp the snapshot was loaded at (None if unknown)
+class RoadGraphSnapshot:
+
+    def __init__(self, graph=None):
+        self.graph = graph
+        self.version = None
+        self.node_ids = []
+        self.index = {}
+        self.offsets = array('q', [0])
+        self.targets = array('q')
+        self.weights = array('d')
+        self.rev_offsets = array('q', [0])
+        self.rev_targets = array('q')
+        self.rev_weights = array('d')
+        self.speeds = array('d')
+        self.rev_speeds = array('d')
+        self.classes = array('b')
+        self.rev_classes = array('b')
+        self.max_speed = MAX_SPEED
+        self.lats = array('d')
+        self.lons = array('d')
+        self._edge_weights = {}
+        self._integer_weights = {}
+        if graph is not None:
+            self.refresh()
+
+    # Build a snapshot from plain (id, lat, lon) and (src, dst, length) or
+    # (src, dst, length, max_speed, highway, lanes) tuples
+    @classmethod
+    def from_edges(cls, nodes, edges):
+        snapshot = cls()
+        snapshot._build(nodes, edges)
+        return snapshot
+
+    # Reload the snapshot from Neo4j, e.g. after osmToNeo4j.py has imported new data
+    @instrumented('snapshot_refresh')
+    def refresh(self, graph=None):
+        if graph is not None:
+            self.graph = graph
+        # Read before the network: an import finishing meanwhile makes the stamp older, never newer
+        version = graph_version(self.graph)
+        nodes = [(record['id'], record['lat'], record['lon']) for record in self.graph.run(snapshot_nodes_query)]
+        edges = [(record['src'], record['dst'], record['length'], record['max_speed'], record['highway'], record['lanes'])
+                 for record in self.graph.run(snapshot_rels_query)]
+        self._build(nodes, edges)
+        self.version = version
+        return self
+
+    def _build(self, nodes, edges):
+        node_ids = []
+        index = {}
+        lats = array('d')
+        lons = array('d')
+        for node_id, lat, lon in nodes:
+            index[node_id] = len(node_ids)
+            node_ids.append(node_id)
+            lats.append(float('nan') if lat is None else lat)
+            lons.append(float('nan') if lon is None else lon)
+
+        edges = list(edges)
+        edge_speeds, edge_classes = free_flow_speeds([edge[3:6] for edge in edges])
+        edges = [(index[src], index[dst], float(length)) for src, dst, length, *_ in edges]
+        offsets, targets, weights = _csr(len(node_ids), edges)
+        # Reversed edges for searches that run backwards from the target
+        rev_offsets, rev_targets, rev_weights = _csr(len(node_ids), [(dst, src, length) for src, dst, length in edges])
+        # The counting sort is stable: a stable argsort of the sources (destinations)
+        # lays out the speeds and classes like the weights (rev_weights)
+        endpoints = np.array([(src, dst) for src, dst, _ in edges], dtype=np.int64).reshape(-1, 2)
+        order = np.argsort(endpoints[:, 0], kind='stable')
+        rev_order = np.argsort(endpoints[:, 1], kind='stable')
+
+        self.node_ids = node_ids
+        self.index = index
+        self.offsets = offsets
+        self.targets = targets
+        self.weights = weights
+        self.rev_offsets = rev_offsets
+        self.rev_targets = rev_targets
+        self.rev_weights = rev_weights
+        self.speeds = array('d', edge_speeds[order].tobytes())
+        self.rev_speeds = array('d', edge_speeds[rev_order].tobytes())
+        self.classes = array('b', edge_classes[order].tobytes())
+        self.rev_classes = array('b', edge_classes[rev_order].tobytes())
+        self.max_speed = float(edge_speeds.max()) if len(edge_speeds) else MAX_SPEED
+        self.lats = lats
+        self.lons = lons
+        self._edge_weights = {}
+        self._integer_weights = {}
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    # Outgoing (neighbor index, length) pairs of the node at index i
+    def neighbors(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return zip(self.targets[start:end], self.weights[start:end])
+
+    # Forward and reverse edge costs of a weight (see travelTime.py) in the order
+    # of targets/rev_targets: weights/rev_weights for 'length', travel times in
+    # seconds computed once per weight for the others
+    def edge_weights(self, weight='length'):
+        if weight == 'length':
+            return self.weights, self.rev_weights
+        if weight not in self._edge_weights:
+            hour = parse_weight(weight)
+            self._edge_weights[weight] = (array('d', travel_times(self.weights, self.speeds, self.classes, hour).tobytes()),
+                                          array('d', travel_times(self.rev_weights, self.rev_speeds, self.rev_classes, hour).tobytes()))
+        return self._edge_weights[weight]
+
+    # Factor that turns a straight-line distance in meters into a lower bound of
+    # the cost of a weight, for the A* heuristics
+    def heuristic_scale(self, weight='length'):
+        return cost_per_meter(weight, self.max_speed)
+
+    # Edge costs rounded to integer multiples of resolution (meters, or seconds for
+    # the travel times) and the number of buckets dial needs for them (largest
+    # rounded cost + 1), computed once per resolution and weight
+    def integer_weights(self, resolution=1, weight='length'):
+        if (resolution, weight) not in self._integer_weights:
+            weights = [round(cost / resolution) for cost in self.edge_weights(weight)[0]]
+            self._integer_weights[(resolution, weight)] = (weights, max(weights, default=0) + 1)
+        return self._integer_weights[(resolution, weight)]
+
+    def location(self, node_id):
+        i = self.index[node_id]
+        return self.lats[i], self.lons[i]
+
+    # The py2neo connection is not picklable, worker processes only need the arrays
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['graph'] = None
+        return state
+
+# Cypher query to expand a whole batch of frontier nodes in a single round trip
+expand_query = '''
+    UNWIND $ids AS src
+    MATCH (u)-[r:ROAD_SEGMENT]->(v)
+    WHERE id(u) = src
+    RETURN src, id(v) AS dst, r.length AS length, r.max_speed AS max_speed, r.highway AS highway, r.lanes AS lanes,
+        v.location.latitude AS lat, v.location.longitude AS lon
+'''
+
+locate_query = '''
+    UNWIND $ids AS node_id
+    MATCH (i)
+    WHERE id(i) = node_id
+    RETURN node_id AS id, i.location.latitude AS lat, i.location.longitude AS lon
+'''
+
+# Server-side neighbor expansion for graphs that do not fit in memory.
+# Adjacency lists are fetched for many frontier nodes per query and kept in a
+# bounded LRU, so round trips grow with the search depth instead of the number
+# of expanded nodes. The cached edge costs are those of one weight
+class NeighborExpander:
+
+    def __init__(self, graph, cache_size=100000, batch_size=64, weight='length'):
+        parse_weight(weight)
+        self.graph = graph
+        self.cache_size = cache_size
+        self.batch_size = batch_size
+        self.weight = weight
+        self.adjacency = OrderedDict()  # node id -> [(dst, cost, lat, lon)]
+        self.round_trips = 0
+
+    def __contains__(self, node_id):
+        return node_id in self.adjacency
 
-def dijkstra(graph, start_id, end_id):
+    # Make sure the adjacency of every given node is cached, fetching the missing
+    # ones at once. Returns the fetched adjacency lists, which a small cache may
+    # already have evicted again
+    def expand(self, node_ids):
+        missing = [node_id for node_id in dict.fromkeys(node_ids) if node_id not in self.adjacency]
+        if not missing:
+            return {}
+        fetched = {node_id: [] for node_id in missing}
+        for record in self.graph.run(expand_query, ids=missing):
+            cost = edge_cost(self.weight, record['length'], record['max_speed'], record['highway'], record['lanes'])
+            fetched[record['src']].append((record['dst'], cost, record['lat'], record['lon']))
+        self.round_trips += 1
+        for node_id, neighbors in fetched.items():
+            self.adjacency[node_id] = neighbors
+        while len(self.adjacency) > self.cache_size:
+            self.adjacency.popitem(last=False)
+        return fetched
+
+    # Outgoing (neighbor id, cost, lat, lon) tuples of a node
+    def neighbors(self, node_id):
+        if node_id not in self.adjacency:
+            return self.expand([node_id])[node_id]
+        self.adjacency.move_to_end(node_id)
+        return self.adjacency[node_id]
+
+    # Coordinates of a few nodes (e.g. start and end of a search) in one round trip
+    def locate(self, node_ids):
+        self.round_trips += 1
+        return {record['id']: (record['lat'], record['lon']) for record in self.graph.run(locate_query, ids=list(node_ids))}
+
+    def clear(self):
+        self.adjacency.clear()
+
+# Rebuild a list of node ids from a predecessor dict
+def _reconstruct_path_from_dict(predecessors, end_id):
+    path = []
+    current = end_id
+    while current is not None:
+        path.append(current)
+        current = predecessors[current]
+    path.reverse()
+    return path
+
+# Rebuild the list of Neo4j ids from a predecessor array over contiguous node
+# indices (snapshot indices, or the local indices of a database search)
+def _reconstruct_path(node_ids, predecessors, end):
+    path = []
+    current = end
+    while current != -1:
+        path.append(node_ids[current])
+        current = predecessors[current]
+    path.reverse()
+    return path
+
+# Raised inside a search whose SearchControl has been cancelled
+class SearchCancelled(Exception):
+    pass
+
+# Progress and cancellation of a running search, shared with the thread that
+# started it. The search engines take it as control=: they count their settled
+# nodes in settled and raise SearchCancelled at the next one after cancel()
+class SearchControl:
+
+    def __init__(self):
+        self.settled = 0
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def step(self):
+        self.settled += 1
+        if self.cancelled:
+            raise SearchCancelled(f"Search cancelled after {self.settled} settled nodes")
+
+# Cypher query to resolve many street names in one round trip. The first branch
+# is an equality seek on the ROAD_SEGMENT.name index; the second one covers
+# segments whose name is a list (osmnx merged ways), which the importer also
+# stores as r.names: a scan of the r.names index, which only holds those segments
+street_nodes_query = '''
+    CALL {
+        UNWIND $names AS street
+        MATCH (i:Intersection)-[r:ROAD_SEGMENT]->()
+        WHERE r.name = street
+        RETURN street, i
+        UNION
+        MATCH (i:Intersection)-[r:ROAD_SEGMENT]->()
+        WHERE r.names IS NOT NULL
+        UNWIND [name IN r.names WHERE name IN $names] AS street
+        RETURN street, i
+    }
+    RETURN street, id(i) AS id, i.location.latitude AS lat, i.location.longitude AS lon
+'''
+
+# Function to search for the intersections of many streets at once. Returns the
+# de-duplicated node ids with their coordinates as NumPy arrays, and a dict
+# mapping every street name to the ids of its intersections
+@instrumented('find_streets_nodes')
+def find_streets_nodes(graph, street_names):
+    positions = {}
+    lats = []
+    lons = []
+    by_street = {name: [] for name in street_names}
+    for record in graph.run(street_nodes_query, names=list(street_names)):
+        node_id = record['id']
+        if node_id not in positions:
+            positions[node_id] = len(positions)
+            lats.append(record['lat'])
+            lons.append(record['lon'])
+        by_street[record['street']].append(node_id)
+
+    ids = np.fromiter(positions, dtype=np.int64, count=len(positions))
+    lats = np.array(lats, dtype=np.float64)
+    lons = np.array(lons, dtype=np.float64)
+    return ids, lats, lons, {name: np.array(sorted(set(nodes)), dtype=np.int64) for name, nodes in by_street.items()}
+
+# Function to search for nodes connected to a specific street, as (node id, (lat, lon)) pairs
+def find_street_nodes(graph, street_name):
+    ids, lats, lons, _ = find_streets_nodes(graph, [street_name])
+    return [(int(node_id), (float(lat), float(lon))) for node_id, lat, lon in zip(ids, lats, lons)]
+
+@instrumented('dijkstra', search=True)
+def dijkstra(graph, start_id, end_id, snapshot=None, weight='length', control=None):
     # Fetch all nodes and relationships to build the graph structure
-    nodes = list(graph.nodes.match("Intersection"))
-    rels = list(graph.relationships.match(r_type="ROAD_SEGMENT"))
-    
-    # Create adjacency list representation of the graph
-    adjacency_list = {node.identity: [] for node in nodes}
-    for rel in rels:
-        adjacency_list[rel.start_node.identity].append((rel.end_node.identity, rel['length']))
-    
+    if snapshot is None:
+        snapshot = RoadGraphSnapshot(graph)
+
+    if start_id not in snapshot.index or end_id not in snapshot.index:
+        return float('inf'), []
+    start, end = snapshot.index[start_id], snapshot.index[end_id]
+    offsets, targets, weights = snapshot.offsets, snapshot.targets, snapshot.edge_weights(weight)[0]
+
     # Initialize data structures for Dijkstra's algorithm
-    queue = [(0, start_id)]  # Priority queue: (distance, node_id)
-    distances = {node_id: float('inf') for node_id in adjacency_list}
-    distances[start_id] = 0
-    predecessors = {node_id: None for node_id in adjacency_list}
-    
+    queue = [(0, start)]  # Priority queue: (distance, node index)
+    distances = array('d', [float('inf')]) * len(snapshot)
+    distances[start] = 0
+    predecessors = array('q', [-1]) * len(snapshot)
+
     while queue:
         current_distance, current_node = heapq.heappop(queue)
-        
-        if current_node == end_id:
+
+        if current_node == end:
             break  # Stop if the target node has been reached
-        
-        for neighbor, weight in adjacency_list[current_node]:
-            distance = current_distance + weight
+
+        if current_distance > distances[current_node]:
+            continue  # Stale queue entry
+        if control is not None:
+            control.step()
+
+        for edge in range(offsets[current_node], offsets[current_node + 1]):
+            neighbor = targets[edge]
+            distance = current_distance + weights[edge]
             if distance < distances[neighbor]:
                 distances[neighbor] = distance
                 predecessors[neighbor] = current_node
                 heapq.heappush(queue, (distance, neighbor))
-                
-    # Reconstruct the shortest path from end_id to start_id
-    path = []
-    current_node = end_id
-    while current_node is not None:
-        path.insert(0, current_node)
-        current_node = predecessors[current_node]
-        
-    if path[0] == start_id:  # Ensure the path is valid
-        return distances[end_id], path
-    else:
+
+    # Reconstruct the shortest path from end to start
+    if distances[end] == float('inf'):
         return float('inf'), []
+    return distances[end], _reconstruct_path(snapshot.node_ids, predecessors, end)
 
 # Haversine formula to calculate the distance between two points on the Earth's surface
 def haversine(lat1, lon1, lat2, lon2):
@@ -81,8 +394,147 @@ def haversine(lat1, lon1, lat2, lon2):
     r = 6371  # Radius of Earth in kilometers. Use 3956 for miles
     return c * r
 
-# A* algorithm implementation
-def astar(graph, start_id, end_id):
+# Vectorized haversine in kilometers, from arrays of coordinates to one point (or
+# element-wise between arrays of the same shape)
+def haversine_vector(lats1, lons1, lat2, lon2):
+    lats1, lons1 = np.radians(lats1), np.radians(lons1)
+    lat2, lon2 = np.radians(lat2), np.radians(lon2)
+    a = np.sin((lat2 - lats1) / 2)**2 + np.cos(lats1) * np.cos(lat2) * np.sin((lon2 - lons1) / 2)**2
+    return 2 * np.arcsin(np.sqrt(a)) * 6371
+
+# Straight-line distances in meters from every snapshot node to one point, times
+# scale (see RoadGraphSnapshot.heuristic_scale), as a list for fast indexing in
+# the search loops. Nodes without a location get 0
+def haversine_estimates(snapshot, lat, lon, scale=1.0):
+    distances = haversine_vector(np.frombuffer(snapshot.lats), np.frombuffer(snapshot.lons), lat, lon) * 1000
+    return np.nan_to_num(distances * scale, nan=0.0).tolist()
+
+# Default A* heuristic: straight-line distance to the end node in meters, the
+# same unit as ROAD_SEGMENT.length. Any heuristic passed to astar takes the same arguments
+def haversine_heuristic(node_id, lat, lon, end_id, end_lat, end_lon):
+    return haversine(lat, lon, end_lat, end_lon) * 1000
+
+# A* over a RoadGraphSnapshot, no database round trips
+def _astar_snapshot(snapshot, start_id, end_id, heuristic, weight, stats, control):
+    if start_id not in snapshot.index or end_id not in snapshot.index:
+        return float('inf'), []
+    start, end = snapshot.index[start_id], snapshot.index[end_id]
+    offsets, targets, weights = snapshot.offsets, snapshot.targets, snapshot.edge_weights(weight)[0]
+    node_ids, lats, lons = snapshot.node_ids, snapshot.lats, snapshot.lons
+    end_lat, end_lon = lats[end], lons[end]
+    scale = snapshot.heuristic_scale(weight)
+    # The default heuristic is computed for all nodes at once, the loop only indexes it
+    estimates = haversine_estimates(snapshot, end_lat, end_lon, scale) if heuristic is haversine_heuristic else None
+
+    open_set = [(scale * heuristic(start_id, lats[start], lons[start], end_id, end_lat, end_lon), 0, start)]  # (f_score, g_score, node index)
+    g_score = array('d', [float('inf')]) * len(snapshot)
+    g_score[start] = 0
+    predecessors = array('q', [-1]) * len(snapshot)
+    visited = set()
+
+    while open_set:
+        _, current_g, current = heapq.heappop(open_set)
+
+        if current in visited:
+            continue
+        visited.add(current)
+        if control is not None:
+            control.step()
+
+        if current == end:
+            if stats is not None:
+                stats['settled'] = len(visited)
+            return current_g, _reconstruct_path(snapshot.node_ids, predecessors, end)
+
+        for edge in range(offsets[current], offsets[current + 1]):
+            neighbor = targets[edge]
+            temp_g_score = current_g + weights[edge]
+            if temp_g_score < g_score[neighbor]:
+                g_score[neighbor] = temp_g_score
+                predecessors[neighbor] = current
+                if estimates is not None:
+                    f_score = temp_g_score + estimates[neighbor]
+                else:
+                    f_score = temp_g_score + scale * heuristic(node_ids[neighbor], lats[neighbor], lons[neighbor], end_id, end_lat, end_lon)
+                heapq.heappush(open_set, (f_score, temp_g_score, neighbor))
+
+    if stats is not None:
+        stats['settled'] = len(visited)
+    return float('inf'), []
+
+# A* with batched neighbor expansion: when the popped node is not cached yet,
+# the best entries of the open set are expanded in the same query
+def _astar_batched(expander, start_id, end_id, heuristic, stats, control):
+    locations = expander.locate([start_id, end_id])
+    if start_id not in locations or end_id not in locations:
+        return float('inf'), []
+    start_lat, start_lon = locations[start_id]
+    end_lat, end_lon = locations[end_id]
+    # The edges are not known in advance, the speed of any segment is bounded by MAX_SPEED
+    scale = cost_per_meter(expander.weight)
+
+    open_set = [(scale * heuristic(start_id, start_lat, start_lon, end_id, end_lat, end_lon), 0, start_id)]  # (f_score, g_score, node_id)
+    g_score = {start_id: 0}
+    # Default heuristic of the neighbors of every fetched batch, computed in one vectorized call
+    estimates = {} if heuristic is haversine_heuristic else None
+    predecessors = {start_id: None}
+    visited = set()
+
+    while open_set:
+        _, current_g, current = heapq.heappop(open_set)
+
+        if current in visited:
+            continue
+        visited.add(current)
+        if control is not None:
+            control.step()
+
+        if current == end_id:
+            if stats is not None:
+                stats['settled'] = len(visited)
+            return current_g, _reconstruct_path_from_dict(predecessors, end_id)
+
+        if current not in expander:
+            frontier = [entry[2] for entry in heapq.nsmallest(expander.batch_size - 1, open_set) if entry[2] not in visited]
+            expander.expand([current] + frontier)
+            if estimates is not None:
+                rows = {neighbor: (lat, lon) for node_id in [current] + frontier if node_id in expander
+                        for neighbor, _, lat, lon in expander.adjacency[node_id] if neighbor not in estimates}
+                if rows:
+                    coordinates = np.array([location for location in rows.values()], dtype=np.float64)
+                    distances = np.nan_to_num(haversine_vector(coordinates[:, 0], coordinates[:, 1], end_lat, end_lon) * 1000 * scale, nan=0.0)
+                    estimates.update(zip(rows, distances.tolist()))
+
+        for neighbor, cost, lat, lon in expander.neighbors(current):
+            temp_g_score = current_g + cost
+            if temp_g_score < g_score.get(neighbor, float('inf')):
+                g_score[neighbor] = temp_g_score
+                predecessors[neighbor] = current
+                if estimates is not None and neighbor in estimates:
+                    f_score = temp_g_score + estimates[neighbor]
+                else:
+                    f_score = temp_g_score + scale * heuristic(neighbor, lat, lon, end_id, end_lat, end_lon)
+                heapq.heappush(open_set, (f_score, temp_g_score, neighbor))
+
+    if stats is not None:
+        stats['settled'] = len(visited)
+    return float('inf'), []
+
+# A* algorithm implementation. heuristic must be a lower bound of the remaining
+# length in meters (haversine_heuristic, or e.g. an ALT heuristic from landmarks.py);
+# for the travel time weights it is scaled to seconds at the highest speed.
+# With an expander, weight must be the one of the expander.
+# if stats is a dict, the number of settled nodes is stored in stats['settled']
+@instrumented('astar', search=True)
+def astar(graph, start_id, end_id, snapshot=None, expander=None, heuristic=haversine_heuristic, stats=None, weight='length', control=None):
+    if snapshot is not None:
+        return _astar_snapshot(snapshot, start_id, end_id, heuristic, weight, stats, control)
+    if expander is not None:
+        if expander.weight != weight:
+            raise ValueError(f"The expander caches '{expander.weight}' costs, not '{weight}'")
+        return _astar_batched(expander, start_id, end_id, heuristic, stats, control)
+    scale = cost_per_meter(weight)
+
     start_node = graph.nodes.get(start_id)
     end_node = graph.nodes.get(end_id)
     
@@ -90,48 +542,102 @@ def astar(graph, start_id, end_id):
     start_lat, start_lon = start_node['location'].latitude, start_node['location'].longitude
     end_lat, end_lon = end_node['location'].latitude, end_node['location'].longitude
 
+    # Nodes get contiguous local indices as they are discovered, scores and
+    # predecessors are kept in typed arrays over these indices
+    node_ids = [start_id]
+    index = {start_id: 0}
+    g_score = array('d', [0.0])
+    predecessors = array('q', [-1])
+    visited = bytearray(1)
+    settled = 0
+
     # Priority queue for A* algorithm
-    open_set = [(0 + haversine(start_lat, start_lon, end_lat, end_lon), 0, start_id, [])]  # (f_score, g_score, node_id, path)
-    
-    # Visited and cost dictionaries
-    visited = set()
-    g_score = {start_id: 0}
+    open_set = [(0 + scale * heuristic(start_id, start_lat, start_lon, end_id, end_lat, end_lon), 0, 0)]  # (f_score, g_score, local index)
 
     while open_set:
-        _, current_g, current, path = heapq.heappop(open_set)
-        
-        if current in visited:
-            continue
+        _, current_g, current = heapq.heappop(open_set)
 
-        visited.add(current)
-        path = path + [current]
+        if visited[current]:
+            continue
+        visited[current] = 1
+        settled += 1
+        if control is not None:
+            control.step()
 
-        if current == end_id:
-            return current_g, path
+        if node_ids[current] == end_id:
+            if stats is not None:
+                stats['settled'] = settled
+            return current_g, _reconstruct_path(node_ids, predecessors, current)
 
-        neighbors = graph.relationships.match(nodes=[graph.nodes.get(current)], r_type="ROAD_SEGMENT")
+        neighbors = graph.relationships.match(nodes=[graph.nodes.get(node_ids[current])], r_type="ROAD_SEGMENT")
         for rel in neighbors:
-            neighbor = rel.end_node
-            temp_g_score = current_g + rel['length']
-            
-            if neighbor.identity in visited and temp_g_score >= g_score.get(neighbor.identity, float('inf')):
-                continue
+            neighbor_node = rel.end_node
+            neighbor = index.get(neighbor_node.identity)
+            if neighbor is None:
+                neighbor = index[neighbor_node.identity] = len(node_ids)
+                node_ids.append(neighbor_node.identity)
+                g_score.append(float('inf'))
+                predecessors.append(-1)
+                visited.append(0)
 
-            if temp_g_score < g_score.get(neighbor.identity, float('inf')):
-                g_score[neighbor.identity] = temp_g_score
-                f_score = temp_g_score + haversine(neighbor['location'].latitude, neighbor['location'].longitude, end_lat, end_lon)
-                heapq.heappush(open_set, (f_score, temp_g_score, neighbor.identity, path))
+            temp_g_score = current_g + edge_cost(weight, rel['length'], rel['max_speed'], rel['highway'], rel['lanes'])
+            if temp_g_score < g_score[neighbor]:
+                g_score[neighbor] = temp_g_score
+                predecessors[neighbor] = current
+                f_score = temp_g_score + scale * heuristic(neighbor_node.identity, neighbor_node['location'].latitude, neighbor_node['location'].longitude, end_id, end_lat, end_lon)
+                heapq.heappush(open_set, (f_score, temp_g_score, neighbor))
 
+    if stats is not None:
+        stats['settled'] = settled
     return float('inf'), []
 
+# Cypher query to fetch the geometry of a whole route in one round trip: one row
+# per path node with its location and, except for the last node, the shortest
+# ROAD_SEGMENT to the next node (length, name and WKT geometry)
+route_geometry_query = '''
+    UNWIND range(0, size($ids) - 1) AS k
+    MATCH (u)
+    WHERE id(u) = $ids[k]
+    OPTIONAL MATCH (u)-[r:ROAD_SEGMENT]->(v)
+    WHERE k < size($ids) - 1 AND id(v) = $ids[k + 1]
+    WITH k, u, r
+    ORDER BY k, r.length
+    WITH k, u, collect(r)[0] AS r
+    RETURN k, u.location.latitude AS lat, u.location.longitude AS lon,
+        r.length AS length, r.name AS name, r.geometry AS geometry
+    ORDER BY k
+'''
+
+# (lon, lat) pairs of a WKT LINESTRING, None when there is no geometry
+def parse_linestring(wkt):
+    if not wkt or not wkt.startswith('LINESTRING'):
+        return None
+    points = wkt[wkt.index('(') + 1:wkt.rindex(')')]
+    return [tuple(float(value) for value in point.split()[:2]) for point in points.split(',')]
+
+# Coordinates of the path nodes plus length, name and shape of every segment,
+# fetched in a single query. Segments without a stored geometry (imported before
+# it was kept) are drawn as a straight line between their nodes
+@instrumented('fetch_route_geometry')
+def fetch_route_geometry(graph, path):
+    rows = graph.run(route_geometry_query, ids=list(path)).data() if path else []
+    geometry = {
+        'lats': np.array([row['lat'] for row in rows], dtype=np.float64),
+        'lons': np.array([row['lon'] for row in rows], dtype=np.float64),
+        'lengths': np.array([row['length'] if row['length'] is not None else np.nan for row in rows[:-1]], dtype=np.float64),
+        'names': [row['name'] for row in rows[:-1]],
+        'shapes': [],
+    }
+    for row, next_row in zip(rows, rows[1:]):
+        shape = parse_linestring(row['geometry'])
+        geometry['shapes'].append(shape or [(row['lon'], row['lat']), (next_row['lon'], next_row['lat'])])
+    return geometry
+
 def plot_route(graph, path, color, label):
-    x_coords = []
-    y_coords = []
-    for node_id in path:
-        node = graph.nodes.get(node_id)
-        x_coords.append(node['location'].longitude)
-        y_coords.append(node['location'].latitude)
-    plt.plot(x_coords, y_coords, color=color, label=label, linewidth=2)
+    geometry = fetch_route_geometry(graph, path)
+    x_coords, y_coords = geometry['lons'], geometry['lats']
+    for i, shape in enumerate(geometry['shapes']):
+        plt.plot([x for x, _ in shape], [y for _, y in shape], color=color, label=label if i == 0 else None, linewidth=2)
     # Starting point
     plt.scatter(x_coords[0], y_coords[0], c='purple', edgecolor='black', label='Start', zorder=5)
     # Finishing poin
@@ -139,32 +645,365 @@ def plot_route(graph, path, color, label):
     # Rest of the route
     plt.scatter(x_coords[1:-1], y_coords[1:-1], c=color)
 
-def bfs(graph, start_id, end_id):
-    queue = deque([(start_id, 0, [])])  # Queue: (node_id, distance, path)
-    visited = set()
+# Level-synchronous BFS over a snapshot. Nodes are marked when they are enqueued,
+# so each one enters the frontier once; max_hops bounds the number of levels
+def _bfs_snapshot(snapshot, start_id, end_id, max_hops, weight, control):
+    if start_id not in snapshot.index or end_id not in snapshot.index:
+        return float('inf'), []
+    start, end = snapshot.index[start_id], snapshot.index[end_id]
+    offsets, targets, weights = snapshot.offsets, snapshot.targets, snapshot.edge_weights(weight)[0]
 
-    while queue:
-        current_node, distance, path = queue.popleft()
-        if current_node == end_id:
-            return distance, path + [current_node]
+    frontier = [start]
+    distances = array('d', [float('inf')]) * len(snapshot)
+    distances[start] = 0
+    predecessors = array('q', [-1]) * len(snapshot)
+    hops = 0
+
+    while frontier:
+        if distances[end] != float('inf'):
+            return distances[end], _reconstruct_path(snapshot.node_ids, predecessors, end)
+        if max_hops is not None and hops >= max_hops:
+            break
+
+        next_frontier = []
+        for current_node in frontier:
+            if control is not None:
+                control.step()
+            for edge in range(offsets[current_node], offsets[current_node + 1]):
+                neighbor = targets[edge]
+                if distances[neighbor] == float('inf') and neighbor != start:
+                    distances[neighbor] = distances[current_node] + weights[edge]
+                    predecessors[neighbor] = current_node
+                    next_frontier.append(neighbor)
+        frontier = next_frontier
+        hops += 1
+
+    return float('inf'), []
+
+# Level-synchronous BFS against the database: every level of the search is
+# expanded in one query
+def _bfs_batched(expander, start_id, end_id, max_hops, control):
+    distances = {start_id: 0}
+    predecessors = {start_id: None}
+    frontier = [start_id]
+    hops = 0
+
+    while frontier:
+        if end_id in distances:
+            return distances[end_id], _reconstruct_path_from_dict(predecessors, end_id)
+        if max_hops is not None and hops >= max_hops:
+            break
+
+        expander.expand(frontier)
+        next_frontier = []
+        for current_node in frontier:
+            if control is not None:
+                control.step()
+            for neighbor, cost, _, _ in expander.neighbors(current_node):
+                if neighbor not in distances:
+                    distances[neighbor] = distances[current_node] + cost
+                    predecessors[neighbor] = current_node
+                    next_frontier.append(neighbor)
+        frontier = next_frontier
+        hops += 1
+
+    return float('inf'), []
 
-        if current_node in visited:
+# Hop-bounded breadth-first search. Returns the path with the fewest road
+# segments and its summed cost, which is not the shortest cost in general
+# (use dijkstra or dial for that), or (inf, []) if the end is more than
+# max_hops segments away. With an expander every BFS level is one query
+@instrumented('bfs', search=True)
+def bfs(graph, start_id, end_id, snapshot=None, expander=None, max_hops=None, weight='length', control=None):
+    if snapshot is not None:
+        return _bfs_snapshot(snapshot, start_id, end_id, max_hops, weight, control)
+    if expander is not None:
+        if expander.weight != weight:
+            raise ValueError(f"The expander caches '{expander.weight}' costs, not '{weight}'")
+        return _bfs_batched(expander, start_id, end_id, max_hops, control)
+    parse_weight(weight)
+
+    # Local indices as in astar; nodes are marked visited when they are enqueued
+    node_ids = [start_id]
+    index = {start_id: 0}
+    predecessors = array('q', [-1])
+    distances = array('d', [0.0])
+    queue = deque([(0, 0)])  # Queue: (local index, hops)
+
+    while queue:
+        current_node, hops = queue.popleft()
+        if control is not None:
+            control.step()
+        if node_ids[current_node] == end_id:
+            return distances[current_node], _reconstruct_path(node_ids, predecessors, current_node)
+        if max_hops is not None and hops >= max_hops:
             continue
 
-        visited.add(current_node)
-        neighbors = graph.relationships.match(nodes=[graph.nodes.get(current_node)], r_type="ROAD_SEGMENT")
-        
+        neighbors = graph.relationships.match(nodes=[graph.nodes.get(node_ids[current_node])], r_type="ROAD_SEGMENT")
         for rel in neighbors:
-            neighbor = rel.end_node
-            queue.append((neighbor.identity, distance + rel['length'], path + [current_node]))
+            if rel.end_node.identity in index:
+                continue
+            index[rel.end_node.identity] = len(node_ids)
+            node_ids.append(rel.end_node.identity)
+            predecessors.append(current_node)
+            distances.append(distances[current_node] + edge_cost(weight, rel['length'], rel['max_speed'], rel['highway'], rel['lanes']))
+            queue.append((len(node_ids) - 1, hops + 1))
 
     return float('inf'), []
 
+# Dial's algorithm: Dijkstra with a circular array of buckets instead of a binary
+# heap, over costs rounded to integer multiples of resolution (meters, or seconds
+# for the travel times). Every bucket holds the nodes at one rounded distance, so
+# a queue operation is O(1). The path is the shortest one for the rounded costs,
+# the returned cost is its exact cost
+@instrumented('dial', search=True)
+def dial(graph, start_id, end_id, snapshot=None, resolution=1, weight='length', control=None):
+    if snapshot is None:
+        snapshot = RoadGraphSnapshot(graph)
+    if start_id not in snapshot.index or end_id not in snapshot.index:
+        return float('inf'), []
+    start, end = snapshot.index[start_id], snapshot.index[end_id]
+    offsets, targets = snapshot.offsets, snapshot.targets
+    integer_weights, num_buckets = snapshot.integer_weights(resolution, weight)
+
+    buckets = [[] for _ in range(num_buckets)]
+    unreached = len(snapshot) * num_buckets  # Larger than any rounded distance
+    distances = [unreached] * len(snapshot)
+    predecessors = array('q', [-1]) * len(snapshot)
+    distances[start] = 0
+    buckets[0].append(start)
+    pending = 1
+    distance = 0
+
+    while pending:
+        bucket = buckets[distance % num_buckets]
+        while bucket:
+            current_node = bucket.pop()
+            pending -= 1
+            if distances[current_node] != distance:
+                continue  # Improved since it was put in this bucket
+            if control is not None:
+                control.step()
+            if current_node == end:
+                path = _reconstruct_path(snapshot.node_ids, predecessors, end)
+                return _path_length(snapshot, path, weight), path
+
+            for edge in range(offsets[current_node], offsets[current_node + 1]):
+                neighbor = targets[edge]
+                new_distance = distance + integer_weights[edge]
+                if new_distance < distances[neighbor]:
+                    distances[neighbor] = new_distance
+                    predecessors[neighbor] = current_node
+                    buckets[new_distance % num_buckets].append(neighbor)
+                    pending += 1
+        distance += 1
+
+    return float('inf'), []
+
+# Exact cost of a path of node ids over the snapshot (cheapest parallel segment)
+def _path_length(snapshot, path, weight='length'):
+    offsets, targets, weights = snapshot.offsets, snapshot.targets, snapshot.edge_weights(weight)[0]
+    length = 0
+    for u, v in zip(path, path[1:]):
+        u_index, v_index = snapshot.index[u], snapshot.index[v]
+        length += min(weights[edge] for edge in range(offsets[u_index], offsets[u_index + 1]) if targets[edge] == v_index)
+    return length
+
+# Bidirectional search over a snapshot: forward over ROAD_SEGMENT from the start,
+# backward over the reversed edges from the end. With a potential function the
+# keys are shifted by the consistent average potentials (bidirectional A*),
+# without it this is plain bidirectional Dijkstra
+def _bidirectional_search(snapshot, start_id, end_id, potential=None, weight='length', control=None):
+    if start_id not in snapshot.index or end_id not in snapshot.index:
+        return float('inf'), []
+    start, end = snapshot.index[start_id], snapshot.index[end_id]
+    if start == end:
+        return 0, [start_id]
+
+    n = len(snapshot)
+    potentials = [None] * n
+    def key_shift(i):
+        if potential is None:
+            return 0
+        if potentials[i] is None:
+            potentials[i] = potential(i)
+        return potentials[i]
+
+    # Per direction: (offsets, targets, weights, distances, predecessors, settled, queue, sign)
+    weights, rev_weights = snapshot.edge_weights(weight)
+    forward = (snapshot.offsets, snapshot.targets, weights, [float('inf')] * n, [-1] * n, [False] * n, [], 1)
+    backward = (snapshot.rev_offsets, snapshot.rev_targets, rev_weights, [float('inf')] * n, [-1] * n, [False] * n, [], -1)
+    forward[3][start] = 0
+    backward[3][end] = 0
+    heapq.heappush(forward[6], (key_shift(start), start))
+    heapq.heappush(backward[6], (-key_shift(end), end))
+
+    best = float('inf')
+    meeting = -1
+    while forward[6] and backward[6]:
+        # Meeting condition: no better path can be found through unsettled nodes
+        if forward[6][0][0] + backward[6][0][0] >= best:
+            break
+
+        # Advance the direction with the smaller queue
+        this, other = (forward, backward) if len(forward[6]) <= len(backward[6]) else (backward, forward)
+        offsets, targets, weights, distances, predecessors, settled, queue, sign = this
+        _, current = heapq.heappop(queue)
+        if settled[current]:
+            continue
+        settled[current] = True
+        if control is not None:
+            control.step()
+
+        for edge in range(offsets[current], offsets[current + 1]):
+            neighbor = targets[edge]
+            distance = distances[current] + weights[edge]
+            if distance < distances[neighbor]:
+                distances[neighbor] = distance
+                predecessors[neighbor] = current
+                heapq.heappush(queue, (distance + sign * key_shift(neighbor), neighbor))
+            if distance + other[3][neighbor] < best:
+                best = distance + other[3][neighbor]
+                meeting = neighbor
+
+    if meeting == -1:
+        return float('inf'), []
+
+    path = _reconstruct_path(snapshot.node_ids, forward[4], meeting)
+    current = backward[4][meeting]
+    while current != -1:
+        path.append(snapshot.node_ids[current])
+        current = backward[4][current]
+    return best, path
+
+@instrumented('bidirectional_dijkstra', search=True)
+def bidirectional_dijkstra(graph, start_id, end_id, snapshot=None, weight='length', control=None):
+    if snapshot is None:
+        snapshot = RoadGraphSnapshot(graph)
+    return _bidirectional_search(snapshot, start_id, end_id, weight=weight, control=control)
+
+@instrumented('bidirectional_astar', search=True)
+def bidirectional_astar(graph, start_id, end_id, snapshot=None, weight='length', control=None):
+    if snapshot is None:
+        snapshot = RoadGraphSnapshot(graph)
+    if start_id not in snapshot.index or end_id not in snapshot.index:
+        return float('inf'), []
+    start_lat, start_lon = snapshot.location(start_id)
+    end_lat, end_lon = snapshot.location(end_id)
+
+    # Average of the forward and backward straight-line estimates, in units of
+    # the weight, for every node at once
+    scale = snapshot.heuristic_scale(weight)
+    to_end = np.array(haversine_estimates(snapshot, end_lat, end_lon, scale))
+    from_start = np.array(haversine_estimates(snapshot, start_lat, start_lon, scale))
+    potentials = ((to_end - from_start) / 2).tolist()
+
+    def potential(i):
+        return potentials[i]
+
+    return _bidirectional_search(snapshot, start_id, end_id, potential, weight, control)
+
+# Snapshot shared by the distance matrix worker processes
+_worker_snapshot = None
+
+def _init_worker(snapshot):
+    global _worker_snapshot
+    _worker_snapshot = snapshot
+
+# Single-source Dijkstra that stops once every target has been settled
+def _one_to_many(snapshot, source, targets, with_predecessors, weight='length'):
+    offsets, targets_array, weights = snapshot.offsets, snapshot.targets, snapshot.edge_weights(weight)[0]
+    distances = [float('inf')] * len(snapshot)
+    predecessors = [-1] * len(snapshot)
+    distances[source] = 0
+    remaining = set(targets)
+    queue = [(0, source)]
+    while queue and remaining:
+        current_distance, current_node = heapq.heappop(queue)
+        if current_distance > distances[current_node]:
+            continue
+        remaining.discard(current_node)
+        for edge in range(offsets[current_node], offsets[current_node + 1]):
+            neighbor = targets_array[edge]
+            distance = current_distance + weights[edge]
+            if distance < distances[neighbor]:
+                distances[neighbor] = distance
+                predecessors[neighbor] = current_node
+                heapq.heappush(queue, (distance, neighbor))
+    row = [distances[target] for target in targets]
+    return row, (predecessors if with_predecessors else None)
+
+def _one_to_many_worker(source, targets, with_predecessors, weight):
+    return _one_to_many(_worker_snapshot, source, targets, with_predecessors, weight)
+
+# Many-to-many shortest path costs: one early-terminating Dijkstra per source,
+# spread over a process pool that shares one read-only snapshot. Returns a
+# (sources x targets) NumPy matrix (inf when unreachable) and, if requested, a
+# (sources x nodes) matrix of predecessor snapshot indices for matrix_path
+def distance_matrix(graph, sources, targets, snapshot=None, processes=None, predecessors=False, weight='length'):
+    if snapshot is None:
+        snapshot = RoadGraphSnapshot(graph)
+    parse_weight(weight)
+    for node_id in list(sources) + list(targets):
+        if node_id not in snapshot.index:
+            raise KeyError(f"Node {node_id} is not an Intersection of the road network")
+    source_indices = [snapshot.index[node_id] for node_id in sources]
+    target_indices = [snapshot.index[node_id] for node_id in targets]
+
+    matrix = np.full((len(source_indices), len(target_indices)), np.inf)
+    predecessor_matrix = np.full((len(source_indices), len(snapshot)), -1, dtype=np.int64) if predecessors else None
+
+    if processes == 1 or len(source_indices) <= 1:
+        results = (_one_to_many(snapshot, source, target_indices, predecessors, weight) for source in source_indices)
+        pool = None
+    else:
+        pool = ProcessPoolExecutor(max_workers=processes, initializer=_init_worker, initargs=(snapshot,))
+        results = pool.map(_one_to_many_worker, source_indices, [target_indices] * len(source_indices),
+                           [predecessors] * len(source_indices), [weight] * len(source_indices))
+    try:
+        for row, (distances, predecessor_row) in enumerate(results):
+            matrix[row] = distances
+            if predecessors:
+                predecessor_matrix[row] = predecessor_row
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    if predecessors:
+        return matrix, predecessor_matrix
+    return matrix
+
+# Path from source_id to target_id using the distance_matrix predecessor row of source_id
+def matrix_path(snapshot, predecessor_row, source_id, target_id):
+    target = snapshot.index[target_id]
+    if target_id != source_id and predecessor_row[target] == -1:
+        return []
+    return _reconstruct_path(snapshot.node_ids, predecessor_row.tolist(), target)
+
+# Search engines selectable by name, all returning (cost, path) and taking weight=
+engines = {
+    'dijkstra': dijkstra,
+    'astar': astar,
+    'bfs': bfs,
+    'dial': dial,
+    'bidirectional_dijkstra': bidirectional_dijkstra,
+    'bidirectional_astar': bidirectional_astar,
+}
+
+@instrumented('shortest_path', search=True)
+def shortest_path(graph, start_id, end_id, engine='dijkstra', snapshot=None, weight='length', control=None):
+    if engine not in engines:
+        raise ValueError(f"Unknown search engine '{engine}', expected one of {sorted(engines)}")
+    return engines[engine](graph, start_id, end_id, snapshot=snapshot, weight=weight, control=control)
+
 # Main code
 if __name__ == "__main__":
     # Connect to Neo4j
     graph = Graph("bolt://localhost:7687", auth=None)
 
+    # Load the road network once and reuse it for every search below
+    snapshot = RoadGraphSnapshot(graph)
+
     # Call the function with the name of the street
     street_name = "Avenida de la Reina Mercedes"
     street_nodes = find_street_nodes(graph, street_name)
@@ -188,7 +1027,7 @@ if __name__ == "__main__":
     # Calculate Dijkstra shortest path
     start_node_id = 4566  
     end_node_id = 766  
-    cost, dijkstra_path = dijkstra(graph, start_node_id, end_node_id)
+    cost, dijkstra_path = dijkstra(graph, start_node_id, end_node_id, snapshot=snapshot)
     
     print("Dijkstra shortest path from node", start_node_id, "to node", end_node_id, ":")
     print("Shortest path cost:", cost, "meters")
@@ -198,7 +1037,7 @@ if __name__ == "__main__":
     # Calculate A* shortest path
     start_node_id = 4566  
     end_node_id = 766  
-    cost, astar_path = astar(graph, start_node_id, end_node_id)
+    cost, astar_path = astar(graph, start_node_id, end_node_id, snapshot=snapshot)
         
     print("A* shortest path from node", start_node_id, "to node", end_node_id, ":")
     print("Shortest path cost:", cost, "meters") 
@@ -208,7 +1047,7 @@ if __name__ == "__main__":
     # Calculate BFS shortest path
     start_node_id = 4566  
     end_node_id = 766  
-    cost, bfs_path = bfs(graph, start_node_id, end_node_id)
+    cost, bfs_path = bfs(graph, start_node_id, end_node_id, snapshot=snapshot)
         
     print("BFS shortest path from node", start_node_id, "to node", end_node_id, ":")
     print("Shortest path length:", cost)
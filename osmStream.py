@@ -0,0 +1,199 @@
+import multiprocessing
+import os
+import queue
+import resource
+import tempfile
+from math import radians, cos, sin, asin, sqrt
+
+# pyosmium is only needed for the streaming ingest of local .osm.pbf/.osm files
+try:
+    import osmium
+except ImportError:
+    osmium = None
+
+# Highway values osmnx excludes from its 'drive' network
+EXCLUDED_HIGHWAYS = {
+    'abandoned', 'bridleway', 'bus_guideway', 'construction', 'corridor', 'cycleway', 'elevator',
+    'escalator', 'footway', 'no', 'path', 'pedestrian', 'planned', 'platform', 'proposed',
+    'raceway', 'razed', 'service', 'steps', 'track',
+}
+EXCLUDED_SERVICES = {'alley', 'driveway', 'emergency_access', 'parking', 'parking_aisle', 'private'}
+
+# Same filter as osmnx's network_type="drive"
+def is_drive_way(tags):
+    highway = tags.get('highway')
+    if highway is None or highway in EXCLUDED_HIGHWAYS:
+        return False
+    if tags.get('area') == 'yes' or tags.get('access') == 'private':
+        return False
+    if tags.get('motor_vehicle') == 'no' or tags.get('motorcar') == 'no':
+        return False
+    return tags.get('service') not in EXCLUDED_SERVICES
+
+# Great-circle distance in meters, with the Earth radius osmnx uses for edge lengths
+def _distance(lat1, lon1, lat2, lon2):
+    lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
+    a = sin((lat2 - lat1) / 2)**2 + cos(lat1) * cos(lat2) * sin((lon2 - lon1) / 2)**2
+    return 2 * asin(sqrt(a)) * 6371009
+
+# WKT LINESTRING of (lon, lat) points, the ROAD_SEGMENT.geometry format
+def _linestring(points):
+    return 'LINESTRING (' + ', '.join(f"{lon} {lat}" for lon, lat in points) + ')'
+
+def _require_osmium():
+    if osmium is None:
+        raise ImportError("Streaming OSM ingest requires pyosmium: pip install osmium")
+
+# First pass: the intersections (nodes shared by several drive ways, and way
+# endpoints, like in osmnx) and how many street pieces meet at each of them (two
+# for an inner node, one for an endpoint). Node ids go to osmium IdSets (bit
+# sets), only the intersections get a street count
+def _count_node_references(path):
+    seen = osmium.index.IdSet()
+    intersections = osmium.index.IdSet()
+    streets = {}
+
+    class WayCounter(osmium.SimpleHandler):
+        def way(self, w):
+            if not is_drive_way(w.tags):
+                return
+            refs = [node.ref for node in w.nodes]
+            last = len(refs) - 1
+            for i, ref in enumerate(refs):
+                pieces = 1 if i in (0, last) else 2
+                if ref in intersections:
+                    streets[ref] += pieces
+                elif ref in seen or pieces == 1:
+                    # Second reference, or an endpoint: an inner node seen before counted two pieces
+                    streets[ref] = (2 if ref in seen else 0) + pieces
+                    intersections.set(ref)
+                else:
+                    seen.set(ref)
+
+    WayCounter().apply_file(path)
+    return intersections, streets
+
+# Stream the drive network of a local OSM file into the node_query/rels_query
+# row format of osmToNeo4j.py. Ways are split at intersections (nodes shared
+# by several ways, and way endpoints). Batches of at most batch_size rows are
+# handed to node_sink and segment_sink; pending nodes are always flushed before
+# a segment batch, so the segments' MATCH on their endpoints succeeds. Node
+# locations go to a file-backed index, memory only holds the id sets and the
+# street counts of the intersections
+def stream_osm_file(path, node_sink, segment_sink, batch_size=10000):
+    _require_osmium()
+    intersections, streets = _count_node_references(path)
+    node_batch = []
+    segment_batch = []
+    emitted = osmium.index.IdSet()
+    node_tags = {}
+    totals = {'nodes': 0, 'segments': 0}
+
+    def flush_nodes():
+        if node_batch:
+            node_sink(list(node_batch))
+            totals['nodes'] += len(node_batch)
+            node_batch.clear()
+
+    def flush_segments():
+        flush_nodes()
+        if segment_batch:
+            segment_sink(list(segment_batch))
+            totals['segments'] += len(segment_batch)
+            segment_batch.clear()
+
+    def emit_node(ref, location):
+        if ref in emitted:
+            return
+        emitted.set(ref)
+        highway, node_ref = node_tags.get(ref, (None, None))
+        node_batch.append({'osmid': ref, 'y': location.lat, 'x': location.lon, 'ref': node_ref,
+                           'highway': highway, 'street_count': streets[ref]})
+        if len(node_batch) >= batch_size:
+            flush_nodes()
+
+    class SegmentEmitter(osmium.SimpleHandler):
+        # Nodes come before ways in sorted files: keep the tags of intersections only
+        def node(self, n):
+            if n.id in intersections and 'highway' in n.tags:
+                node_tags[n.id] = (n.tags.get('highway'), n.tags.get('ref'))
+
+        def way(self, w):
+            if not is_drive_way(w.tags):
+                return
+            tags = w.tags
+            oneway_tag = tags.get('oneway')
+            oneway = oneway_tag in ('yes', 'true', '1', '-1') or tags.get('junction') == 'roundabout'
+            refs = [(node.ref, node.location) for node in w.nodes if node.location.valid()]
+            if oneway_tag == '-1':
+                refs.reverse()
+            properties = {'osmid': w.id, 'oneway': oneway, 'lanes': tags.get('lanes'), 'ref': tags.get('ref'),
+                          'name': tags.get('name'), 'highway': tags.get('highway'), 'maxspeed': tags.get('maxspeed')}
+
+            start = 0
+            length = 0.0
+            for i in range(1, len(refs)):
+                length += _distance(refs[i - 1][1].lat, refs[i - 1][1].lon, refs[i][1].lat, refs[i][1].lon)
+                if refs[i][0] not in intersections and i != len(refs) - 1:
+                    continue
+                u, v = refs[start], refs[i]
+                emit_node(*u)
+                emit_node(*v)
+                points = [(location.lon, location.lat) for _, location in refs[start:i + 1]]
+                segment_batch.append(dict(properties, u=u[0], v=v[0], length=length, geometry=_linestring(points)))
+                if not oneway:
+                    segment_batch.append(dict(properties, u=v[0], v=u[0], length=length, geometry=_linestring(points[::-1])))
+                if len(segment_batch) >= batch_size:
+                    flush_segments()
+                start = i
+                length = 0.0
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        SegmentEmitter().apply_file(path, locations=True, idx=f'sparse_file_array,{os.path.join(tmp_dir, "locations")}')
+    flush_segments()
+    return totals
+
+# Peak resident set size of the current process in megabytes (Linux reports kB)
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def _measure_stream(path, results):
+    totals = stream_osm_file(path, lambda rows: None, lambda rows: None)
+    results.put(('stream', peak_rss_mb(), totals))
+
+def _measure_osmnx(path, results):
+    import osmnx as ox
+    G = ox.graph_from_xml(path, simplify=True)
+    gdf_nodes, gdf_relationships = ox.graph_to_gdfs(G)
+    gdf_nodes = gdf_nodes.reset_index().drop(columns=['geometry'])
+    gdf_relationships = gdf_relationships.reset_index().drop(columns=['geometry'])
+    records = (gdf_nodes.to_dict('records'), gdf_relationships.to_dict('records'))
+    results.put(('osmnx', peak_rss_mb(), {'nodes': len(records[0]), 'segments': len(records[1])}))
+
+# Peak memory of the streaming ingest vs the osmnx path on the same extract, each
+# measured in a fresh process. osmnx only reads OSM XML, so pass an .osm file;
+# graph_from_xml keeps every way, a drive-only extract gives comparable row counts
+def compare_memory(path, poll_interval=1.0):
+    if not path.lower().endswith(('.osm', '.osm.bz2')):
+        raise ValueError(f"osmnx only reads OSM XML, expected an .osm file, got {path}")
+    _require_osmium()
+    context = multiprocessing.get_context('spawn')
+    report = {}
+    for name, target in (('stream', _measure_stream), ('osmnx', _measure_osmnx)):
+        results = context.Queue()
+        process = context.Process(target=target, args=(path, results))
+        process.start()
+        # Polled: a measurement killed (OOM) or failing before its put would block a plain get() forever
+        while True:
+            alive = process.is_alive()
+            try:
+                # One more get after the exit, the result may have been sent just before
+                _, peak, totals = results.get(timeout=poll_interval)
+                break
+            except queue.Empty:
+                if not alive:
+                    process.join()
+                    raise RuntimeError(f"The {name} measurement of {path} exited with code {process.exitcode} without a result")
+        process.join()
+        report[name] = {'peak_rss_mb': round(peak, 1), **totals}
+    return report
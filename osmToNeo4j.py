@@ -1,32 +1,49 @@
+import argparse
+import csv
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 import neo4j
+from neo4j.exceptions import ServiceUnavailable, SessionExpired, TransientError
 import osmnx as ox
+import pandas as pd
+import instrumentation
+from graphFile import export_from_geodataframes
+from instrumentation import LoggingExporter, PrometheusExporter, instrumented
+from osmStream import compare_memory, stream_osm_file
 
 # Local bolt connection
 NEO4J_URI = "bolt://localhost:7687"
 
-# Neo4j driver with no auth
-driver = neo4j.GraphDatabase.driver(NEO4J_URI, auth=None)
+# Default region to import
+PLACE = "Sevilla, Andalucía, España"
 
-# Cypher queries to delete all nodes and relationships
-delete_all_nodes_query = "MATCH (n) DETACH DELETE n"
-delete_all_rels_query = "MATCH ()-[r]-() DELETE r"
-
-# Execute queries to delete all nodes and relationships
-with driver.session() as session:
-    session.run(delete_all_rels_query)
-    session.run(delete_all_nodes_query)
-
-# Search OpenStreetMap and create an OSMNx graph
-G = ox.graph_from_place("Sevilla, Andalucía, España", network_type="drive")
-
-gdf_nodes, gdf_relationships = ox.graph_to_gdfs(G)
-gdf_nodes.reset_index(inplace=True)
-gdf_relationships.reset_index(inplace=True)
+# Cypher queries to delete all nodes and relationships in bounded chunks,
+# so large regions do not have to fit in a single transaction. The GraphMeta
+# node is kept so the graph version keeps increasing across reloads
+delete_rels_batch_query = '''
+    MATCH ()-[r]->()
+    WITH r LIMIT $limit
+    DELETE r
+    RETURN COUNT(*) AS total
+'''
+delete_nodes_batch_query = '''
+    MATCH (n)
+    WHERE NOT n:GraphMeta
+    WITH n LIMIT $limit
+    DETACH DELETE n
+    RETURN COUNT(*) AS total
+'''
 
 # Define Cypher queries to create constraints and indexes
 constraint_query = "CREATE CONSTRAINT IF NOT EXISTS FOR (i:Intersection) REQUIRE i.osmid IS UNIQUE"
 rel_index_query = "CREATE INDEX IF NOT EXISTS FOR ()-[r:ROAD_SEGMENT]-() ON r.osmids"
 point_index_query = "CREATE POINT INDEX IF NOT EXISTS FOR (i:Intersection) ON i.location"
+rel_name_index_query = "CREATE INDEX IF NOT EXISTS FOR ()-[r:ROAD_SEGMENT]-() ON r.name"
+rel_names_index_query = "CREATE INDEX IF NOT EXISTS FOR ()-[r:ROAD_SEGMENT]-() ON r.names"
 
 # Cypher query to import road network nodes GeoDataFrame
 # UNWIND -> iterate over rows
@@ -42,7 +59,10 @@ node_query = '''
     RETURN COUNT(*) as total
 '''
 
-# Cypher query to import road network relationships GeoDataFrame
+# Cypher query to import road network relationships GeoDataFrame. Segments of
+# merged ways (osmnx lists their names) also get the list as r.names, so street
+# lookups find them through the r.names index: [] + name is always a list, and a
+# plain string is the only value equal to the head of a one-element list
 rels_query = '''
     UNWIND $rows AS road
     MATCH (u:Intersection {osmid: road.u})
@@ -52,36 +72,601 @@ rels_query = '''
             r.lanes = road.lanes,
             r.ref = road.ref,
             r.name = road.name,
+            r.names = CASE WHEN road.name IS NOT NULL AND (size([] + road.name) <> 1 OR road.name <> head([] + road.name)) THEN road.name END,
             r.highway = road.highway,
             r.max_speed = road.maxspeed,
-            r.length = toFloat(road.length)
+            r.length = toFloat(road.length),
+            r.geometry = road.geometry
+    RETURN COUNT(*) AS total
+'''
+
+# Cypher query to bump the graph version stamp after every load, route caches
+# (routeCache.py) drop their entries when it changes
+graph_version_query = '''
+    MERGE (m:GraphMeta {name: 'road_network'})
+    SET m.version = coalesce(m.version, 0) + 1,
+        m.updated_at = datetime()
+    RETURN m.version AS version
+'''
+
+# Cypher query to fill r.names on graphs imported before it existed; the delta
+# import only rewrites changed segments
+backfill_names_query = '''
+    MATCH ()-[r:ROAD_SEGMENT]->()
+    WHERE r.names IS NULL AND r.name IS NOT NULL AND (size([] + r.name) <> 1 OR r.name <> head([] + r.name))
+    SET r.names = r.name
+    RETURN COUNT(*) AS total
+'''
+
+# Cypher queries for incremental (delta) imports keyed on osmid
+existing_nodes_query = '''
+    MATCH (i:Intersection)
+    RETURN i.osmid AS osmid, i.location.latitude AS y, i.location.longitude AS x,
+        i.ref AS ref, i.highway AS highway, i.street_count AS street_count
+'''
+existing_rels_query = '''
+    MATCH (u:Intersection)-[r:ROAD_SEGMENT]->(v:Intersection)
+    RETURN u.osmid AS u, v.osmid AS v, r.osmid AS osmid, r.oneway AS oneway, r.lanes AS lanes, r.ref AS ref,
+        r.name AS name, r.highway AS highway, r.max_speed AS maxspeed, r.length AS length, r.geometry AS geometry
+'''
+update_nodes_query = '''
+    UNWIND $rows AS row
+    MATCH (i:Intersection {osmid: row.osmid})
+    SET i.location = point({latitude: row.y, longitude: row.x }),
+        i.ref = row.ref,
+        i.highway = row.highway,
+        i.street_count = toInteger(row.street_count)
+    RETURN COUNT(*) AS total
+'''
+delete_nodes_query = '''
+    UNWIND $rows AS row
+    MATCH (i:Intersection {osmid: row.osmid})
+    DETACH DELETE i
     RETURN COUNT(*) AS total
 '''
+delete_rels_query = '''
+    UNWIND $rows AS road
+    MATCH (u:Intersection {osmid: road.u})-[r:ROAD_SEGMENT]->(v:Intersection {osmid: road.v})
+    WHERE r.osmid = road.osmid
+    DELETE r
+    RETURN COUNT(*) AS total
+'''
+
+# Properties compared by the delta import, as named in the GeoDataFrames
+node_properties = ['y', 'x', 'ref', 'highway', 'street_count']
+segment_properties = ['oneway', 'lanes', 'ref', 'name', 'highway', 'maxspeed', 'length', 'geometry']
+
+# neo4j-admin database import layout: (GeoDataFrame column, CSV header field).
+# osmnx turns some columns into lists when it merges ways, and the Bolt import
+# stores those values as lists and all others as scalars. A CSV header types a
+# whole file, so the rows are split into one file per set of list-valued
+# columns, whose header gives those columns an array type ('name:string[]').
+# names only holds the list names, as in rels_query
+ARRAY_DELIMITER = '|'
+intersection_columns = [
+    ('osmid', 'osmid:ID(Intersection)'),
+    ('location', 'location:point{crs:WGS-84}'),
+    ('ref', 'ref:string'),
+    ('highway', 'highway:string'),
+    ('street_count', 'street_count:int'),
+]
+road_segment_columns = [
+    ('u', ':START_ID(Intersection)'),
+    ('v', ':END_ID(Intersection)'),
+    ('osmid', 'osmid:long'),
+    ('oneway', 'oneway:boolean'),
+    ('lanes', 'lanes:string'),
+    ('ref', 'ref:string'),
+    ('name', 'name:string'),
+    ('names', 'names:string'),
+    ('highway', 'highway:string'),
+    ('maxspeed', 'max_speed:string'),
+    ('length', 'length:float'),
+    ('geometry', 'geometry:string'),
+]
+
+# Errors worth retrying a batch for: deadlocks between concurrent writers,
+# leader switches and dropped connections
+RETRYABLE_ERRORS = (TransientError, ServiceUnavailable, SessionExpired)
 
 # Function to execute constraint / index queries
 def create_constraints(tx):
     tx.run(constraint_query)
     tx.run(rel_index_query)
     tx.run(point_index_query)
+    tx.run(rel_name_index_query)
+    tx.run(rel_names_index_query)
 
-# Function to batch GeoDataFrames
+# Function to batch GeoDataFrames (or lists of row dicts). With instrumentation
+# enabled, the DataFrame conversion and the writes are timed as separate phases
+@instrumented('insert_data')
 def insert_data(tx, query, rows, batch_size=10000):
     total = 0
     batch = 0
-    
+
     while batch * batch_size < len(rows):
-        results = tx.run(query, parameters={'rows': rows[batch*batch_size:(batch+1)*batch_size].to_dict('records')}).data()
+        batch_rows = rows[batch*batch_size:(batch+1)*batch_size]
+        with instrumentation.phase('convert'):
+            if hasattr(batch_rows, 'to_dict'):
+                batch_rows = batch_rows.to_dict('records')
+        with instrumentation.phase('write'):
+            results = tx.run(query, parameters={'rows': batch_rows}).data()
+        instrumentation.count('db_calls')
+        instrumentation.count('rows', len(batch_rows))
         print(results)
         total += results[0]['total']
         batch += 1
+    return total
+
+# Function to delete the current graph chunk by chunk
+def delete_all(driver, batch_size=10000):
+    for query in (delete_rels_batch_query, delete_nodes_batch_query):
+        while True:
+            with driver.session() as session:
+                deleted = session.execute_write(lambda tx: tx.run(query, limit=batch_size).single()['total'])
+            if deleted == 0:
+                break
+
+# Function to mark the end of a load with a new graph version
+def bump_graph_version(driver):
+    with driver.session() as session:
+        version = session.execute_write(lambda tx: tx.run(graph_version_query).single()['version'])
+    print(f"Graph version {version}")
+    return version
+
+# Function to write one batch in its own transaction, retrying with exponential backoff
+def write_batch(driver, query, rows, retries=5, backoff=0.5):
+    for attempt in range(retries):
+        try:
+            with driver.session() as session:
+                return session.execute_write(insert_data, query, rows, len(rows) or 1)
+        except RETRYABLE_ERRORS:
+            if attempt == retries - 1:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+# Split a GeoDataFrame into batches without converting it to records up front.
+# The geometry is converted to WKT one batch at a time, never for the whole frame
+def dataframe_batches(df, batch_size=10000):
+    for start in range(0, len(df), batch_size):
+        yield wkt_geometry(df.iloc[start:start + batch_size])
+
+# Plain DataFrame with the geometry column as WKT text (ROAD_SEGMENT.geometry),
+# the shapely objects cannot be sent to Neo4j
+def wkt_geometry(gdf):
+    if 'geometry' not in gdf:
+        return gdf
+    return pd.DataFrame(gdf.drop(columns=['geometry'])).assign(geometry=gdf.geometry.to_wkt().values)
+
+# Committed batches per import phase, persisted as JSON so an interrupted
+# import resumes after the last committed batches instead of starting over.
+# Batch numbers only mean the same rows with the same batch size, so a
+# checkpoint written with another batch size is discarded
+class ImportCheckpoint:
+
+    def __init__(self, path, source, batch_size):
+        self.path = path
+        self.source = source
+        self.batch_size = batch_size
+        self.lock = threading.Lock()
+        self.committed = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            # A checkpoint of a different region is of no use
+            if data.get('source') != source:
+                return
+            if data.get('batch_size') != batch_size:
+                print(f"Ignoring checkpoint {path}: written with batch size {data.get('batch_size')}, not {batch_size}")
+                return
+            self.committed = {phase: set(batches) for phase, batches in data.get('committed', {}).items()}
+
+    # True when a previous run already committed at least one batch
+    def started(self):
+        return any(self.committed.values())
+
+    def done(self, phase, batch_number):
+        return batch_number in self.committed.get(phase, ())
+
+    def mark(self, phase, batch_number):
+        with self.lock:
+            self.committed.setdefault(phase, set()).add(batch_number)
+            if not self.path:
+                return
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump({'source': self.source, 'batch_size': self.batch_size,
+                           'committed': {phase: sorted(batches) for phase, batches in self.committed.items()}}, f)
+            os.replace(tmp_path, self.path)
+
+    # Forget the progress once the whole import has finished
+    def clear(self):
+        self.committed = {}
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+# Function to import one phase (nodes or relationships) with concurrent writer
+# sessions, one transaction per batch, and report the throughput
+def import_phase(driver, phase, query, batches, checkpoint=None, workers=4, retries=5):
+    start_time = time.perf_counter()
+    written = 0
+    skipped = 0
+
+    def write(batch_number, rows):
+        write_batch(driver, query, rows, retries)
+        if checkpoint is not None:
+            checkpoint.mark(phase, batch_number)
+        return len(rows)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        for batch_number, rows in enumerate(batches):
+            if checkpoint is not None and checkpoint.done(phase, batch_number):
+                skipped += 1
+                continue
+            # Keep a bounded number of batches in flight
+            if len(pending) >= workers * 2:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                written += sum(future.result() for future in finished)
+            pending.add(pool.submit(write, batch_number, rows))
+        written += sum(future.result() for future in pending)
+
+    elapsed = time.perf_counter() - start_time
+    rate = written / elapsed if elapsed > 0 else 0
+    print(f"{phase}: {written} rows in {elapsed:.1f} s ({rate:.0f} rows/s), {skipped} batches already committed")
+    return written
+
+# Encode one GeoDataFrame value for a neo4j-admin CSV field of the given header type
+def _csv_value(value, field):
+    if isinstance(value, (list, tuple)):
+        values = [item for item in value if item is not None and item == item]
+    elif value is None or value != value:  # NaN means missing
+        return ''
+    else:
+        values = [value]
+    if field.endswith('[]'):
+        return ARRAY_DELIMITER.join(str(int(item)) if field.endswith('long[]') else str(item) for item in values)
+    if field.endswith(':boolean'):
+        return 'true' if values[0] else 'false'
+    if field.endswith((':int', ':long')) or field.startswith('osmid:ID') or 'START_ID' in field or 'END_ID' in field:
+        return str(int(values[0]))
+    return str(values[0])
+
+# Entity name of an export file: 'road_segments' for road_segments.csv,
+# road_segments-name_header.csv, road_segments-name-osmid.csv...
+def _export_name(filename):
+    stem = filename[:-len('.csv')] if filename.endswith('.csv') else filename
+    return stem[:-len('_header')].split('-')[0] if stem.endswith('_header') else stem.split('-')[0]
+
+# Write the header and data files of one entity, streaming the GeoDataFrame
+# chunk by chunk. Rows without list values go to name.csv, the others to
+# name-<list columns>.csv. Returns the row count and the (header, data) paths
+def _export_csv_file(df, columns, name, out_dir, chunk_size):
+    for filename in os.listdir(out_dir):
+        if filename.endswith('.csv') and _export_name(filename) == name:
+            os.remove(os.path.join(out_dir, filename))  # Files of a previous export may have other list columns
+
+    writers = {}  # list-valued columns -> (header fields, data file, csv writer)
+    files = []
+    rows = 0
+    try:
+        for start in range(0, len(df), chunk_size):
+            chunk = df.iloc[start:start + chunk_size]
+            if 'geometry' in (column for column, _ in columns):
+                chunk = wkt_geometry(chunk)
+            if 'location' in (column for column, _ in columns):
+                chunk = chunk.assign(location=[f"{{latitude:{y}, longitude:{x}}}" for y, x in zip(chunk['y'], chunk['x'])])
+            if 'names' in (column for column, _ in columns) and 'name' in chunk:
+                chunk = chunk.assign(names=[name if isinstance(name, (list, tuple)) else None for name in chunk['name']])
+            chunk = chunk.reindex(columns=[column for column, _ in columns])
+            for values in chunk.itertuples(index=False, name=None):
+                lists = tuple(column for (column, _), value in zip(columns, values) if isinstance(value, (list, tuple)))
+                if lists not in writers:
+                    stem = os.path.join(out_dir, '-'.join((name,) + lists))
+                    fields = [field + '[]' if column in lists else field for column, field in columns]
+                    with open(stem + '_header.csv', 'w', newline='') as f:
+                        csv.writer(f).writerow(fields)
+                    data_file = open(stem + '.csv', 'w', newline='')
+                    writers[lists] = (fields, data_file, csv.writer(data_file))
+                    files.append((stem + '_header.csv', stem + '.csv'))
+                fields, _, writer = writers[lists]
+                writer.writerow([_csv_value(value, field) for value, field in zip(values, fields)])
+            rows += len(chunk)
+    finally:
+        for _, data_file, _ in writers.values():
+            data_file.close()
+    return rows, files
+
+# Offline export of the osmnx GeoDataFrames as neo4j-admin database import CSV files
+def export_csv(gdf_nodes, gdf_relationships, out_dir, chunk_size=50000):
+    os.makedirs(out_dir, exist_ok=True)
+    counts = {}
+    files = {}
+    for name, df, columns in (('intersections', gdf_nodes, intersection_columns),
+                              ('road_segments', gdf_relationships, road_segment_columns)):
+        counts[name], files[name] = _export_csv_file(df, columns, name, out_dir, chunk_size)
+    print(f"Exported {counts['intersections']} intersections and {counts['road_segments']} road segments to {out_dir}")
+    print("Load them with:")
+    print(f"  neo4j-admin database import full --id-type=integer --array-delimiter='{ARRAY_DELIMITER}' "
+          + ' '.join(f"--nodes=Intersection={header},{data}" for header, data in files['intersections']) + ' '
+          + ' '.join(f"--relationships=ROAD_SEGMENT={header},{data}" for header, data in files['road_segments']) + ' neo4j')
+    return counts
+
+# Check the exported files without a database: header types, field counts, ids,
+# points, arrays and that every relationship references an exported intersection
+def validate_csv_export(out_dir):
+    # Rows of every file of an entity, keyed on the header fields without the array marker
+    def read(name):
+        for header_name in sorted(os.listdir(out_dir)):
+            if not header_name.endswith('_header.csv') or _export_name(header_name) != name:
+                continue
+            data_name = header_name[:-len('_header.csv')] + '.csv'
+            with open(os.path.join(out_dir, header_name), newline='') as f:
+                header = [field.removesuffix('[]') for field in next(csv.reader(f))]
+            with open(os.path.join(out_dir, data_name), newline='') as f:
+                for line_number, row in enumerate(csv.reader(f), 1):
+                    if len(row) != len(header):
+                        raise ValueError(f"{data_name} line {line_number}: {len(row)} fields, header has {len(header)}")
+                    yield f"{data_name} line {line_number}", dict(zip(header, row))
+
+    def check_long(value, where):
+        try:
+            int(value)
+        except ValueError:
+            raise ValueError(f"{where}: '{value}' is not an integer") from None
+
+    node_ids = set()
+    for where, row in read('intersections'):
+        node_id = row['osmid:ID(Intersection)']
+        check_long(node_id, where)
+        if node_id in node_ids:
+            raise ValueError(f"{where}: duplicate id {node_id}")
+        node_ids.add(node_id)
+        location = row['location:point{crs:WGS-84}']
+        if not (location.startswith('{latitude:') and ', longitude:' in location and location.endswith('}')):
+            raise ValueError(f"{where}: malformed point '{location}'")
+        latitude, longitude = location[len('{latitude:'):-1].split(', longitude:')
+        float(latitude), float(longitude)
+
+    rels = 0
+    for where, row in read('road_segments'):
+        for field in (':START_ID(Intersection)', ':END_ID(Intersection)'):
+            if row[field] not in node_ids:
+                raise ValueError(f"{where}: {field} {row[field]} is not an exported intersection")
+        for osmid in filter(None, row['osmid:long'].split(ARRAY_DELIMITER)):
+            check_long(osmid, where)
+        if row['oneway:boolean'] not in ('', 'true', 'false'):
+            raise ValueError(f"{where}: '{row['oneway:boolean']}' is not a boolean")
+        if row['length:float']:
+            float(row['length:float'])
+        if row['geometry:string'] and not row['geometry:string'].startswith('LINESTRING'):
+            raise ValueError(f"{where}: '{row['geometry:string'][:40]}' is not a WKT LINESTRING")
+        rels += 1
+
+    return {'intersections': len(node_ids), 'road_segments': rels}
+
+# Comparable form of a property value: NaN -> None, lists -> tuples, NumPy
+# scalars -> Python values, floats rounded so re-imported coordinates match
+def _normalize(value, digits=7):
+    if isinstance(value, (list, tuple)):
+        return tuple(_normalize(item, digits) for item in value)
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float):
+        return None if value != value else round(value, digits)
+    return value
+
+# Parameter form of a normalized value (the driver wants lists, not tuples)
+def _parameter(value):
+    return list(value) if isinstance(value, tuple) else value
+
+def _node_key(row):
+    return _normalize(row['osmid'])
+
+def _segment_key(row):
+    return (_normalize(row['u']), _normalize(row['v']), _normalize(row['osmid']))
+
+# Diff the incoming osmnx rows against the rows already in Neo4j. Returns the
+# rows to insert, update and delete per entity plus a JSON-friendly change summary
+def compute_delta(existing_nodes, existing_segments, incoming_nodes, incoming_segments):
+    def index(rows, key, properties, digits):
+        return {key(row): {name: _normalize(row.get(name), digits) for name in properties} for row in rows}
+
+    delta = {}
+    summary = {}
+    for entity, existing, incoming, key, properties, digits in (
+            ('intersections', existing_nodes, incoming_nodes, _node_key, node_properties, 7),
+            ('road_segments', existing_segments, incoming_segments, _segment_key, segment_properties, 3)):
+        old = index(existing, key, properties, digits)
+        new = index(incoming, key, properties, digits)
+        inserted = [k for k in new if k not in old]
+        updated = [k for k in new if k in old and new[k] != old[k]]
+        deleted = [k for k in old if k not in new]
+
+        def rows(keys, values):
+            if entity == 'intersections':
+                return [dict({name: _parameter(value) for name, value in values[k].items()}, osmid=_parameter(k)) for k in keys]
+            return [dict({name: _parameter(value) for name, value in values[k].items()}, u=k[0], v=k[1], osmid=_parameter(k[2])) for k in keys]
+
+        delta[entity] = {'inserted': rows(inserted, new), 'updated': rows(updated, new), 'deleted': rows(deleted, old)}
+        summary[entity] = {change: [_parameter(k) if entity == 'intersections' else [k[0], k[1], _parameter(k[2])] for k in keys]
+                           for change, keys in (('inserted', inserted), ('updated', updated), ('deleted', deleted))}
+
+    # Intersections whose routes may have changed, for precise cache invalidation
+    affected = {row['osmid'] for changes in delta['intersections'].values() for row in changes}
+    affected.update(row[end] for changes in delta['road_segments'].values() for row in changes for end in ('u', 'v'))
+    summary['affected_intersections'] = sorted(affected, key=str)
+    return delta, summary
+
+# Split a list of rows into batches
+def list_batches(rows, batch_size=10000):
+    for start in range(0, len(rows), batch_size):
+        yield rows[start:start + batch_size]
+
+# Incremental import: only apply the inserts, property updates and deletions
+# between the current graph and the incoming GeoDataFrames
+def delta_import(driver, gdf_nodes, gdf_relationships, batch_size=10000, workers=4, retries=5):
+    with driver.session() as session:
+        existing_nodes = [record.data() for record in session.run(existing_nodes_query)]
+        existing_segments = [record.data() for record in session.run(existing_rels_query)]
+    incoming_nodes = gdf_nodes.drop(columns=['geometry'], errors='ignore').to_dict('records')
+    incoming_segments = [row for batch in dataframe_batches(gdf_relationships, batch_size) for row in batch.to_dict('records')]
+    delta, summary = compute_delta(existing_nodes, existing_segments, incoming_nodes, incoming_segments)
+
+    # Nodes first so new segments find their endpoints, deleted nodes last
+    nodes, segments = delta['intersections'], delta['road_segments']
+    for phase, query, rows in (
+            ('new intersections', node_query, nodes['inserted']),
+            ('updated intersections', update_nodes_query, nodes['updated']),
+            ('deleted road segments', delete_rels_query, segments['deleted']),
+            ('new and updated road segments', rels_query, segments['inserted'] + segments['updated']),
+            ('deleted intersections', delete_nodes_query, nodes['deleted'])):
+        if rows:
+            import_phase(driver, phase, query, list_batches(rows, batch_size), None, workers, retries)
+
+    for entity in ('intersections', 'road_segments'):
+        counts = ', '.join(f"{len(summary[entity][change])} {change}" for change in ('inserted', 'updated', 'deleted'))
+        print(f"{entity}: {counts}")
+    return summary
+
+# Search OpenStreetMap and create the nodes and relationships GeoDataFrames
+def load_osm_graph(place):
+    G = ox.graph_from_place(place, network_type="drive")
+
+    gdf_nodes, gdf_relationships = ox.graph_to_gdfs(G)
+    gdf_nodes.reset_index(inplace=True)
+    gdf_relationships.reset_index(inplace=True)
+    return gdf_nodes, gdf_relationships
+
+# Streaming import of a local .osm.pbf/.osm file: batches go straight from the
+# file reader into node_query/rels_query without building an osmnx graph
+def import_osm_file(driver, path, checkpoint=None, batch_size=10000, retries=5):
+    start_time = time.perf_counter()
+    batch_numbers = {'nodes': 0, 'relationships': 0}
+    written = {'nodes': 0, 'relationships': 0}
+
+    def sink(phase, query):
+        def write(rows):
+            batch_number = batch_numbers[phase]
+            batch_numbers[phase] += 1
+            if checkpoint is not None and checkpoint.done(phase, batch_number):
+                return
+            write_batch(driver, query, rows, retries)
+            if checkpoint is not None:
+                checkpoint.mark(phase, batch_number)
+            written[phase] += len(rows)
+        return write
+
+    stream_osm_file(path, sink('nodes', node_query), sink('relationships', rels_query), batch_size)
+
+    elapsed = time.perf_counter() - start_time
+    for phase, rows in written.items():
+        rate = rows / elapsed if elapsed > 0 else 0
+        print(f"{phase}: {rows} rows in {elapsed:.1f} s ({rate:.0f} rows/s)")
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description="Import an OpenStreetMap road network into Neo4j")
+    parser.add_argument('--place', default=PLACE, help="place to download with osmnx")
+    parser.add_argument('--uri', default=NEO4J_URI, help="bolt URI of the Neo4j server")
+    parser.add_argument('--batch-size', type=int, default=10000, help="rows per transaction")
+    parser.add_argument('--node-workers', type=int, default=4, help="concurrent writer sessions for the node phase")
+    parser.add_argument('--rel-workers', type=int, default=2, help="concurrent writer sessions for the relationship phase")
+    parser.add_argument('--retries', type=int, default=5, help="attempts per batch before giving up")
+    parser.add_argument('--checkpoint', default='import_checkpoint.json', help="checkpoint file used to resume an interrupted import")
+    parser.add_argument('--export-csv', metavar='DIR', help="write neo4j-admin import CSV files to DIR instead of loading over Bolt")
+    parser.add_argument('--osm-file', metavar='PATH', help="stream a local .osm.pbf/.osm extract instead of downloading --place")
+    parser.add_argument('--delta', action='store_true', help="apply only the differences to the current graph instead of wiping and reloading it")
+    parser.add_argument('--change-summary', metavar='PATH', help="with --delta, write the change summary as JSON to PATH")
+    parser.add_argument('--memory-report', action='store_true', help="compare the peak memory of streaming --osm-file (an .osm XML file) with osmnx and exit")
+    parser.add_argument('--graph-file', metavar='PATH', help="also write the downloaded network to a memory-mapped routing graph file (nodes keyed on osmid)")
+    parser.add_argument('--metrics', metavar='PATH', help="write Prometheus text metrics of the batch writes to PATH")
+    parser.add_argument('--log-metrics', action='store_true', help="log the calls, rows and phase times of every batch write")
+    args = parser.parse_args()
+
+    exporters = []
+    if args.metrics:
+        exporters.append(PrometheusExporter(args.metrics))
+    if args.log_metrics:
+        logging.basicConfig(level=logging.INFO)
+        exporters.append(LoggingExporter())
+    if exporters:
+        instrumentation.enable(*exporters)
+
+    if args.memory_report:
+        if not args.osm_file:
+            parser.error("--memory-report needs --osm-file")
+        print(json.dumps(compare_memory(args.osm_file), indent=2))
+        return
+
+    if args.graph_file and args.osm_file:
+        parser.error("--graph-file is written from the osmnx GeoDataFrames, it cannot be combined with --osm-file")
+
+    # Offline mode: no database connection at all
+    if args.export_csv:
+        gdf_nodes, gdf_relationships = load_osm_graph(args.place)
+        if args.graph_file:
+            export_from_geodataframes(gdf_nodes, gdf_relationships, args.graph_file)
+        export_csv(gdf_nodes, gdf_relationships, args.export_csv)
+        print(validate_csv_export(args.export_csv))
+        return
+
+    # Neo4j driver with no auth
+    driver = neo4j.GraphDatabase.driver(args.uri, auth=None)
+
+    # Incremental mode: diff against the current graph, no wipe and no checkpoint
+    if args.delta:
+        if args.osm_file:
+            parser.error("--delta works on the osmnx GeoDataFrames, it cannot be combined with --osm-file")
+        with driver.session() as session:
+            session.execute_write(create_constraints)
+            backfilled = session.execute_write(lambda tx: tx.run(backfill_names_query).single()['total'])
+        if backfilled:
+            print(f"Stored the name lists of {backfilled} road segments as names")
+        gdf_nodes, gdf_relationships = load_osm_graph(args.place)
+        if args.graph_file:
+            export_from_geodataframes(gdf_nodes, gdf_relationships, args.graph_file)
+        summary = delta_import(driver, gdf_nodes, gdf_relationships, args.batch_size, args.node_workers, args.retries)
+        bump_graph_version(driver)
+        if args.change_summary:
+            with open(args.change_summary, 'w') as f:
+                json.dump(summary, f)
+        driver.close()
+        return
+    source = os.path.abspath(args.osm_file) if args.osm_file else args.place
+    checkpoint = ImportCheckpoint(args.checkpoint, source, args.batch_size)
+
+    # Only wipe the database when not resuming an interrupted import
+    if checkpoint.started():
+        print(f"Resuming import of {source} from {args.checkpoint}")
+    else:
+        delete_all(driver, args.batch_size)
+
+    with driver.session() as session:
+        session.execute_write(create_constraints)
+
+    if args.osm_file:
+        import_osm_file(driver, args.osm_file, checkpoint, args.batch_size, args.retries)
+        bump_graph_version(driver)
+        checkpoint.clear()
+        driver.close()
+        return
+
+    gdf_nodes, gdf_relationships = load_osm_graph(args.place)
+    if args.graph_file:
+        export_from_geodataframes(gdf_nodes, gdf_relationships, args.graph_file)
+
+    # Run our nodes GeoDataFrame import
+    import_phase(driver, 'nodes', node_query, dataframe_batches(gdf_nodes.drop(columns=['geometry']), args.batch_size),
+                 checkpoint, args.node_workers, args.retries)
 
-# Run our constraints queries and nodes GeoDataFrame import
-with driver.session() as session:
-    session.execute_write(create_constraints)
-    session.execute_write(insert_data, node_query, gdf_nodes.drop(columns=['geometry'])) 
+    # Run our relationships GeoDataFrame import
+    import_phase(driver, 'relationships', rels_query, dataframe_batches(gdf_relationships, args.batch_size),
+                 checkpoint, args.rel_workers, args.retries)
 
-# Run our relationships GeoDataFrame import
-with driver.session() as session:
-    session.execute_write(insert_data, rels_query, gdf_relationships.drop(columns=['geometry'])) 
+    bump_graph_version(driver)
+    checkpoint.clear()
+    driver.close()
 
-driver.close()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,169 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError
+from instrumentation import instrumented
+from operations import SearchCancelled, engines, graph_version
+
+# Size-bounded LRU of route results keyed on (engine, start, end, weight), with an
+# optional time to live in seconds. Entries belong to one graph version and are
+# all dropped when it changes: searches on a snapshot use the version the
+# snapshot was loaded at, searches on the database the graph version, read at
+# most every version_interval seconds when the cache is built with a graph.
+# Identical concurrent misses share one search. One cache can be shared by all
+# the search functions and threads
+class RouteCache:
+
+    def __init__(self, graph=None, max_size=10000, ttl=None, version_interval=5.0):
+        self.graph = graph
+        self.max_size = max_size
+        self.ttl = ttl
+        self.version_interval = version_interval
+        self.entries = OrderedDict()  # key -> (expiry time or None, cost, path)
+        self.lock = threading.Lock()
+        self.version = None
+        self.version_checked = None
+        self.in_flight = {}  # (key, version) -> Future of the running search
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    # Drop every entry if the graph version changed since the last check
+    def check_version(self, force=False):
+        if self.graph is None:
+            return
+        now = time.monotonic()
+        if not force and self.version_checked is not None and now - self.version_checked < self.version_interval:
+            return
+        version = graph_version(self.graph)
+        with self.lock:
+            self.version_checked = now
+            self._set_version(version)
+
+    # Switch to the entries of another graph version (called with the lock held)
+    def _set_version(self, version):
+        if version != self.version:
+            if self.entries:
+                self.invalidations += 1
+            self.entries.clear()
+            self.version = version
+
+    # Graph version the entries for a search on snapshot (None: on the database) must have
+    def current_version(self, snapshot=None):
+        if snapshot is None:
+            self.check_version()
+            return self.version
+        with self.lock:
+            self._set_version(snapshot.version)
+            return self.version
+
+    # Cached (cost, path) of a key, or None on a miss
+    def get(self, key):
+        self.check_version()
+        return self._lookup(key, self.version)
+
+    # Cached (cost, path) of a key if the entries still are those of version
+    def _lookup(self, key, version):
+        with self.lock:
+            entry = self.entries.get(key) if version == self.version else None
+            if entry is not None and entry[0] is not None and entry[0] < time.monotonic():
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1], list(entry[2])
+
+    # Store a route, unless it was computed for another graph version than the
+    # current one (the snapshot was refreshed while it ran)
+    def put(self, key, cost, path, version=None):
+        expiry = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            if version is not None and version != self.version:
+                return
+            self.entries[key] = (expiry, cost, tuple(path))
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    # Drop every entry, e.g. after the snapshot has been refreshed
+    def invalidate(self):
+        with self.lock:
+            if self.entries:
+                self.invalidations += 1
+            self.entries.clear()
+
+    # Hit/miss counters as a dict
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'version': self.version,
+            }
+
+    # Same as operations.shortest_path, answered from the cache when possible.
+    # weight names the edge cost the route minimizes and is part of the key. A
+    # miss while the same route is already being searched waits for that search;
+    # if it gets cancelled, the waiter searches itself
+    @instrumented('cached_shortest_path', search=True)
+    def shortest_path(self, graph, start_id, end_id, engine='dijkstra', snapshot=None, weight='length', control=None):
+        if engine not in engines:
+            raise ValueError(f"Unknown search engine '{engine}', expected one of {sorted(engines)}")
+        key = (engine, start_id, end_id, weight)
+        while True:
+            version = self.current_version(snapshot)
+            cached = self._lookup(key, version)
+            if cached is not None:
+                return cached
+            with self.lock:
+                future = self.in_flight.get((key, version))
+                if future is None:
+                    future = self.in_flight[(key, version)] = Future()
+                    break
+                self.coalesced += 1
+            try:
+                cost, path = self._wait(future, control)
+                return cost, list(path)
+            except SearchCancelled:
+                if control is not None and control.cancelled:
+                    raise
+                # The search we waited for was cancelled, not us: try again
+
+        # The result is cached and handed to the waiters before the search stops
+        # being in flight, so a miss in between finds one of the two
+        try:
+            cost, path = engines[engine](graph, start_id, end_id, snapshot=snapshot, weight=weight, control=control)
+            self.put(key, cost, path, version)
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        else:
+            future.set_result((cost, tuple(path)))
+        finally:
+            with self.lock:
+                del self.in_flight[(key, version)]
+        return cost, path
+
+    # Result of another thread's search, polled so our own control can still cancel the wait
+    def _wait(self, future, control):
+        while True:
+            try:
+                return future.result(timeout=0.05)
+            except TimeoutError:
+                if control is not None and control.cancelled:
+                    raise SearchCancelled("Search cancelled while waiting for the same search") from None
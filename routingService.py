@@ -0,0 +1,262 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+import numpy as np
+import neo4j
+import operations
+import travelTime
+from graphFile import MappedSnapshot
+from operations import RoadGraphSnapshot, engines, graph_version_query, snapshot_nodes_query, snapshot_rels_query
+from spatialIndex import GridIndex
+
+# Local bolt connection
+NEO4J_URI = "bolt://localhost:7687"
+
+# Load the read-only snapshot through the async driver
+async def load_snapshot(driver):
+    async with driver.session() as session:
+        # Read before the network, as RoadGraphSnapshot.refresh does
+        result = await session.run(graph_version_query)
+        record = await result.single()
+        version = record['version'] if record else None
+        result = await session.run(snapshot_nodes_query)
+        nodes = [(record['id'], record['lat'], record['lon']) async for record in result]
+        result = await session.run(snapshot_rels_query)
+        edges = [(record['src'], record['dst'], record['length'], record['max_speed'], record['highway'], record['lanes'])
+                 async for record in result]
+    snapshot = RoadGraphSnapshot.from_edges(nodes, edges)
+    snapshot.version = version
+    return snapshot
+
+# Runs in the worker processes, on the snapshot shared by operations._init_worker
+def _route_worker(engine, start_id, end_id, weight):
+    return engines[engine](None, start_id, end_id, snapshot=operations._worker_snapshot, weight=weight)
+
+def _worker_ready():
+    return operations._worker_snapshot is not None
+
+# Routing over HTTP: searches run on a process pool whose workers all hold the
+# same snapshot, identical requests in flight share one search
+class RoutingService:
+
+    def __init__(self, snapshot, driver=None, processes=None):
+        self.snapshot = snapshot
+        self.driver = driver
+        self.processes = processes or os.cpu_count()
+        self.spatial_index = GridIndex(snapshot)
+        # Spawned, not forked: forked workers would inherit the open client sockets
+        # and keep connections alive after the service closed them
+        self.pool = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=operations._init_worker, initargs=(snapshot,))
+        self.in_flight = {}  # (engine, start, end, weight) -> future of the running search
+        self.connections = set()  # tasks of the open client connections
+        self.counters = {'requests': 0, 'searches': 0, 'coalesced': 0, 'errors': 0}
+
+    @classmethod
+    async def from_neo4j(cls, uri=NEO4J_URI, processes=None):
+        driver = neo4j.AsyncGraphDatabase.driver(uri, auth=None)
+        return cls(await load_snapshot(driver), driver, processes)
+
+    async def close(self):
+        # Let the open connections finish their current request
+        if self.connections:
+            await asyncio.wait(self.connections, timeout=1)
+        for task in self.connections:
+            task.cancel()
+        self.pool.shutdown()
+        if self.driver is not None:
+            await self.driver.close()
+
+    # Shortest path between two node ids, coalescing identical concurrent requests
+    async def route(self, engine, start_id, end_id, weight='length'):
+        if engine not in engines:
+            raise ValueError(f"Unknown search engine '{engine}', expected one of {sorted(engines)}")
+        travelTime.parse_weight(weight)
+        key = (engine, start_id, end_id, weight)
+        future = self.in_flight.get(key)
+        if future is not None:
+            self.counters['coalesced'] += 1
+        else:
+            self.counters['searches'] += 1
+            future = asyncio.get_running_loop().run_in_executor(self.pool, _route_worker, engine, start_id, end_id, weight)
+            self.in_flight[key] = future
+            future.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        # A client that goes away must not cancel the search the others wait for
+        return await asyncio.shield(future)
+
+    # Node id of a query parameter: an id, or "lat,lon" snapped to the nearest intersection
+    def _node_id(self, value):
+        if ',' in value:
+            lat, lon = (float(part) for part in value.split(','))
+            return int(self.spatial_index.snap(lat, lon)[0][0])
+        return int(value)
+
+    # (status, JSON body) of a GET request
+    async def dispatch(self, target):
+        url = urlsplit(target)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        if url.path == '/route':
+            try:
+                start_id, end_id = self._node_id(params['start']), self._node_id(params['end'])
+                cost, path = await self.route(params.get('engine', 'dijkstra'), start_id, end_id, params.get('weight', 'length'))
+            except (KeyError, ValueError) as error:
+                return 400, {'error': f"bad request: {error}"}
+            return 200, {'start': start_id, 'end': end_id, 'weight': params.get('weight', 'length'),
+                         'cost': cost if cost != float('inf') else None, 'path': path}
+        if url.path == '/stats':
+            return 200, dict(self.counters, in_flight=len(self.in_flight), intersections=len(self.snapshot))
+        if url.path == '/health':
+            return 200, {'status': 'ok'}
+        return 404, {'error': f"unknown path {url.path}"}
+
+    # One HTTP/1.1 connection, kept alive until the client closes it
+    async def handle(self, reader, writer):
+        self.connections.add(asyncio.current_task())
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                if int(headers.get('content-length', 0)):
+                    await reader.readexactly(int(headers['content-length']))
+
+                self.counters['requests'] += 1
+                method, target, _ = request_line.decode('latin-1').split(' ', 2)
+                if method != 'GET':
+                    status, body = 405, {'error': f"method {method} not allowed"}
+                else:
+                    try:
+                        status, body = await self.dispatch(target)
+                    except Exception as error:
+                        status, body = 500, {'error': str(error)}
+                if status >= 400:
+                    self.counters['errors'] += 1
+
+                payload = json.dumps(body).encode()
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write(f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                             f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n"
+                             f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + payload)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            self.connections.discard(asyncio.current_task())
+            writer.close()
+
+    # Start the worker processes (each one loads the snapshot) before accepting requests
+    async def serve(self, host='127.0.0.1', port=8080):
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self.pool, _worker_ready) for _ in range(self.processes)))
+        return await asyncio.start_server(self.handle, host, port)
+
+# Keep-alive client of the load test: sends the request paths from the queue and
+# records the latency of every response in seconds
+async def _load_client(host, port, queue, latencies, statuses):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while not queue.empty():
+            target = queue.get_nowait()
+            start_time = time.perf_counter()
+            writer.write(f"GET {target} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                if line.lower().startswith(b'content-length:'):
+                    length = int(line.split(b':')[1])
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start_time)
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        writer.close()
+        await writer.wait_closed()
+
+# Send every request target with the given number of concurrent keep-alive
+# connections; returns p50/p99 latency in milliseconds and throughput
+async def load_test(host, port, targets, concurrency=32):
+    queue = asyncio.Queue()
+    for target in targets:
+        queue.put_nowait(target)
+    latencies = []
+    statuses = {}
+    start_time = time.perf_counter()
+    await asyncio.gather(*(_load_client(host, port, queue, latencies, statuses) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start_time
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        'requests': len(latencies),
+        'concurrency': concurrency,
+        'statuses': statuses,
+        'p50_ms': float(np.percentile(latencies_ms, 50)) if len(latencies) else None,
+        'p99_ms': float(np.percentile(latencies_ms, 99)) if len(latencies) else None,
+        'qps': len(latencies) / elapsed if elapsed > 0 else 0,
+    }
+
+# Fixed-seed /route targets; repeat_fraction of them reuse earlier pairs so the
+# coalescing of identical in-flight queries is exercised
+def route_targets(snapshot, count, engine='dijkstra', repeat_fraction=0.2, seed=0):
+    rng = random.Random(seed)
+    targets = []
+    for _ in range(count):
+        if targets and rng.random() < repeat_fraction:
+            targets.append(rng.choice(targets))
+        else:
+            targets.append(f"/route?engine={engine}&start={rng.choice(snapshot.node_ids)}&end={rng.choice(snapshot.node_ids)}")
+    return targets
+
+async def main(args):
+    if args.graph_file:
+        # Workers map the same file instead of receiving a pickled copy of the snapshot
+        service = RoutingService(MappedSnapshot(args.graph_file, verify=True), processes=args.processes)
+    elif args.synthetic:
+        # Imported here: benchmark.py pulls in the importer (osmnx), the service does not need it otherwise
+        from benchmark import SyntheticNetwork
+        service = RoutingService(SyntheticNetwork(args.synthetic ** 2).snapshot(), processes=args.processes)
+    else:
+        service = await RoutingService.from_neo4j(args.uri, args.processes)
+    server = await service.serve(args.host, args.port)
+    print(f"Routing {len(service.snapshot)} intersections on http://{args.host}:{args.port}")
+    try:
+        if args.load_test:
+            targets = route_targets(service.snapshot, args.load_test, args.engine)
+            report = await load_test(args.host, args.port, targets, args.concurrency)
+            report['service'] = dict(service.counters)
+            print(json.dumps(report, indent=2))
+        else:
+            await server.serve_forever()
+    finally:
+        server.close()
+        await server.wait_closed()
+        await service.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the operations.py search engines over HTTP")
+    parser.add_argument('--uri', default=NEO4J_URI, help="bolt URI of the Neo4j server")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--processes', type=int, default=None, help="search worker processes (default: one per CPU)")
+    parser.add_argument('--graph-file', metavar='PATH', help="serve a graph file written by graphFile.py instead of loading from Neo4j")
+    parser.add_argument('--synthetic', type=int, metavar='N', help="serve an N x N synthetic grid instead of Neo4j")
+    parser.add_argument('--load-test', type=int, metavar='REQUESTS', help="send REQUESTS route queries to the service, print the latency report and exit")
+    parser.add_argument('--concurrency', type=int, default=32, help="concurrent connections of the load test")
+    parser.add_argument('--engine', default='dijkstra', help="search engine used by the load test")
+    asyncio.run(main(parser.parse_args()))
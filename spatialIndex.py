@@ -0,0 +1,201 @@
+import time
+import numpy as np
+from py2neo import Graph
+from operations import RoadGraphSnapshot, haversine_vector, shortest_path
+
+# Cypher query to snap a batch of coordinates with the POINT INDEX on
+# Intersection.location, used before an in-memory index has been built
+nearest_intersections_query = '''
+    UNWIND range(0, size($lats) - 1) AS k
+    WITH k, point({latitude: $lats[k], longitude: $lons[k]}) AS p
+    CALL {
+        WITH p
+        MATCH (i:Intersection)
+        WHERE point.distance(i.location, p) < $radius
+        RETURN i, point.distance(i.location, p) AS distance
+        ORDER BY distance
+        LIMIT 1
+    }
+    RETURN k, id(i) AS id, distance
+'''
+
+# Meters per degree of latitude
+METERS_PER_DEGREE = 6371000 * np.pi / 180
+
+# Great-circle distances in meters from arrays of points to one point
+def _distances(lats, lons, lat, lon):
+    return haversine_vector(lats, lons, lat, lon) * 1000
+
+# Cells at Chebyshev distance ring from (x, y)
+def _ring_cells(x, y, ring):
+    if ring == 0:
+        yield (x, y)
+        return
+    for dx in range(-ring, ring + 1):
+        yield (x + dx, y - ring)
+        yield (x + dx, y + ring)
+    for dy in range(-ring + 1, ring):
+        yield (x - ring, y + dy)
+        yield (x + ring, y + dy)
+
+# Uniform grid over the Intersection locations of a snapshot. Longitudes are
+# scaled by cos(latitude) so cells are roughly square; a query searches rings
+# of cells around the point until no unsearched cell can hold a closer node
+class GridIndex:
+
+    def __init__(self, snapshot, cell_size=100):
+        lats = np.asarray(snapshot.lats, dtype=np.float64)
+        lons = np.asarray(snapshot.lons, dtype=np.float64)
+        valid = ~(np.isnan(lats) | np.isnan(lons))
+        self.node_ids = np.asarray(snapshot.node_ids, dtype=np.int64)[valid]
+        self.lats = lats[valid]
+        self.lons = lons[valid]
+        self.cell_size = cell_size
+        self.cell_degrees = cell_size / METERS_PER_DEGREE
+        self.scale = np.cos(np.radians(np.mean(self.lats))) if len(self.lats) else 1.0
+
+        # Nodes sorted by cell, every cell maps to its (start, end) slice
+        cells_x, cells_y = self._cells(self.lats, self.lons)
+        order = np.lexsort((cells_y, cells_x))
+        self.node_ids, self.lats, self.lons = self.node_ids[order], self.lats[order], self.lons[order]
+        cells = list(zip(cells_x[order].tolist(), cells_y[order].tolist()))
+        self.cells = {}
+        for position, cell in enumerate(cells):
+            start, _ = self.cells.get(cell, (position, position))
+            self.cells[cell] = (start, position + 1)
+        xs = [x for x, _ in self.cells] or [0]
+        ys = [y for _, y in self.cells] or [0]
+        self.bounds = (min(xs), min(ys), max(xs), max(ys))
+
+        # Same cells as sorted linear keys, for the vectorized batch lookup
+        self.cell_keys = self._keys(np.array(xs), np.array(ys))
+        self.cell_starts = np.array([start for start, _ in self.cells.values()], dtype=np.int64)
+        self.cell_ends = np.array([end for _, end in self.cells.values()], dtype=np.int64)
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    def _cells(self, lats, lons):
+        return (np.floor(np.asarray(lons) * self.scale / self.cell_degrees).astype(np.int64),
+                np.floor(np.asarray(lats) / self.cell_degrees).astype(np.int64))
+
+    def _keys(self, xs, ys):
+        min_x, min_y, _, max_y = self.bounds
+        return (xs - min_x) * (max_y - min_y + 1) + (ys - min_y)
+
+    # Nearest intersection (node id, distance in meters) of one coordinate
+    def nearest(self, lat, lon):
+        best_id, best_distance = -1, np.inf
+        if not self.cells:
+            return best_id, best_distance
+        cell_x, cell_y = (int(value) for value in self._cells(lat, lon))
+        min_x, min_y, max_x, max_y = self.bounds
+        # Rings closer than the bounding box of the grid hold no cells
+        first = max(0, min_x - cell_x, cell_x - max_x, min_y - cell_y, cell_y - max_y)
+        last = max(cell_x - min_x, max_x - cell_x, cell_y - min_y, max_y - cell_y)
+        for ring in range(first, last + 1):
+            # Every node outside the rings searched so far is at least this far away
+            if best_distance <= (ring - 1) * self.cell_size:
+                break
+            for cell in _ring_cells(cell_x, cell_y, ring):
+                if cell not in self.cells:
+                    continue
+                start, end = self.cells[cell]
+                distances = _distances(self.lats[start:end], self.lons[start:end], lat, lon)
+                closest = int(np.argmin(distances))
+                if distances[closest] < best_distance:
+                    best_id, best_distance = int(self.node_ids[start + closest]), float(distances[closest])
+        return best_id, best_distance
+
+    # Snap many coordinates at once, returns (node ids, distances in meters) arrays.
+    # The 3x3 cells around every point are searched in one vectorized pass; a point
+    # whose nearest candidate is farther than one cell falls back to nearest()
+    def snap(self, lats, lons):
+        lats = np.atleast_1d(np.asarray(lats, dtype=np.float64))
+        lons = np.atleast_1d(np.asarray(lons, dtype=np.float64))
+        ids = np.full(len(lats), -1, dtype=np.int64)
+        distances = np.full(len(lats), np.inf)
+        if not self.cells or not len(lats):
+            return ids, distances
+
+        # (point, start, count) of every non-empty neighbouring cell
+        cells_x, cells_y = self._cells(lats, lons)
+        min_x, min_y, max_x, max_y = self.bounds
+        points, starts, counts = [], [], []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                xs, ys = cells_x + dx, cells_y + dy
+                inside = np.flatnonzero((xs >= min_x) & (xs <= max_x) & (ys >= min_y) & (ys <= max_y))
+                keys = self._keys(xs[inside], ys[inside])
+                positions = np.minimum(np.searchsorted(self.cell_keys, keys), len(self.cell_keys) - 1)
+                found = self.cell_keys[positions] == keys
+                points.append(inside[found])
+                starts.append(self.cell_starts[positions[found]])
+                counts.append(self.cell_ends[positions[found]] - starts[-1])
+        points, starts, counts = np.concatenate(points), np.concatenate(starts), np.concatenate(counts)
+
+        # Expand the cells into candidate nodes and keep the closest one per point
+        candidates = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+        candidate_points = np.repeat(points, counts)
+        candidate_distances = _distances(self.lats[candidates], self.lons[candidates],
+                                         lats[candidate_points], lons[candidate_points])
+        order = np.lexsort((candidate_distances, candidate_points))
+        closest = order[np.r_[True, candidate_points[order][1:] != candidate_points[order][:-1]]] if len(order) else order
+        ids[candidate_points[closest]] = self.node_ids[candidates[closest]]
+        distances[candidate_points[closest]] = candidate_distances[closest]
+
+        # Nodes outside the 3x3 cells can only be closer than the candidate if it is farther than one cell
+        for k in np.flatnonzero(distances > self.cell_size).tolist():
+            ids[k], distances[k] = self.nearest(lats[k], lons[k])
+        return ids, distances
+
+# Snap coordinates through the Neo4j POINT INDEX (cold start). Coordinates with no
+# intersection within radius meters get id -1 and an infinite distance
+def snap_with_database(graph, lats, lons, radius=500):
+    lats = [float(lat) for lat in np.atleast_1d(lats)]
+    lons = [float(lon) for lon in np.atleast_1d(lons)]
+    ids = np.full(len(lats), -1, dtype=np.int64)
+    distances = np.full(len(lats), np.inf)
+    for record in graph.run(nearest_intersections_query, lats=lats, lons=lons, radius=radius):
+        ids[record['k']] = record['id']
+        distances[record['k']] = record['distance']
+    return ids, distances
+
+# Snap coordinates with the in-memory index when there is one, else with the database
+def snap_points(graph, lats, lons, index=None, radius=500):
+    if index is not None:
+        return index.snap(lats, lons)
+    return snap_with_database(graph, lats, lons, radius)
+
+# Routing entry point for GPS coordinates: snap start and end (lat, lon) to the
+# nearest intersections and run the selected engine between them
+def route_between_points(graph, start, end, engine='dijkstra', snapshot=None, index=None):
+    ids, _ = snap_points(graph, [start[0], end[0]], [start[1], end[1]], index)
+    if ids[0] == -1 or ids[1] == -1:
+        return float('inf'), []
+    return shortest_path(graph, int(ids[0]), int(ids[1]), engine=engine, snapshot=snapshot)
+
+# Main code
+if __name__ == "__main__":
+    # Connect to Neo4j
+    graph = Graph("bolt://localhost:7687", auth=None)
+    snapshot = RoadGraphSnapshot(graph)
+
+    start_time = time.perf_counter()
+    index = GridIndex(snapshot)
+    print(f"Indexed {len(index)} intersections in {(time.perf_counter() - start_time) * 1000:.1f} ms")
+
+    # Random coordinates around the network
+    rng = np.random.default_rng(42)
+    lats = rng.uniform(np.min(index.lats), np.max(index.lats), 10000)
+    lons = rng.uniform(np.min(index.lons), np.max(index.lons), 10000)
+    start_time = time.perf_counter()
+    ids, distances = index.snap(lats, lons)
+    print(f"Snapped {len(ids)} coordinates in {(time.perf_counter() - start_time) * 1000:.1f} ms, "
+          f"median distance {np.median(distances):.0f} m")
+
+    start_time = time.perf_counter()
+    snap_with_database(graph, lats[:100], lons[:100])
+    print(f"Snapped 100 coordinates with the POINT INDEX in {(time.perf_counter() - start_time) * 1000:.1f} ms")
+
+    print(route_between_points(graph, (37.3890, -5.9845), (37.3772, -5.9869), snapshot=snapshot, index=index))
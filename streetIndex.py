@@ -0,0 +1,156 @@
+import bisect
+import difflib
+import heapq
+import time
+import unicodedata
+from py2neo import Graph
+
+# Cypher query to read every distinct street name once (name can be a string or a list)
+street_names_query = '''
+    MATCH ()-[r:ROAD_SEGMENT]->()
+    WHERE r.name IS NOT NULL
+    RETURN DISTINCT r.name AS name
+'''
+
+# Optional Neo4j full-text index over the street names, accent-folding analyzer
+fulltext_index_query = '''
+    CREATE FULLTEXT INDEX street_names IF NOT EXISTS
+    FOR ()-[r:ROAD_SEGMENT]-() ON EACH [r.name]
+    OPTIONS {indexConfig: {`fulltext.analyzer`: 'standard-folding'}}
+'''
+fulltext_search_query = '''
+    CALL db.index.fulltext.queryRelationships('street_names', $search, {limit: $limit}) YIELD relationship, score
+    RETURN relationship.name AS name, score
+'''
+
+# Lucene special characters that must be escaped in full-text queries
+LUCENE_SPECIAL = set('+-&|!(){}[]^"~*?:\\/')
+
+# Lookup key of a street name: accents folded, case folded, whitespace collapsed
+def normalize_street_name(name):
+    decomposed = unicodedata.normalize('NFKD', name)
+    folded = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    return ' '.join(folded.casefold().split())
+
+def _trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+# In-memory street name index built once from the graph. Every word start of
+# every normalized name is kept in one sorted list, so 'torneo' finds
+# 'Calle Torneo' with a binary search; a trigram index gives fuzzy matches
+class StreetIndex:
+
+    def __init__(self, names=()):
+        self.names = []
+        self.keys = []
+        seen = set()
+        for name in names:
+            for single_name in (name if isinstance(name, list) else [name]):
+                if not isinstance(single_name, str) or not single_name.strip() or single_name in seen:
+                    continue
+                seen.add(single_name)
+                self.names.append(single_name)
+                self.keys.append(normalize_street_name(single_name))
+
+        # (suffix of the key starting at a word, name index), sorted
+        self.entries = []
+        self.trigrams = {}
+        for i, key in enumerate(self.keys):
+            position = 0
+            for word in key.split(' '):
+                self.entries.append((key[position:], i))
+                position += len(word) + 1
+            for trigram in _trigrams(key):
+                self.trigrams.setdefault(trigram, []).append(i)
+        self.entries.sort()
+
+    @classmethod
+    def from_graph(cls, graph):
+        return cls(record['name'] for record in graph.run(street_names_query))
+
+    def __len__(self):
+        return len(self.names)
+
+    # Names with a word starting with the given text, names starting with it first
+    def prefix(self, text, limit=None):
+        key = normalize_street_name(text)
+        matches = []
+        seen = set()
+        entries = self.entries
+        for position in range(bisect.bisect_left(entries, (key,)), len(entries)):
+            suffix, i = entries[position]
+            if not suffix.startswith(key):
+                break
+            if i not in seen:
+                seen.add(i)
+                matches.append(i)
+        matches.sort(key=lambda i: (not self.keys[i].startswith(key), self.keys[i]))
+        return [self.names[i] for i in matches[:limit]]
+
+    # Closest names by trigram overlap, re-ranked by similarity ratio. Trigrams
+    # shared by a large part of the names ('cal', 'lle', ...) are skipped when
+    # rarer ones are available, they do not discriminate and cost the most
+    def fuzzy(self, text, limit=10, cutoff=0.6):
+        key = normalize_street_name(text)
+        postings = sorted((self.trigrams[trigram] for trigram in _trigrams(key) if trigram in self.trigrams), key=len)
+        common = max(50, len(self.names) // 10)
+        postings = [posting for posting in postings if len(posting) <= common] or postings[:1]
+        overlap = {}
+        for posting in postings:
+            for i in posting:
+                overlap[i] = overlap.get(i, 0) + 1
+        candidates = heapq.nlargest(limit * 3, overlap, key=overlap.get)
+        scored = []
+        for i in candidates:
+            ratio = difflib.SequenceMatcher(None, key, self.keys[i]).ratio()
+            if ratio >= cutoff:
+                scored.append((-ratio, self.keys[i], i))
+        scored.sort()
+        return [self.names[i] for _, _, i in scored[:limit]]
+
+    # Prefix matches, completed with fuzzy matches when there are too few
+    def suggest(self, text, limit=20):
+        suggestions = self.prefix(text, limit)
+        if len(suggestions) < limit and text.strip():
+            suggestions += [name for name in self.fuzzy(text, limit) if name not in suggestions][:limit - len(suggestions)]
+        return suggestions
+
+def create_fulltext_index(graph):
+    graph.run(fulltext_index_query)
+
+# Server-side suggestions from the full-text index, e.g. before the in-memory index is built
+def fulltext_suggestions(graph, text, limit=20):
+    words = [''.join('\\' + c if c in LUCENE_SPECIAL else c for c in word) for word in text.split()]
+    if not words:
+        return []
+    # Every word must match, the last one may be incomplete
+    search = ' AND '.join(words[:-1] + [words[-1] + '*'])
+    suggestions = []
+    for record in graph.run(fulltext_search_query, search=search, limit=limit * 5):
+        for name in (record['name'] if isinstance(record['name'], list) else [record['name']]):
+            if name not in suggestions:
+                suggestions.append(name)
+    return suggestions[:limit]
+
+# Average latency of a lookup function in microseconds
+def _latency_us(lookup, texts, repeat=100):
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            lookup(text)
+    return (time.perf_counter() - start_time) / (repeat * len(texts)) * 1e6
+
+# Main code
+if __name__ == "__main__":
+    # Connect to Neo4j
+    graph = Graph("bolt://localhost:7687", auth=None)
+
+    start_time = time.perf_counter()
+    street_index = StreetIndex.from_graph(graph)
+    print(f"Indexed {len(street_index)} street names in {(time.perf_counter() - start_time) * 1000:.1f} ms")
+
+    texts = ['Calle', 'avenida de la reina', 'torneo', 'Republica Argentina', 'san ']
+    print(f"prefix: {_latency_us(street_index.prefix, texts):.1f} us per lookup")
+    print(f"fuzzy: {_latency_us(street_index.fuzzy, ['Avda Reina Mercedes', 'Calle Tornoe', 'Republica Argentin']):.1f} us per lookup")
+    print(street_index.suggest('reina merc'))
@@ -0,0 +1,24 @@
+import os
+import sys
+import pytest
+
+# The modules live at the top of the repository, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmark import InMemoryGraph, SyntheticNetwork, load_network
+
+# Small synthetic grid as the benchmarks generate it (jittered intersections,
+# some one-way streets), keyed on its osmids
+@pytest.fixture
+def network():
+    return SyntheticNetwork(64, seed=1)
+
+@pytest.fixture
+def snapshot(network):
+    return network.snapshot()
+
+# The same network loaded into an in-memory stand-in for Neo4j, keyed on id()
+@pytest.fixture
+def graph(network):
+    graph = InMemoryGraph()
+    load_network(graph, network)
+    return graph
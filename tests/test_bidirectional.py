@@ -0,0 +1,77 @@
+import random
+import pytest
+from operations import RoadGraphSnapshot, bidirectional_astar, bidirectional_dijkstra, dijkstra, haversine
+
+HIGHWAYS = [('50', 'primary', '2'), ('30', 'residential', '1'), (None, 'service', None), ('20 mph', None, '3')]
+
+# Random road network around Seville: a grid with some one-way and missing
+# segments, plus a few isolated nodes that no pair can reach. Segments are at
+# least as long as the straight line, as real ones are (A* relies on it)
+def random_snapshot(seed, size=12, isolated=3):
+    rng = random.Random(seed)
+    nodes = []
+    for r in range(size):
+        for c in range(size):
+            nodes.append((r * size + c, 37.38 + r * 0.001 + rng.uniform(-2e-4, 2e-4), -5.98 + c * 0.00125 + rng.uniform(-2e-4, 2e-4)))
+    nodes += [(size * size + k, 37.3 + k * 0.001, -6.0) for k in range(isolated)]
+    edges = []
+    for r in range(size):
+        for c in range(size):
+            u = r * size + c
+            for v in ((u + 1) if c + 1 < size else None, (u + size) if r + 1 < size else None):
+                if v is None or rng.random() < 0.1:
+                    continue
+                length = haversine(*nodes[u][1:], *nodes[v][1:]) * 1000 * rng.uniform(1.0, 1.5)
+                attributes = rng.choice(HIGHWAYS)
+                if rng.random() < 0.3:
+                    u_, v_ = (u, v) if rng.random() < 0.5 else (v, u)
+                    edges.append((u_, v_, length, *attributes))
+                else:
+                    edges.append((u, v, length, *attributes))
+                    edges.append((v, u, length, *attributes))
+    return RoadGraphSnapshot.from_edges(nodes, edges)
+
+# A path is valid if it goes from start to end over existing segments and costs what was returned
+def path_cost(snapshot, path, weight):
+    weights = snapshot.edge_weights(weight)[0]
+    cost = 0
+    for u, v in zip(path, path[1:]):
+        i, j = snapshot.index[u], snapshot.index[v]
+        costs = [weights[edge] for edge in range(snapshot.offsets[i], snapshot.offsets[i + 1]) if snapshot.targets[edge] == j]
+        assert costs, f"no segment from {u} to {v}"
+        cost += min(costs)
+    return cost
+
+@pytest.mark.parametrize('engine', [bidirectional_dijkstra, bidirectional_astar])
+@pytest.mark.parametrize('weight', ['length', 'time'])
+@pytest.mark.parametrize('seed', range(5))
+def test_bidirectional_matches_dijkstra(engine, weight, seed):
+    snapshot = random_snapshot(seed)
+    rng = random.Random(seed)
+    for _ in range(40):
+        start_id, end_id = rng.choice(snapshot.node_ids), rng.choice(snapshot.node_ids)
+        expected, _ = dijkstra(None, start_id, end_id, snapshot=snapshot, weight=weight)
+        cost, path = engine(None, start_id, end_id, snapshot=snapshot, weight=weight)
+        if expected == float('inf'):
+            assert cost == float('inf') and path == []
+            continue
+        assert cost == pytest.approx(expected)
+        assert path[0] == start_id and path[-1] == end_id
+        assert path_cost(snapshot, path, weight) == pytest.approx(expected)
+
+@pytest.mark.parametrize('engine', [bidirectional_dijkstra, bidirectional_astar])
+def test_unreachable_and_unknown_nodes(engine):
+    snapshot = random_snapshot(0)
+    isolated = snapshot.node_ids[-1]
+    assert engine(None, 0, isolated, snapshot=snapshot) == (float('inf'), [])
+    assert engine(None, isolated, 0, snapshot=snapshot) == (float('inf'), [])
+    assert engine(None, 0, -1, snapshot=snapshot) == (float('inf'), [])
+    assert engine(None, 5, 5, snapshot=snapshot) == (0, [5])
+
+def test_one_way_segment_is_not_used_backwards():
+    nodes = [(1, 37.38, -5.98), (2, 37.381, -5.98), (3, 37.382, -5.98)]
+    edges = [(1, 2, 120.0), (2, 3, 120.0), (3, 1, 500.0)]
+    snapshot = RoadGraphSnapshot.from_edges(nodes, edges)
+    for engine in (bidirectional_dijkstra, bidirectional_astar):
+        assert engine(None, 1, 3, snapshot=snapshot) == (240.0, [1, 2, 3])
+        assert engine(None, 3, 2, snapshot=snapshot) == (620.0, [3, 1, 2])
@@ -0,0 +1,50 @@
+import csv
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from osmToNeo4j import export_csv, validate_csv_export
+
+def read_export(out_dir, stem):
+    with open(os.path.join(out_dir, f'{stem}_header.csv'), newline='') as f:
+        header = next(csv.reader(f))
+    with open(os.path.join(out_dir, f'{stem}.csv'), newline='') as f:
+        return [dict(zip(header, row)) for row in csv.reader(f)]
+
+def test_only_list_values_get_array_types(tmp_path):
+    out_dir = str(tmp_path)
+    nodes = pd.DataFrame({'osmid': [1, 2, 3], 'y': [37.1, 37.2, 37.3], 'x': [-5.9, -5.8, -5.7],
+                          'ref': np.nan, 'highway': [np.nan, 'traffic_signals', np.nan], 'street_count': [3, 2, 1]})
+    rels = pd.DataFrame({'u': [1, 2, 3], 'v': [2, 3, 1], 'osmid': [10, [11, 12], 13], 'oneway': [True, False, False],
+                         'name': ['Calle Torneo', ['A', 'B'], np.nan], 'maxspeed': [np.nan, '30', '50'],
+                         'highway': 'residential', 'length': [10.5, 20.0, 3.3]})
+
+    assert export_csv(nodes, rels, out_dir, chunk_size=2) == {'intersections': 3, 'road_segments': 3}
+    assert validate_csv_export(out_dir) == {'intersections': 3, 'road_segments': 3}
+
+    # Scalars keep scalar types, as the Bolt import stores them
+    scalars = read_export(out_dir, 'road_segments')
+    assert [(row['osmid:long'], row['name:string']) for row in scalars] == [('10', 'Calle Torneo'), ('13', '')]
+    assert read_export(out_dir, 'intersections')[1]['highway:string'] == 'traffic_signals'
+
+    lists = read_export(out_dir, 'road_segments-osmid-name-names')
+    assert lists == [dict(lists[0], **{'osmid:long[]': '11|12', 'name:string[]': 'A|B', 'names:string[]': 'A|B', 'max_speed:string': '30'})]
+    assert all(row['names:string'] == '' for row in scalars)
+
+    # A new export replaces the files of the previous one
+    export_csv(nodes, rels.assign(osmid=[10, 11, 13], name='Calle Torneo'), out_dir)
+    assert not os.path.exists(os.path.join(out_dir, 'road_segments-osmid-name-names.csv'))
+    assert len(read_export(out_dir, 'road_segments')) == 3
+
+def test_geometry_is_written_as_wkt(tmp_path):
+    geopandas = pytest.importorskip('geopandas')
+    from shapely.geometry import LineString, Point
+    out_dir = str(tmp_path)
+    nodes = geopandas.GeoDataFrame({'osmid': [1, 2], 'y': [37.1, 37.2], 'x': [-5.9, -5.8], 'street_count': [1, 1]},
+                                   geometry=[Point(-5.9, 37.1), Point(-5.8, 37.2)])
+    rels = geopandas.GeoDataFrame({'u': [1, 2], 'v': [2, 1], 'osmid': [10, 10], 'oneway': False, 'length': 11.1},
+                                  geometry=[LineString([(-5.9, 37.1), (-5.8, 37.2)]), LineString([(-5.8, 37.2), (-5.9, 37.1)])])
+
+    export_csv(nodes, rels, out_dir, chunk_size=1)
+    assert [row['geometry:string'] for row in read_export(out_dir, 'road_segments')] == [
+        'LINESTRING (-5.9 37.1, -5.8 37.2)', 'LINESTRING (-5.8 37.2, -5.9 37.1)']
@@ -0,0 +1,39 @@
+import os
+import struct
+import pytest
+from graphFile import FORMAT_VERSION, GraphFile, MappedSnapshot, write_graph_file
+
+def write_line(path):
+    return write_graph_file(str(path), [3, 1, 2], [37.1, 37.2, 37.3], [-5.9, -5.8, -5.7], [1, 2], [2, 3], [100.0, 50.0],
+                            names=['Calle Torneo', None], version=7)
+
+def test_round_trip(tmp_path):
+    snapshot = MappedSnapshot(write_line(tmp_path / 'line.graph'), verify=True)
+    assert list(snapshot.node_ids) == [1, 2, 3]
+    assert list(snapshot.targets) == [1, 2] and list(snapshot.weights) == [100.0, 50.0]
+    assert snapshot.version == 7
+    assert snapshot.file.edge_name(0) == 'Calle Torneo' and snapshot.file.edge_name(1) is None
+
+def test_truncated_file_is_rejected_without_verify(tmp_path):
+    path = write_line(tmp_path / 'line.graph')
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) - 1)
+    with pytest.raises(ValueError, match='truncated'):
+        GraphFile(path)
+    with pytest.raises(ValueError, match='truncated'):
+        MappedSnapshot(path)
+
+def test_truncated_header_is_rejected(tmp_path):
+    path = write_line(tmp_path / 'line.graph')
+    with open(path, 'r+b') as f:
+        f.truncate(100)
+    with pytest.raises(ValueError, match='corrupt'):
+        GraphFile(path)
+
+def test_files_of_an_older_format_are_rejected(tmp_path):
+    path = write_line(tmp_path / 'line.graph')
+    with open(path, 'r+b') as f:
+        f.seek(8)
+        f.write(struct.pack('<I', FORMAT_VERSION - 1))
+    with pytest.raises(ValueError, match='format version'):
+        GraphFile(path)
@@ -0,0 +1,71 @@
+import pytest
+from benchmark import InMemoryDriver, InMemoryGraph, SyntheticNetwork, _InMemorySession
+from osmToNeo4j import ImportCheckpoint, import_phase, node_query, rels_query
+
+BATCH_SIZE = 50
+
+# Driver whose relationship writes fail for good once fail_after batches went through
+class InterruptedDriver(InMemoryDriver):
+
+    def __init__(self, graph, fail_after):
+        super().__init__(graph)
+        self.remaining = fail_after
+
+    def session(self):
+        driver = self
+
+        class Session(_InMemorySession):
+            def run(self, query, parameters=None, **kwparameters):
+                if query == rels_query:
+                    if driver.remaining == 0:
+                        raise RuntimeError("connection lost")
+                    driver.remaining -= 1
+                return super().run(query, parameters, **kwparameters)
+
+        return Session(self.graph)
+
+def network_rows():
+    network = SyntheticNetwork(200, seed=3)
+    nodes = [row for rows in network.node_rows(BATCH_SIZE) for row in rows]
+    segments = [row for rows in network.segment_rows(BATCH_SIZE) for row in rows]
+    return nodes, segments
+
+def batches(rows):
+    return [rows[start:start + BATCH_SIZE] for start in range(0, len(rows), BATCH_SIZE)]
+
+def run_import(driver, checkpoint, nodes, segments):
+    written = import_phase(driver, 'nodes', node_query, batches(nodes), checkpoint, workers=1, retries=1)
+    written += import_phase(driver, 'relationships', rels_query, batches(segments), checkpoint, workers=1, retries=1)
+    return written
+
+def test_resume_after_interruption(tmp_path):
+    path = str(tmp_path / 'checkpoint.json')
+    nodes, segments = network_rows()
+    graph = InMemoryGraph()
+
+    with pytest.raises(RuntimeError):
+        run_import(InterruptedDriver(graph, fail_after=3), ImportCheckpoint(path, 'synthetic', BATCH_SIZE), nodes, segments)
+    assert len(graph.src) == 3 * BATCH_SIZE
+
+    checkpoint = ImportCheckpoint(path, 'synthetic', BATCH_SIZE)
+    assert checkpoint.started()
+    assert checkpoint.done('relationships', 2) and not checkpoint.done('relationships', 3)
+
+    # Only the batches that were not committed are written again
+    written = run_import(InMemoryDriver(graph), checkpoint, nodes, segments)
+    assert written == len(segments) - 3 * BATCH_SIZE
+    assert len(graph) == len(nodes)
+    assert len(graph.src) == len(segments)
+    assert sorted(zip(graph.src, graph.dst)) == sorted((graph.index[row['u']], graph.index[row['v']]) for row in segments)
+
+    checkpoint.clear()
+    assert not ImportCheckpoint(path, 'synthetic', BATCH_SIZE).started()
+
+def test_checkpoint_of_other_batch_size_is_discarded(tmp_path):
+    path = str(tmp_path / 'checkpoint.json')
+    checkpoint = ImportCheckpoint(path, 'synthetic', BATCH_SIZE)
+    checkpoint.mark('nodes', 0)
+
+    assert ImportCheckpoint(path, 'synthetic', BATCH_SIZE).done('nodes', 0)
+    assert not ImportCheckpoint(path, 'synthetic', BATCH_SIZE * 2).started()
+    assert not ImportCheckpoint(path, 'elsewhere', BATCH_SIZE).started()
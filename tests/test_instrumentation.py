@@ -0,0 +1,44 @@
+import pytest
+import instrumentation
+from operations import SearchControl, dijkstra, shortest_path
+
+@pytest.fixture
+def measurements():
+    class Collector:
+        def __init__(self):
+            self.metrics = []
+
+        def export(self, metrics):
+            self.metrics.append(metrics)
+
+    collector = Collector()
+    instrumentation.enable(collector)
+    yield collector.metrics
+    instrumentation.disable()
+
+def test_positional_control_is_counted(snapshot, measurements):
+    start, end = snapshot.node_ids[0], snapshot.node_ids[-1]
+    control = SearchControl()
+    cost, path = dijkstra(None, start, end, snapshot, 'length', control)
+    assert path[0] == start and path[-1] == end
+    assert measurements[-1].name == 'dijkstra'
+    assert measurements[-1].settled == control.settled > 0
+
+    # Without a control the wrapper counts through its own one, in place of the positional None
+    assert dijkstra(None, start, end, snapshot, 'length', None) == (cost, path)
+    assert measurements[-1].settled == control.settled
+
+def test_nested_searches_count_once(snapshot, measurements):
+    start, end = snapshot.node_ids[0], snapshot.node_ids[-1]
+    dijkstra(None, start, end, snapshot=snapshot)
+    direct = measurements[-1].settled
+
+    shortest_path(None, start, end, engine='dijkstra', snapshot=snapshot)
+    assert measurements[-1].name == 'shortest_path'
+    assert measurements[-1].settled == direct
+    assert 'dijkstra' in measurements[-1].phases
+
+def test_disabled_searches_are_not_wrapped(snapshot):
+    before = instrumentation.last()
+    dijkstra(None, snapshot.node_ids[0], snapshot.node_ids[-1], snapshot, 'length', None)
+    assert instrumentation.last() is before
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+import isochrone as isochrone_module
+from isochrone import _convex_hull, hull, isochrone
+from operations import RoadGraphSnapshot, dijkstra
+
+def costs_of(result):
+    return dict(zip(result['ids'].tolist(), result['costs'].tolist()))
+
+def test_multi_source_cost_is_the_nearest_source(snapshot):
+    sources = [snapshot.node_ids[0], snapshot.node_ids[-1]]
+    costs = costs_of(isochrone(None, sources, float('inf'), snapshot=snapshot))
+    for node_id in snapshot.node_ids:
+        expected = min(dijkstra(None, source, node_id, snapshot=snapshot)[0] for source in sources)
+        if expected == float('inf'):
+            assert node_id not in costs
+        else:
+            assert costs[node_id] == pytest.approx(expected)
+
+def test_budget_is_inclusive(snapshot):
+    source = snapshot.node_ids[0]
+    everything = costs_of(isochrone(None, source, float('inf'), snapshot=snapshot))
+    budget = sorted(everything.values())[len(everything) // 2]
+    result = isochrone(None, source, budget, snapshot=snapshot)
+    assert costs_of(result) == {node_id: cost for node_id, cost in everything.items() if cost <= budget}
+    assert list(result['costs']) == sorted(result['costs'])
+    below = costs_of(isochrone(None, source, np.nextafter(budget, 0), snapshot=snapshot))
+    assert below == {node_id: cost for node_id, cost in everything.items() if cost < budget}
+
+def test_reverse_searches_the_reversed_graph(network, snapshot):
+    osmids = network.osmids.tolist()
+    reversed_snapshot = RoadGraphSnapshot.from_edges(zip(osmids, network.lats.tolist(), network.lons.tolist()),
+                                                     ((osmids[v], osmids[u], length) for u, v, length in
+                                                      zip(network.src.tolist(), network.dst.tolist(), network.lengths.tolist())))
+    source = snapshot.node_ids[len(snapshot) // 2]
+    for budget in (250.0, 450.0, float('inf')):
+        reverse = costs_of(isochrone(None, source, budget, snapshot=snapshot, reverse=True))
+        expected = costs_of(isochrone(None, source, budget, snapshot=reversed_snapshot))
+        assert reverse.keys() == expected.keys()
+        assert all(reverse[node_id] == pytest.approx(cost) for node_id, cost in expected.items())
+
+def test_unknown_source_and_negative_budget(snapshot):
+    with pytest.raises(KeyError):
+        isochrone(None, -1, 100.0, snapshot=snapshot)
+    with pytest.raises(ValueError):
+        isochrone(None, snapshot.node_ids[0], -1.0, snapshot=snapshot)
+
+def test_convex_hull():
+    square = [(0, 0), (2, 0), (2, 2), (0, 2), (1, 1), (1, 0)]
+    assert _convex_hull(square) == [(0, 0), (2, 0), (2, 2), (0, 2)]
+    # Degenerate inputs span no area
+    assert _convex_hull([]) == []
+    assert _convex_hull([(0, 0), (1, 1)]) == []
+    assert _convex_hull([(0, 0), (0, 0), (0, 0)]) == []
+    assert _convex_hull([(0, 0), (1, 1), (2, 2), (3, 3)]) == []
+
+def test_polygon_without_shapely(monkeypatch, snapshot):
+    monkeypatch.setattr(isochrone_module, 'shapely', None)
+    result = isochrone(None, snapshot.node_ids[0], float('inf'), snapshot=snapshot, polygon=True)
+    # Closed ring whose vertices are reached intersections
+    assert len(result['lats']) >= 4
+    assert (result['lats'][0], result['lons'][0]) == (result['lats'][-1], result['lons'][-1])
+    positions = [snapshot.index[node_id] for node_id in result['ids'].tolist()]
+    reached = np.column_stack([np.asarray(snapshot.lats)[positions], np.asarray(snapshot.lons)[positions]])
+    for lat, lon in zip(result['lats'], result['lons']):
+        assert np.isclose(reached, [lat, lon]).all(axis=1).any()
+    lats, lons = hull([37.0, 37.001], [-5.9, -5.899])
+    assert len(lats) == len(lons) == 0
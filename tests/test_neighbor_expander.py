@@ -0,0 +1,10 @@
+import pytest
+from operations import NeighborExpander
+
+@pytest.mark.parametrize('cache_size', [0, 1, 100000])
+def test_neighbors_with_any_cache_size(graph, cache_size):
+    expected = NeighborExpander(graph)
+    expander = NeighborExpander(graph, cache_size=cache_size)
+    for node_id in list(range(len(graph))) * 2:
+        assert expander.neighbors(node_id) == expected.neighbors(node_id)
+    assert len(expander.adjacency) <= cache_size
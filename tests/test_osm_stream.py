@@ -0,0 +1,11 @@
+import pytest
+from osmStream import compare_memory
+
+def test_compare_memory_rejects_pbf():
+    with pytest.raises(ValueError, match='OSM XML'):
+        compare_memory('extract.osm.pbf')
+
+def test_compare_memory_reports_a_failed_measurement(tmp_path):
+    pytest.importorskip('osmium')
+    with pytest.raises(RuntimeError, match='stream measurement'):
+        compare_memory(str(tmp_path / 'missing.osm'), poll_interval=0.1)
@@ -0,0 +1,137 @@
+import threading
+import pytest
+import routeCache
+from operations import SearchCancelled, SearchControl, dijkstra
+from routeCache import RouteCache
+
+# Engine that blocks until released and counts its calls
+class BlockingEngine:
+
+    def __init__(self):
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, graph, start_id, end_id, snapshot=None, weight='length', control=None):
+        self.calls += 1
+        self.started.set()
+        while not self.release.wait(0.01):
+            if control is not None:
+                control.step()
+        return 300.0, [0, 1, 2, 3]
+
+def test_entries_follow_the_snapshot_version(network, snapshot):
+    cache = RouteCache()
+    snapshot.version = 1
+    start, end = snapshot.node_ids[0], snapshot.node_ids[-1]
+    expected = dijkstra(None, start, end, snapshot=snapshot)
+    assert cache.shortest_path(None, start, end, snapshot=snapshot) == expected
+    assert cache.shortest_path(None, start, end, snapshot=snapshot) == expected
+    assert cache.stats()['hits'] == 1
+
+    refreshed = network.snapshot()
+    refreshed.version = 2
+    cache.shortest_path(None, start, end, snapshot=refreshed)
+    assert cache.stats()['hits'] == 1 and cache.stats()['version'] == 2
+    assert cache.stats()['invalidations'] == 1
+
+def test_result_of_an_older_version_is_not_stored(monkeypatch, network, snapshot):
+    engine = BlockingEngine()
+    monkeypatch.setitem(routeCache.engines, 'blocking', engine)
+    cache = RouteCache()
+    snapshot.version = 1
+    thread = threading.Thread(target=cache.shortest_path, args=(None, 0, 3), kwargs={'engine': 'blocking', 'snapshot': snapshot})
+    thread.start()
+    engine.started.wait()
+    # The snapshot is refreshed while the search runs
+    refreshed = network.snapshot()
+    refreshed.version = 2
+    cache.current_version(refreshed)
+    engine.release.set()
+    thread.join()
+    assert len(cache) == 0
+
+def test_identical_misses_share_one_search(monkeypatch, snapshot):
+    engine = BlockingEngine()
+    monkeypatch.setitem(routeCache.engines, 'blocking', engine)
+    cache = RouteCache()
+    results = []
+
+    def search():
+        results.append(cache.shortest_path(None, 0, 3, engine='blocking', snapshot=snapshot))
+
+    threads = [threading.Thread(target=search) for _ in range(4)]
+    threads[0].start()
+    engine.started.wait()
+    for thread in threads[1:]:
+        thread.start()
+    while cache.stats()['coalesced'] < 3:
+        threading.Event().wait(0.01)
+    engine.release.set()
+    for thread in threads:
+        thread.join()
+
+    assert engine.calls == 1
+    assert results == [(300.0, [0, 1, 2, 3])] * 4
+
+def test_waiter_searches_itself_when_the_shared_search_is_cancelled(monkeypatch, snapshot):
+    engine = BlockingEngine()
+    monkeypatch.setitem(routeCache.engines, 'blocking', engine)
+    cache = RouteCache()
+    owner_control = SearchControl()
+    errors, results = [], []
+
+    def owner():
+        try:
+            cache.shortest_path(None, 0, 3, engine='blocking', snapshot=snapshot, control=owner_control)
+        except SearchCancelled as error:
+            errors.append(error)
+
+    owner_thread = threading.Thread(target=owner)
+    owner_thread.start()
+    engine.started.wait()
+    waiter_thread = threading.Thread(target=lambda: results.append(cache.shortest_path(None, 0, 3, engine='blocking', snapshot=snapshot)))
+    waiter_thread.start()
+    while cache.stats()['coalesced'] < 1:
+        threading.Event().wait(0.01)
+    owner_control.cancel()
+    owner_thread.join()
+    engine.release.set()
+    waiter_thread.join()
+
+    assert len(errors) == 1
+    assert results == [(300.0, [0, 1, 2, 3])]
+    assert engine.calls == 2
+
+def test_waiter_can_be_cancelled(monkeypatch, snapshot):
+    engine = BlockingEngine()
+    monkeypatch.setitem(routeCache.engines, 'blocking', engine)
+    cache = RouteCache()
+    owner_thread = threading.Thread(target=cache.shortest_path, args=(None, 0, 3), kwargs={'engine': 'blocking', 'snapshot': snapshot})
+    owner_thread.start()
+    engine.started.wait()
+
+    control = SearchControl()
+    control.cancel()
+    with pytest.raises(SearchCancelled):
+        cache.shortest_path(None, 0, 3, engine='blocking', snapshot=snapshot, control=control)
+    engine.release.set()
+    owner_thread.join()
+
+def test_search_stays_in_flight_until_its_result_is_cached(monkeypatch, snapshot):
+    engine = BlockingEngine()
+    engine.release.set()
+    monkeypatch.setitem(routeCache.engines, 'blocking', engine)
+    cache = RouteCache()
+    put = cache.put
+    in_flight = []
+
+    # A miss arriving while the result is stored must still find the running search
+    def checked_put(key, cost, path, version=None):
+        in_flight.append(dict(cache.in_flight))
+        put(key, cost, path, version)
+
+    monkeypatch.setattr(cache, 'put', checked_put)
+    assert cache.shortest_path(None, 0, 3, engine='blocking', snapshot=snapshot) == (300.0, [0, 1, 2, 3])
+    assert len(in_flight) == 1 and len(in_flight[0]) == 1
+    assert not cache.in_flight and len(cache) == 1
@@ -1,165 +1,49 @@
-from collections import deque
+import logging
+import os
+import time
 import tkinter as tk
+from concurrent.futures import ThreadPoolExecutor
 from tkinter import Spinbox, ttk
-import heapq
-from py2neo import Graph, RelationshipMatcher
-from math import radians, cos, sin, asin, sqrt
+from py2neo import Graph
 import matplotlib.pyplot as plt
-
-# Function to search for nodes connected to a specific street
-def find_street_nodes(graph, street_name):
-    rel_matcher = RelationshipMatcher(graph)
-    relationships = rel_matcher.match(r_type="ROAD_SEGMENT", name=street_name)
-
-    # Initialize a set for unique node identities and a list for nodes information
-    nodes_info = []
-
-    node_cache = {}
-
-    for rel in relationships:
-        # Check if start_node is already processed
-        if rel.start_node.identity not in node_cache:
-            # If not in cache, fetch and store it
-            start_node_info = (rel.start_node.identity, rel.start_node.get('location', None))
-            node_cache[rel.start_node.identity] = start_node_info
-            nodes_info.append(start_node_info)
-        else:
-            # If in cache, directly append from cache
-            nodes_info.append(node_cache[rel.start_node.identity])
-            
-    return nodes_info
-
-def dijkstra(graph, start_id, end_id):
-    # Fetch all nodes and relationships to build the graph structure
-    nodes = list(graph.nodes.match("Intersection"))
-    rels = list(graph.relationships.match(r_type="ROAD_SEGMENT"))
-    
-    # Create adjacency list representation of the graph
-    adjacency_list = {node.identity: [] for node in nodes}
-    for rel in rels:
-        adjacency_list[rel.start_node.identity].append((rel.end_node.identity, rel['length']))
-    
-    # Initialize data structures for Dijkstra's algorithm
-    queue = [(0, start_id)]  # Priority queue: (distance, node_id)
-    distances = {node_id: float('inf') for node_id in adjacency_list}
-    distances[start_id] = 0
-    predecessors = {node_id: None for node_id in adjacency_list}
-    
-    while queue:
-        current_distance, current_node = heapq.heappop(queue)
-        
-        if current_node == end_id:
-            break  # Stop if the target node has been reached
-        
-        for neighbor, weight in adjacency_list[current_node]:
-            distance = current_distance + weight
-            if distance < distances[neighbor]:
-                distances[neighbor] = distance
-                predecessors[neighbor] = current_node
-                heapq.heappush(queue, (distance, neighbor))
-                
-    # Reconstruct the shortest path from end_id to start_id
-    path = []
-    current_node = end_id
-    while current_node is not None:
-        path.insert(0, current_node)
-        current_node = predecessors[current_node]
-        
-    if path[0] == start_id:  # Ensure the path is valid
-        return distances[end_id], path
-    else:
-        return float('inf'), []
-
-# Haversine formula to calculate the distance between two points on the Earth's surface
-def haversine(lat1, lon1, lat2, lon2):
-    # Convert decimal degrees to radians
-    lon1, lat1, lon2, lat2 = map(radians, [lon1, lat1, lon2, lat2])
-
-    # Haversine formula
-    dlon = lon2 - lon1
-    dlat = lat2 - lat1
-    a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-    c = 2 * asin(sqrt(a))
-    r = 6371  # Radius of Earth in kilometers. Use 3956 for miles
-    return c * r
-
-# A* algorithm implementation
-def astar(graph, start_id, end_id):
-    start_node = graph.nodes.get(start_id)
-    end_node = graph.nodes.get(end_id)
-    
-    # Extract latitude and longitude from the start and end nodes
-    start_lat, start_lon = start_node['location'].latitude, start_node['location'].longitude
-    end_lat, end_lon = end_node['location'].latitude, end_node['location'].longitude
-
-    # Priority queue for A* algorithm
-    open_set = [(0 + haversine(start_lat, start_lon, end_lat, end_lon), 0, start_id, [])]  # (f_score, g_score, node_id, path)
-    
-    # Visited and cost dictionaries
-    visited = set()
-    g_score = {start_id: 0}
-
-    while open_set:
-        _, current_g, current, path = heapq.heappop(open_set)
-        
-        if current in visited:
-            continue
-
-        visited.add(current)
-        path = path + [current]
-
-        if current == end_id:
-            return current_g, path
-
-        neighbors = graph.relationships.match(nodes=[graph.nodes.get(current)], r_type="ROAD_SEGMENT")
-        for rel in neighbors:
-            neighbor = rel.end_node
-            temp_g_score = current_g + rel['length']
-            
-            if neighbor.identity in visited and temp_g_score >= g_score.get(neighbor.identity, float('inf')):
-                continue
-
-            if temp_g_score < g_score.get(neighbor.identity, float('inf')):
-                g_score[neighbor.identity] = temp_g_score
-                f_score = temp_g_score + haversine(neighbor['location'].latitude, neighbor['location'].longitude, end_lat, end_lon)
-                heapq.heappush(open_set, (f_score, temp_g_score, neighbor.identity, path))
-
-    return float('inf'), []
-
-def bfs(graph, start_id, end_id):
-    queue = deque([(start_id, 0, [])])  # Queue: (node_id, distance, path)
-    visited = set()
-
-    while queue:
-        current_node, distance, path = queue.popleft()
-        if current_node == end_id:
-            return distance, path + [current_node]
-
-        if current_node in visited:
-            continue
-
-        visited.add(current_node)
-        neighbors = graph.relationships.match(nodes=[graph.nodes.get(current_node)], r_type="ROAD_SEGMENT")
-        
-        for rel in neighbors:
-            neighbor = rel.end_node
-            queue.append((neighbor.identity, distance + rel['length'], path + [current_node]))
-
-    return float('inf'), []
-
-def get_street_suggestions(graph, partial_street_name):
-    rel_matcher = RelationshipMatcher(graph)
-    # Search for relationships with a name that begins with the partial text
-    relationships = rel_matcher.match(r_type="ROAD_SEGMENT")
-    streets = set()
-    for rel in relationships:
-        name = rel.get('name', '')
-        # Check if name is a list and take the first element, or ignore if it's NaN or an empty list
-        if isinstance(name, list):
-            name = name[0] if name else ''
-        if isinstance(name, str) and name and name.lower().startswith(partial_street_name.lower()):
-            streets.add(name)
-    return list(streets)
+import instrumentation
+from instrumentation import InstrumentedGraph, LoggingExporter, PrometheusExporter, instrumented
+from operations import RoadGraphSnapshot, SearchCancelled, SearchControl, fetch_route_geometry, find_street_nodes
+from routeCache import RouteCache
+from streetIndex import StreetIndex
+from spatialIndex import GridIndex
+
+# Measure the GUI startup time
+startup_time = time.perf_counter()
+
+# Street names for the Spinbox, served from the in-memory street index. Timed
+# (logged and exported) only when ROUTING_METRICS enables instrumentation
+@instrumented('street_suggestions')
+def get_street_suggestions(graph, partial_street_name, limit=None):
+    if not partial_street_name:
+        return street_index.prefix('', limit)
+    return street_index.suggest(partial_street_name, limit or 20)
+
+# Narrow the Spinbox values down to the suggestions for the typed text
+def update_street_suggestions(event):
+    text = street_name_var.get()
+    suggestions = get_street_suggestions(graph, text)
+    street_name_spinbox.config(values=suggestions or all_streets)
+    # Configuring the values resets the text, keep what the user typed
+    street_name_var.set(text)
+    street_name_spinbox.icursor(tk.END)
+
+# Start and end node ids from the input fields. A "lat,lon" entry is snapped to
+# the nearest intersection, both coordinates in one call to the spatial index
+def get_node_ids():
+    entries = [start_node_var.get().strip(), end_node_var.get().strip()]
+    ids = [None if ',' in entry else int(entry) for entry in entries]
+    coordinates = [tuple(float(value) for value in entry.split(',')) for entry in entries if ',' in entry]
+    if coordinates:
+        snapped, _ = spatial_index.snap([lat for lat, _ in coordinates], [lon for _, lon in coordinates])
+        snapped = iter(snapped.tolist())
+        ids = [next(snapped) if node_id is None else node_id for node_id in ids]
+    return ids
 
 def execute_find_street_nodes():
     street_name = street_name_var.get()
@@ -169,64 +53,136 @@ def execute_find_street_nodes():
     for node_id, location in nodes:
         result_text.insert(tk.END, f"{node_id}: {location}\n")
 
+# Plot color, legend label and title of every search engine offered by the GUI
+search_styles = {
+    'dijkstra': ('red', 'Dijkstra Path', 'Dijkstra'),
+    'astar': ('blue', 'A*', 'A*'),
+    'bfs': ('darkorange', 'BFS', 'BFS'),
+}
+
+# Runs on a worker thread: the route and, when there is one, its geometry, so
+# the Tk thread never waits for the database. Returns (cost, path, geometry)
+def search_route(start_node_id, end_node_id, engine, snapshot, control):
+    cost, path = route_cache.shortest_path(graph, start_node_id, end_node_id, engine=engine, snapshot=snapshot, control=control)
+    return cost, path, fetch_route_geometry(graph, path) if path else None
+
+# Start the searches of the given engines on the worker threads. Engines started
+# together form one job, shown side by side once all of them have finished
+def start_searches(engine_names):
+    start_node_id, end_node_id = get_node_ids()
+    searches = {}
+    for engine in engine_names:
+        control = SearchControl()
+        future = search_pool.submit(search_route, start_node_id, end_node_id, engine, snapshot, control)
+        searches[engine] = (future, control)
+    running_jobs.append((start_node_id, end_node_id, searches))
+
 def execute_dijkstra():
-    start_node_id = int(start_node_var.get())
-    end_node_id = int(end_node_var.get())
-    cost, path = dijkstra(graph, start_node_id, end_node_id)
-    result_text.delete('1.0', tk.END)
-    result_text.insert(tk.END, f"Dijkstra shortest path from node {start_node_id} to node {end_node_id}:\n")
-    result_text.insert(tk.END, f"Shortest path cost: {cost} meters\n")
-    result_text.insert(tk.END, f"Shortest path: {path}\n")
-    plot_route(graph, path, 'red', 'Dijkstra Path')
-    plt.xlabel('Longitude', fontsize='x-large')
-    plt.ylabel('Latitude', fontsize='x-large')
-    plt.legend()
-    plt.title('Dijkstra Shortest Path', fontsize='xx-large')
-    plt.show()
+    start_searches(['dijkstra'])
 
 def execute_astar():
-    start_node_id = int(start_node_var.get())
-    end_node_id = int(end_node_var.get())
-    cost, path = astar(graph, start_node_id, end_node_id)
-    result_text.delete('1.0', tk.END)
-    result_text.insert(tk.END, f"A* shortest path from node {start_node_id} to node {end_node_id}:\n")
-    result_text.insert(tk.END, f"Shortest path cost: {cost} meters\n")
-    result_text.insert(tk.END, f"Shortest path: {path}\n")
-    plot_route(graph, path, 'blue', 'A*')
-    plt.xlabel('Longitude', fontsize='x-large')
-    plt.ylabel('Latitude', fontsize='x-large')
-    plt.legend()
-    plt.title('A* Shortest Path', fontsize='xx-large')
-    plt.show()
-    
+    start_searches(['astar'])
+
 def execute_bfs():
-    start_node_id = int(start_node_var.get())
-    end_node_id = int(end_node_var.get())
-    cost, path = bfs(graph, start_node_id, end_node_id)
+    start_searches(['bfs'])
+
+def execute_compare():
+    start_searches(['dijkstra', 'astar', 'bfs'])
+
+def execute_cancel():
+    for _, _, searches in running_jobs:
+        for _, control in searches.values():
+            control.cancel()
+
+# Runs on the Tk main thread every 100 ms: show the settled-node count of the
+# running searches, display the jobs whose searches have all finished and swap
+# in a reloaded road network once no search uses the current one any more
+def poll_searches():
+    progress = []
+    for job in list(running_jobs):
+        start_node_id, end_node_id, searches = job
+        progress += [f"{search_styles[engine][2]}: {control.settled} settled"
+                     for engine, (future, control) in searches.items() if not future.done()]
+        if all(future.done() for future, _ in searches.values()):
+            running_jobs.remove(job)
+            show_results(start_node_id, end_node_id, searches)
+    if pending_refresh is not None:
+        if not pending_refresh.done():
+            progress.append("Reloading the road network")
+        elif running_jobs:
+            progress.append("Reloaded road network waiting for the running searches")
+        else:
+            swap_network()
+    progress_var.set(', '.join(progress) if progress else "No search running")
+    root.after(100, poll_searches)
+
+def show_results(start_node_id, end_node_id, searches):
+    result_text.delete('1.0', tk.END)
+    plotted = []
+    for engine, (future, control) in searches.items():
+        color, label, title = search_styles[engine]
+        try:
+            cost, path, geometry = future.result()
+        except SearchCancelled:
+            result_text.insert(tk.END, f"{title} search cancelled after {control.settled} settled nodes\n")
+            continue
+        except Exception as error:
+            result_text.insert(tk.END, f"{title} search failed: {error}\n")
+            continue
+        result_text.insert(tk.END, f"{title} shortest path from node {start_node_id} to node {end_node_id}:\n")
+        result_text.insert(tk.END, f"Shortest path cost: {cost} meters\n")
+        result_text.insert(tk.END, f"Shortest path: {path}\n")
+        if path:
+            plot_route(geometry, path, color, label)
+            plotted.append(title)
+    if plotted:
+        plt.xlabel('Longitude', fontsize='x-large')
+        plt.ylabel('Latitude', fontsize='x-large')
+        plt.legend()
+        plt.title(f"{' vs '.join(plotted)} Shortest Path", fontsize='xx-large')
+        plt.show()
+
+# Stop the running searches before closing the window
+def close_window():
+    execute_cancel()
+    search_pool.shutdown(wait=False)
+    refresh_pool.shutdown(wait=False)
+    root.destroy()
+
+# Runs on the refresh thread: a new snapshot and the indexes over it. The
+# running searches keep the current snapshot, poll_searches swaps them in
+def load_network():
+    new_snapshot = RoadGraphSnapshot(graph)
+    return new_snapshot, StreetIndex.from_graph(graph), GridIndex(new_snapshot)
+
+def execute_refresh_graph():
+    global pending_refresh
+    if pending_refresh is not None:
+        return  # Already reloading
+    pending_refresh = refresh_pool.submit(load_network)
+
+# Runs on the Tk main thread once the reload has finished and no search is running
+def swap_network():
+    global pending_refresh, snapshot, street_index, spatial_index
+    future, pending_refresh = pending_refresh, None
     result_text.delete('1.0', tk.END)
-    result_text.insert(tk.END, f"BFS shortest path from node {start_node_id} to node {end_node_id}:\n")
-    result_text.insert(tk.END, f"Shortest path cost: {cost} meters\n")
-    result_text.insert(tk.END, f"Shortest path: {path}\n")
-    plot_route(graph, path, 'darkorange', 'BFS')
-    plt.xlabel('Longitude', fontsize='x-large')
-    plt.ylabel('Latitude', fontsize='x-large')
-    plt.legend()
-    plt.title('BFS Shortest Path', fontsize='xx-large')
-    plt.show()
-    
-def plot_route(graph, path, color, label):
-    x_coords = []
-    y_coords = []
-    total_distance = 0  # Initialize total distance to 0
-    
-    # Fetch nodes
-    for node_id in path:
-        node = graph.nodes.get(node_id)
-        x_coords.append(node['location'].longitude)
-        y_coords.append(node['location'].latitude)
-
-    # Plot the route
-    plt.plot(x_coords, y_coords, color=color, label=label, linewidth=2)
+    try:
+        new_snapshot, new_street_index, new_spatial_index = future.result()
+    except Exception as error:
+        result_text.insert(tk.END, f"Road network reload failed: {error}\n")
+        return
+    snapshot, street_index, spatial_index = new_snapshot, new_street_index, new_spatial_index
+    route_cache.invalidate()
+    result_text.insert(tk.END, f"Road network reloaded: {len(snapshot)} intersections, {len(snapshot.targets)} road segments\n")
+
+# Plot a route from its geometry (fetch_route_geometry: coordinates, lengths, names and shapes)
+def plot_route(geometry, path, color, label):
+    x_coords = geometry['lons']
+    y_coords = geometry['lats']
+
+    # Plot the route along the real street geometry
+    for i, shape in enumerate(geometry['shapes']):
+        plt.plot([x for x, _ in shape], [y for _, y in shape], color=color, label=label if i == 0 else None, linewidth=2)
     # Starting point
     plt.scatter(x_coords[0], y_coords[0], c='yellow', edgecolor='yellow', label='Start', zorder=5)
     # Finishing point
@@ -234,20 +190,20 @@ def plot_route(graph, path, color, label):
     # Rest of the route
     plt.scatter(x_coords[1:-1], y_coords[1:-1], c=color)
 
-    # Fetch relationships and annotate the distance
+    # Annotate the distance of every segment
+    total_distance = 0
     for i in range(1, len(path)):
-        start_node = graph.nodes.get(path[i-1])
-        end_node = graph.nodes.get(path[i])
-        rel = graph.relationships.match((start_node, end_node), r_type="ROAD_SEGMENT").first()
-        if rel:
-            distance = rel['length']
-            street_name = rel['name'] if 'name' in rel else ''
-            total_distance += distance
-            # Get the midpoint for the label
-            mid_x = (x_coords[i-1] + x_coords[i]) / 2
-            mid_y = (y_coords[i-1] + y_coords[i]) / 2
-            # Annotate the segment with the distance
-            plt.annotate(f"{street_name}\n{distance:.2f} m", (mid_x, mid_y), textcoords="offset points", xytext=(0,5), ha='center')
+        distance = geometry['lengths'][i-1]
+        if distance != distance:  # No segment between the two nodes
+            continue
+        name = geometry['names'][i-1]
+        street_name = ', '.join(name) if isinstance(name, list) else (name or '')
+        total_distance += distance
+        # Get the midpoint for the label
+        mid_x = (x_coords[i-1] + x_coords[i]) / 2
+        mid_y = (y_coords[i-1] + y_coords[i]) / 2
+        # Annotate the segment with the distance
+        plt.annotate(f"{street_name}\n{distance:.2f} m", (mid_x, mid_y), textcoords="offset points", xytext=(0,5), ha='center')
 
     # Annotate the total distance
     plt.annotate(f"Total distance: {total_distance:.2f} m", (x_coords[-1], y_coords[-1]), textcoords="offset points", xytext=(0,-15), ha='center', fontsize=9, bbox=dict(boxstyle="round,pad=0.3", edgecolor=color, facecolor='white'))
@@ -256,7 +212,35 @@ def plot_route(graph, path, color, label):
 # Connection to Neo4j
 graph = Graph("bolt://localhost:7687", auth=None)
 
-# Get all the streets for the Spinbox
+# Opt-in instrumentation: with ROUTING_METRICS=<path> every search and query is
+# logged and its totals are written to path in the Prometheus text format
+metrics_path = os.environ.get('ROUTING_METRICS')
+if metrics_path:
+    logging.basicConfig(level=logging.INFO)
+    instrumentation.enable(PrometheusExporter(metrics_path), LoggingExporter())
+    graph = InstrumentedGraph(graph)
+
+# Load the road network once, the searches reuse it until it is refreshed
+snapshot = RoadGraphSnapshot(graph)
+
+# Routes already computed by any of the searches, dropped when the importer bumps the graph version
+route_cache = RouteCache(graph)
+
+# Searches run on worker threads so the window stays responsive, one per engine
+# for side-by-side comparisons. running_jobs holds (start, end, {engine: (future, control)})
+search_pool = ThreadPoolExecutor(max_workers=len(search_styles))
+running_jobs = []
+
+# Road network reloads run on their own thread; pending_refresh is the future of
+# the (snapshot, street index, spatial index) being loaded, or None
+refresh_pool = ThreadPoolExecutor(max_workers=1)
+pending_refresh = None
+
+# Grid index over the intersections to snap "lat,lon" inputs
+spatial_index = GridIndex(snapshot)
+
+# Build the street name index once and get all the streets for the Spinbox
+street_index = StreetIndex.from_graph(graph)
 all_streets = get_street_suggestions(graph, '')
 
 # Create the main window
@@ -266,13 +250,14 @@ root.title("Graph Operations GUI")
 # Spinbox to select or enter the street name
 street_name_var = tk.StringVar()
 street_name_spinbox = Spinbox(root, values=all_streets, textvariable=street_name_var, wrap=True)
+street_name_spinbox.bind('<KeyRelease>', update_street_suggestions)
 street_name_spinbox.pack()
 
 # Button to search for nodes
 search_button = ttk.Button(root, text="Search Node", command=execute_find_street_nodes)
 search_button.pack()
 
-# Input fields for Dijkstra and A*
+# Input fields for Dijkstra and A*, node ids or "lat,lon" coordinates
 start_node_var = tk.StringVar()
 end_node_var = tk.StringVar()
 start_node_entry = ttk.Entry(root, textvariable=start_node_var)
@@ -285,10 +270,24 @@ astar_button = ttk.Button(root, text="Calculate A*", command=execute_astar)
 astar_button.pack()
 bfs_button = ttk.Button(root, text="Calculate BFS", command=execute_bfs)
 bfs_button.pack()
+compare_button = ttk.Button(root, text="Compare All", command=execute_compare)
+compare_button.pack()
+cancel_button = ttk.Button(root, text="Cancel", command=execute_cancel)
+cancel_button.pack()
+refresh_button = ttk.Button(root, text="Refresh Graph", command=execute_refresh_graph)
+refresh_button.pack()
+
+# Progress of the running searches
+progress_var = tk.StringVar(value="No search running")
+progress_label = ttk.Label(root, textvariable=progress_var)
+progress_label.pack()
 
 # Text area for results
 result_text = tk.Text(root, height=10, width=50)
 result_text.pack()
 
 # Run the application
+root.protocol("WM_DELETE_WINDOW", close_window)
+root.after(100, poll_searches)
+print(f"GUI ready in {time.perf_counter() - startup_time:.2f} s ({len(street_index)} street names)")
 root.mainloop()
\ No newline at end of file
@@ -0,0 +1,158 @@
+import re
+import numpy as np
+
+# Edge costs other than ROAD_SEGMENT.length: travel times in seconds derived from
+# the max_speed, highway and lanes properties the importer stores on every
+# segment. Weights are named by strings, which the engines and the route cache
+# take as weight=:
+#   'length'    meters (the default)
+#   'time'      seconds at free-flow speed
+#   'time@H'    seconds at hour H (0-23) of the time-of-day speed profiles
+
+# Speed in km/h of every highway class when a segment has no usable max_speed
+DEFAULT_SPEEDS = {
+    'motorway': 120,
+    'motorway_link': 60,
+    'trunk': 100,
+    'trunk_link': 50,
+    'primary': 50,
+    'primary_link': 40,
+    'secondary': 50,
+    'secondary_link': 40,
+    'tertiary': 40,
+    'tertiary_link': 30,
+    'unclassified': 40,
+    'residential': 30,
+    'living_street': 20,
+    'service': 20,
+}
+# Speed of segments whose highway class is missing or not in DEFAULT_SPEEDS
+UNKNOWN_SPEED = 30
+# Highest speed limit taken into account; it bounds the speed of any segment for
+# the A* heuristics of the database searches, which do not know the edges in advance
+MAX_SPEED = 130
+
+# Highway class of an edge as a small integer: its position in DEFAULT_SPEEDS,
+# UNKNOWN_CLASS for anything else
+highway_types = list(DEFAULT_SPEEDS)
+UNKNOWN_CLASS = len(highway_types)
+
+# Share of the speed limit driven on average, by number of lanes (3 or more: 1.0)
+LANE_FACTORS = {1: 0.8, 2: 0.9}
+UNKNOWN_LANES_FACTOR = 0.85
+
+# Hourly speed factors (0:00 to 23:00) of the time-of-day weights: main roads
+# slow down more in the rush hours than local streets
+_ARTERIAL_PROFILE = [1.0] * 7 + [0.6, 0.5, 0.65] + [0.85] * 7 + [0.6, 0.55, 0.7] + [0.9, 0.95, 1.0, 1.0]
+_LOCAL_PROFILE = [1.0] * 7 + [0.85, 0.8, 0.9] + [0.95] * 7 + [0.85, 0.85, 0.9] + [1.0] * 4
+SPEED_PROFILES = {highway: _ARTERIAL_PROFILE if highway.split('_')[0] in ('motorway', 'trunk', 'primary', 'secondary', 'tertiary')
+                  else _LOCAL_PROFILE for highway in highway_types}
+
+_KMH_PER_MPH = 1.609344
+_number = re.compile(r'\d+(\.\d+)?')
+
+# Speed limit in km/h of an OSM maxspeed value ('50', '30 mph', ['30', '50']), or
+# None when it is missing or symbolic ('ES:urban', 'signals'). Of a list the
+# lowest limit is used
+def parse_max_speed(value):
+    if isinstance(value, (list, tuple)):
+        speeds = [speed for speed in (parse_max_speed(item) for item in value) if speed is not None]
+        return min(speeds) if speeds else None
+    if value is None or value != value:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value) if value > 0 else None
+    match = _number.search(str(value))
+    if match is None or float(match.group()) <= 0:
+        return None
+    return float(match.group()) * (_KMH_PER_MPH if 'mph' in str(value) else 1)
+
+# Number of lanes of an OSM lanes value ('2', 2, ['1', '2'], '2;3'), or None. Of
+# several values the highest is used
+def parse_lanes(value):
+    if isinstance(value, (list, tuple)):
+        lanes = [count for count in (parse_lanes(item) for item in value) if count is not None]
+        return max(lanes) if lanes else None
+    if value is None or value != value:
+        return None
+    counts = [int(float(part)) for part in re.split(r'[;|]', str(value)) if _number.fullmatch(part.strip())]
+    return max(counts) if counts else None
+
+# Highway class index of an OSM highway value (the first known class of a list)
+def highway_class(value):
+    for highway in value if isinstance(value, (list, tuple)) else [value]:
+        if highway in DEFAULT_SPEEDS:
+            return highway_types.index(highway)
+    return UNKNOWN_CLASS
+
+# (free-flow speed in km/h, highway class index) of a segment
+def free_flow_speed(max_speed, highway, lanes):
+    klass = highway_class(highway)
+    limit = parse_max_speed(max_speed)
+    if limit is None:
+        limit = DEFAULT_SPEEDS[highway_types[klass]] if klass != UNKNOWN_CLASS else UNKNOWN_SPEED
+    limit = min(limit, MAX_SPEED)
+    count = parse_lanes(lanes)
+    factor = UNKNOWN_LANES_FACTOR if count is None else LANE_FACTORS.get(count, 1.0)
+    return limit * factor, klass
+
+def _hashable(values):
+    return tuple(tuple(value) if isinstance(value, list) else value for value in values)
+
+# free_flow_speed of many segments from a list of (max_speed, highway, lanes)
+# tuples, as (speeds, classes) NumPy arrays; an empty tuple stands for a segment
+# without attributes. Segments share few combinations, each one is parsed once
+def free_flow_speeds(attributes):
+    keys = {}
+    try:
+        ids = [keys.setdefault(values, len(keys)) for values in attributes]
+    except TypeError:
+        # Lists (OSM values of merged ways) cannot be keys
+        keys = {}
+        ids = [keys.setdefault(_hashable(values), len(keys)) for values in attributes]
+    parsed = [free_flow_speed(*(values or (None, None, None))) for values in keys]
+    ids = np.array(ids, dtype=np.int64)
+    speeds = np.array([speed for speed, _ in parsed], dtype=np.float64).reshape(-1)
+    classes = np.array([klass for _, klass in parsed], dtype=np.int8).reshape(-1)
+    return speeds[ids], classes[ids]
+
+# Hour of a weight name: None for 'length' and 'time', H for 'time@H'
+def parse_weight(weight):
+    if weight in ('length', 'time'):
+        return None
+    kind, _, hour = str(weight).partition('@')
+    if kind == 'time' and hour.isdigit() and 0 <= int(hour) < 24:
+        return int(hour)
+    raise ValueError(f"Unknown weight '{weight}', expected 'length', 'time' or 'time@H' with H from 0 to 23")
+
+def _profile(klass):
+    return SPEED_PROFILES[highway_types[klass]] if klass != UNKNOWN_CLASS else _LOCAL_PROFILE
+
+# Speed factor of every highway class index at an hour (1.0 for free flow)
+def speed_factors(hour=None):
+    if hour is None:
+        return np.ones(UNKNOWN_CLASS + 1)
+    return np.array([_profile(klass)[hour] for klass in range(UNKNOWN_CLASS + 1)])
+
+# Travel times in seconds of all the edges at once, from their lengths in meters,
+# free-flow speeds in km/h and highway class indices
+def travel_times(lengths, speeds, classes, hour=None):
+    speeds = np.asarray(speeds, dtype=np.float64) * speed_factors(hour)[np.asarray(classes, dtype=np.int64)]
+    return np.asarray(lengths, dtype=np.float64) * 3.6 / speeds
+
+# Cost of one segment for the searches that read the edges from the database
+def edge_cost(weight, length, max_speed, highway, lanes):
+    if weight == 'length':
+        return length
+    hour = parse_weight(weight)
+    speed, klass = free_flow_speed(max_speed, highway, lanes)
+    return length * 3.6 / (speed * (1.0 if hour is None else _profile(klass)[hour]))
+
+# Lower bound of the cost per meter of straight-line distance, for A* heuristics:
+# 1 for lengths, 1 / fastest edge speed (m/s) for travel times. Speed factors are
+# at most 1, so free-flow speeds bound every hour
+def cost_per_meter(weight, max_speed_kmh=MAX_SPEED):
+    if weight == 'length':
+        return 1.0
+    parse_weight(weight)
+    return 3.6 / max_speed_kmh